@@ -0,0 +1,69 @@
+import asyncio
+import time
+
+from vpn_cache import CacheEntry, HttpCache, parse_cache_control
+from vpn_relay import LocalProxyServer
+
+
+def entry(cache_control, age):
+    return CacheEntry('http://example.com/', 200, 'OK', [('Cache-Control', cache_control)], {},
+                      time.time() - age, body=b"ok", size=2)
+
+
+def satisfies(stored, request_cache_control):
+    return stored.satisfies(parse_cache_control(request_cache_control), time.time())
+
+
+def test_request_cache_control_forces_revalidation():
+    fresh = entry('max-age=600', 100)
+    assert satisfies(fresh, None)
+    assert not satisfies(fresh, 'max-age=0')
+    assert not satisfies(fresh, 'no-cache')
+    assert not satisfies(fresh, 'max-age=60')
+    assert satisfies(fresh, 'max-age=3600')
+    assert not satisfies(fresh, 'min-fresh=600')
+    assert satisfies(fresh, 'min-fresh=60')
+
+
+def test_max_stale_accepts_stale_entries():
+    stale = entry('max-age=60', 100)
+    assert not satisfies(stale, None)
+    assert satisfies(stale, 'max-stale')
+    assert satisfies(stale, 'max-stale=60')
+    assert not satisfies(stale, 'max-stale=10')
+    assert not satisfies(entry('max-age=60, must-revalidate', 100), 'max-stale')
+
+
+def test_reload_goes_back_to_the_origin():
+    requests = []
+
+    async def origin(reader, writer):
+        requests.append(await reader.readuntil(b"\r\n\r\n"))
+        writer.write(b"HTTP/1.1 200 OK\r\nCache-Control: max-age=600\r\n"
+                     b"Content-Length: 2\r\n\r\nok")
+        await writer.drain()
+        writer.close()
+
+    async def get(port, url, extra=""):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(f"GET {url} HTTP/1.1\r\nHost: example{extra}\r\n\r\n".encode())
+        response = await asyncio.wait_for(reader.read(), 5)
+        writer.close()
+        return [line.split(b": ")[1] for line in response.split(b"\r\n")
+                if line.startswith(b"X-Cache: ")][0]
+
+    async def run():
+        origin_server = await asyncio.start_server(origin, '127.0.0.1', 0)
+        proxy = await LocalProxyServer(port=0, cache=HttpCache()).start()
+        url = f"http://127.0.0.1:{origin_server.sockets[0].getsockname()[1]}/page"
+        try:
+            assert await get(proxy.port, url) == b"MISS"
+            assert await get(proxy.port, url) == b"HIT"
+            assert await get(proxy.port, url, "\r\nCache-Control: max-age=0") != b"HIT"
+            assert await get(proxy.port, url, "\r\nPragma: no-cache") != b"HIT"
+            assert len(requests) == 3
+        finally:
+            await proxy.stop()
+            origin_server.close()
+
+    asyncio.run(run())
@@ -0,0 +1,22 @@
+from vpn_cluster import ClusterNode
+from vpn_probe import ProbeScheduler
+
+CATALOG = {'us': {'proxies': [{'host': '10.0.0.1', 'port': 80, 'type': 'http'}]}}
+
+
+def make_node(node_id):
+    prober = ProbeScheduler(CATALOG)
+    prober.sync_catalog()
+    return ClusterNode(prober, node_id, '127.0.0.1', 0, secret='shared')
+
+
+def test_replay_from_another_address_is_rejected():
+    receiver, sender = make_node('a'), make_node('b')
+    key = next(iter(receiver.prober.health))
+    packet = sender.encode([[key, 1, 50, '1.2.3.4', 'US', 5, 0, None, None]])
+
+    receiver.handle_packet(packet, ('127.0.0.1', 1000))
+    assert receiver.stats['merged'] == 1
+    receiver.handle_packet(packet, ('127.0.0.2', 2000))
+    assert receiver.stats['rejected'] == 1
+    assert receiver.stats['merged'] == 1
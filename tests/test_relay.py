@@ -0,0 +1,47 @@
+import asyncio
+import struct
+
+from vpn_relay import LocalProxyServer, MemoryBudget
+
+
+def test_stop_with_live_connection():
+    async def echo(reader, writer):
+        while True:
+            data = await reader.read(1024)
+            if not data:
+                break
+            writer.write(data)
+        writer.close()
+
+    async def run():
+        origin = await asyncio.start_server(echo, '127.0.0.1', 0)
+        proxy = await LocalProxyServer(port=0).start()
+        reader, writer = await asyncio.open_connection('127.0.0.1', proxy.port)
+        writer.write(f"CONNECT 127.0.0.1:{origin.sockets[0].getsockname()[1]} HTTP/1.1"
+                     f"\r\n\r\n".encode())
+        assert b" 200 " in await reader.readuntil(b"\r\n\r\n")
+
+        await asyncio.wait_for(proxy.stop(), 5)
+        assert await asyncio.wait_for(reader.read(), 5) == b""
+        assert proxy.active_connections == 0
+        writer.close()
+        origin.close()
+
+    asyncio.run(run())
+
+
+def test_budget_refuses_socks5_with_socks_failure():
+    async def run():
+        proxy = await LocalProxyServer(port=0, memory_budget=MemoryBudget(0)).start()
+        try:
+            reader, writer = await asyncio.open_connection('127.0.0.1', proxy.port)
+            writer.write(b"\x05\x01\x00")
+            assert await reader.readexactly(2) == b"\x05\x00"
+            writer.write(b"\x05\x01\x00\x01\x7f\x00\x00\x01" + struct.pack("!H", 80))
+            reply = await asyncio.wait_for(reader.read(), 5)
+            assert reply[:2] == b"\x05\x01"
+            writer.close()
+        finally:
+            await proxy.stop()
+
+    asyncio.run(run())
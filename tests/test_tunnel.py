@@ -0,0 +1,67 @@
+import asyncio
+import os
+
+from vpn_tunnel import (FRAME_DATA, INITIAL_WINDOW, FrameCodec, MuxConnection, MuxStream,
+                        TunnelClient, TunnelExitNode)
+
+
+async def start_tunnel(origin):
+    origin_server = await asyncio.start_server(origin, '127.0.0.1', 0)
+    node = await TunnelExitNode('127.0.0.1', 0, allow_private=True).start()
+    client = TunnelClient('127.0.0.1', node.port)
+    return origin_server, node, client
+
+
+def test_readexactly_larger_than_window():
+    payload = os.urandom(5 * 1024 * 1024)
+
+    async def origin(reader, writer):
+        writer.write(payload + b"END\r\n\r\n")
+        await writer.drain()
+        writer.close()
+
+    async def run():
+        origin_server, node, client = await start_tunnel(origin)
+        try:
+            reader, _ = await client.open_connection(
+                '127.0.0.1', origin_server.sockets[0].getsockname()[1])
+            assert await asyncio.wait_for(reader.readexactly(len(payload)), 10) == payload
+            assert await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 10) == b"END\r\n\r\n"
+        finally:
+            await client.close()
+            await node.stop()
+            origin_server.close()
+
+    asyncio.run(run())
+
+
+def test_window_overrun_resets_stream():
+    class Sink:
+        def __init__(self):
+            self.data = b""
+
+        def write(self, data):
+            self.data += data
+
+        def close(self):
+            pass
+
+    async def run():
+        mux = MuxConnection(None, Sink(), FrameCodec())
+        stream = MuxStream(mux, 1)
+        assert mux.register(stream)
+        mux.dispatch(FRAME_DATA, 1, b"x" * INITIAL_WINDOW)
+        assert 1 in mux.streams
+        # Nothing was read, so no window was granted back; one more byte overruns it
+        mux.dispatch(FRAME_DATA, 1, b"x")
+        assert 1 not in mux.streams
+        assert mux.writer.data
+        assert len(await stream.reader.read()) == INITIAL_WINDOW  # Already buffered
+        try:
+            await stream.reader.read()
+        except ConnectionResetError:
+            pass
+        else:
+            raise AssertionError("reader of a reset stream did not fail")
+
+    asyncio.run(run())
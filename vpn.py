@@ -7,6 +7,8 @@ GitHub: https://github.com/Jabsama/FREE-VPN
 
 import sys
 import os
+import argparse
+import asyncio
 import json
 import time
 import threading
@@ -14,11 +16,14 @@ import subprocess
 import requests
 import socket
 import random
+from urllib.parse import urlparse
 from datetime import datetime
 from pathlib import Path
 
 # Import autonomous VPN module
 from vpn_core import AutonomousVPN
+from vpn_assets import CachedResponse, JsonResponseCache
+from vpn_trace import sample_profile
 
 try:
     from flask import Flask, request, jsonify, render_template_string
@@ -35,6 +40,99 @@ VPN_CONFIG = {
     "port": 8080,
     "autonomous": True,
     "no_openvpn_required": True,
+    # Hosts matching these rules bypass the VPN (domain suffix, *.wildcard, CIDR, <local>)
+    "split_tunnel": [
+        "<local>",
+        "localhost",
+        "127.0.0.0/8",
+        "10.0.0.0/8",
+        "172.16.0.0/12",
+        "192.168.0.0/16",
+        "::1/128",
+        "fe80::/10"
+    ],
+    # Record relay stage timings from startup (can also be toggled via /api/admin/trace)
+    "tracing": False,
+    "max_profile_seconds": 60,
+    # Relay buffering: per-direction watermarks and a memory budget across all connections;
+    # clients are turned away (503 or SOCKS5 failure) once admitting them could exceed the
+    # budget. Each connection reserves its worst case (1 MB at these watermarks) and each
+    # tunnel stream its 256 KB window, so 256 MB admits about 250 concurrent connections
+    "relay": {
+        "high_water_kb": 64,
+        "low_water_kb": 16,
+        "memory_budget_mb": 256
+    },
+    # Linux only: also accept iptables/nftables-REDIRECTed TCP on this port (see README)
+    "transparent": {
+        "enabled": False,
+        "host": "0.0.0.0",
+        "port": 9998
+    },
+    # Relay timeouts in seconds per connection phase (null disables one); all connections
+    # share one timing wheel, so idle ones are reaped in bulk
+    "relay_timeouts": {
+        "handshake": 15,
+        "connect": 10,
+        "idle": 300,
+        "lifetime": None
+    },
+    # Warm the session's most-used destinations: pre-open tunnels through the upstream
+    # (bypassed hosts are only pre-resolved) so new connections skip the setup round trip.
+    # Opt-in: warm tunnels are speculative traffic and hold memory budget while idle
+    "preconnect": {
+        "enabled": False,
+        "top_n": 8,
+        "max_idle": 8,
+        "ttl": 20,
+        "min_score": 2.0,
+        "dials_per_minute": 30
+    },
+    # Share proxy health with other FREE-VPN gateways over UDP gossip (needs "probe");
+    # peers are "host:port" seeds, and all nodes must share a secret unless host is 127.0.0.1
+    "cluster": {
+        "enabled": False,
+        "node_id": None,
+        "host": "0.0.0.0",
+        "port": 7946,
+        "peers": [],
+        "secret": None,
+        "interval": 2.0,
+        "fanout": 2,
+        "max_message": 1200
+    },
+    # Multi-hop servers: traffic enters the first region and exits from the last
+    "chains": {
+        "nl-us": ["nl", "us"]
+    },
+    # Connecting while connected switches live; open connections keep the old upstream this long
+    "switch_grace_seconds": 30,
+    # Optional cache for plain-HTTP responses passing through the local proxy
+    "http_cache": {
+        "enabled": False,
+        "memory_mb": 32,
+        "disk_dir": str(Path.home() / ".free-vpn" / "http-cache"),
+        "disk_mb": 512
+    },
+    # GeoIP database (.mmdb or range file) used to verify where proxies really exit
+    "geoip_database": str(Path.home() / ".free-vpn" / "GeoLite2-Country.mmdb"),
+    # Background proxy health checks; connect picks from proxies already known to be good
+    "probe": {
+        "enabled": True,
+        "base_interval": 300,
+        "fast_interval": 60,
+        "max_backoff": 3600,
+        "max_concurrency": 4,
+        "bandwidth_bps": 16384,
+        # Throughput tests through alive proxies; set to None to disable
+        "speed_test": {
+            "url": "http://speed.cloudflare.com/__down?bytes={bytes}",
+            "payload_bytes": 2097152,
+            "max_seconds": 8,
+            "interval": 3600,
+            "hourly_budget_bytes": 67108864
+        }
+    },
     "servers": [
         {
             "id": "us",
@@ -43,7 +141,7 @@ VPN_CONFIG = {
             "flag": "🇺🇸",
             "host": "us-proxy.free-vpn.net",
             "port": 8080,
-            "speed": "100 Mbps",
+            "speed": "Untested",
             "load": "Low"
         },
         {
@@ -53,7 +151,7 @@ VPN_CONFIG = {
             "flag": "🇬🇧",
             "host": "uk-proxy.free-vpn.net",
             "port": 8080,
-            "speed": "100 Mbps",
+            "speed": "Untested",
             "load": "Low"
         },
         {
@@ -63,7 +161,7 @@ VPN_CONFIG = {
             "flag": "🇩🇪",
             "host": "de-proxy.free-vpn.net",
             "port": 8080,
-            "speed": "100 Mbps",
+            "speed": "Untested",
             "load": "Medium"
         },
         {
@@ -73,7 +171,7 @@ VPN_CONFIG = {
             "flag": "🇳🇱", 
             "host": "nl-proxy.free-vpn.net",
             "port": 8080,
-            "speed": "100 Mbps",
+            "speed": "Untested",
             "load": "Low"
         },
         {
@@ -83,7 +181,7 @@ VPN_CONFIG = {
             "flag": "🇨🇦",
             "host": "ca-proxy.free-vpn.net", 
             "port": 8080,
-            "speed": "100 Mbps",
+            "speed": "Untested",
             "load": "Medium"
         },
         {
@@ -93,68 +191,14 @@ VPN_CONFIG = {
             "flag": "🇯🇵",
             "host": "jp-proxy.free-vpn.net",
             "port": 8080,
-            "speed": "100 Mbps",
+            "speed": "Untested",
             "load": "Low"
         }
     ]
 }
 
-# Flask Web Interface (if Flask is available)
-if FLASK_AVAILABLE:
-    app = Flask(__name__)
-    CORS(app)
-    vpn_core = AutonomousVPN()
-    
-    @app.route('/api/status', methods=['GET'])
-    def api_status():
-        """Get VPN status"""
-        status = vpn_core.status()
-        status["servers"] = VPN_CONFIG['servers']
-        return jsonify(status)
-    
-    @app.route('/api/servers', methods=['GET'])
-    def api_servers():
-        """Get available servers"""
-        return jsonify({
-            "servers": VPN_CONFIG['servers'],
-            "total": len(VPN_CONFIG['servers']),
-            "timestamp": datetime.now().isoformat()
-        })
-    
-    @app.route('/api/connect/<server_id>', methods=['POST'])
-    def api_connect(server_id):
-        """Connect to server"""
-        success, message = vpn_core.connect(server_id)
-        return jsonify({
-            "success": success,
-            "message": message,
-            "server": vpn_core.current_server,
-            "timestamp": datetime.now().isoformat()
-        })
-    
-    @app.route('/api/disconnect', methods=['POST'])
-    def api_disconnect():
-        """Disconnect VPN"""
-        success, message = vpn_core.disconnect()
-        return jsonify({
-            "success": success,
-            "message": message,
-            "timestamp": datetime.now().isoformat()
-        })
-    
-    @app.route('/api/health', methods=['GET'])
-    def api_health():
-        """Health check"""
-        return jsonify({
-            "status": "healthy",
-            "version": VPN_CONFIG['version'],
-            "timestamp": datetime.now().isoformat()
-        })
-    
-    @app.route('/')
-    def dashboard():
-        """Main dashboard"""
-        return render_template_string('''
+# Dashboard page; rendered and compressed once at startup
+DASHBOARD_TEMPLATE = '''
 <!DOCTYPE html>
 <html lang="en">
 <head>
@@ -366,7 +410,8 @@ if FLASK_AVAILABLE:
                     `;
                 }
                 
-                updateServerButtons(data.connected || isConnecting);
+                // Connecting while connected switches servers live
+                updateServerButtons(isConnecting);
                 
             } catch (error) {
                 document.getElementById('status-text').innerHTML = `❌ Error: ${error.message}`;
@@ -472,12 +517,322 @@ if FLASK_AVAILABLE:
     </script>
 </body>
 </html>
-        ''')
+'''
+
+# Flask Web Interface (if Flask is available)
+if FLASK_AVAILABLE:
+    app = Flask(__name__)
+    # Admin endpoints stay out of CORS so other sites' pages cannot read them
+    CORS(app, resources={r"^(?!/api/admin/).*": {}})
+    vpn_core = AutonomousVPN()
+    vpn_core.set_split_tunnel_rules(VPN_CONFIG['split_tunnel'])
+    vpn_core.set_relay_limits(**VPN_CONFIG['relay'])
+    vpn_core.set_relay_timeouts(**VPN_CONFIG['relay_timeouts'])
+    vpn_core.set_preconnect(**VPN_CONFIG['preconnect'])
+    vpn_core.switch_grace = VPN_CONFIG['switch_grace_seconds']
+    if VPN_CONFIG['transparent']['enabled']:
+        vpn_core.enable_transparent_mode(VPN_CONFIG['transparent']['host'],
+                                         VPN_CONFIG['transparent']['port'])
+    
+    # Precompile and precompress static assets once instead of per request
+    with app.app_context():
+        DASHBOARD_ASSET = CachedResponse(render_template_string(DASHBOARD_TEMPLATE),
+                                         'text/html; charset=utf-8')
+    WIDGET_PATH = Path(__file__).with_name('vpn_widget.js')
+    WIDGET_ASSET = (CachedResponse(WIDGET_PATH.read_text(encoding='utf-8'),
+                                   'application/javascript; charset=utf-8',
+                                   'public, max-age=3600')
+                    if WIDGET_PATH.exists() else None)
+    json_responses = JsonResponseCache()
+    pac_responses = {}
+    
+    def send_cached(cached):
+        """Serve a precompressed response, answering conditional requests with 304"""
+        status, body, headers = cached.respond(request.headers.get('If-None-Match'),
+                                               request.headers.get('Accept-Encoding'))
+        return app.response_class(body, status=status, headers=headers)
+    if VPN_CONFIG['http_cache']['enabled']:
+        vpn_core.enable_http_cache(VPN_CONFIG['http_cache']['memory_mb'],
+                                   VPN_CONFIG['http_cache']['disk_dir'],
+                                   VPN_CONFIG['http_cache']['disk_mb'])
+    
+    @app.route('/api/status', methods=['GET'])
+    def api_status():
+        """Get VPN status"""
+        status = vpn_core.status()
+        status["servers"] = servers_with_measurements()
+        return jsonify(status)
+    
+    def servers_with_measurements():
+        """Server list with measured throughput in place of the static speed"""
+        servers = []
+        for server in VPN_CONFIG['servers']:
+            server = dict(server)
+            if vpn_core.prober is not None:
+                server['speed'] = vpn_core.get_server_speed(server['id'])
+            servers.append(server)
+        return servers
+    
+    @app.route('/api/servers', methods=['GET'])
+    def api_servers():
+        """Get available servers"""
+        version = (vpn_core.state_version, vpn_core.prober.version if vpn_core.prober else 0)
+        return send_cached(json_responses.get('servers', version, lambda: {
+            "servers": servers_with_measurements(),
+            "total": len(VPN_CONFIG['servers'])
+        }))
+    
+    @app.route('/api/connect/<server_id>', methods=['POST'])
+    def api_connect(server_id):
+        """Connect to server"""
+        success, message = vpn_core.connect(server_id)
+        return jsonify({
+            "success": success,
+            "message": message,
+            "server": vpn_core.current_server,
+            "timestamp": datetime.now().isoformat()
+        })
+    
+    @app.route('/api/disconnect', methods=['POST'])
+    def api_disconnect():
+        """Disconnect VPN"""
+        success, message = vpn_core.disconnect()
+        return jsonify({
+            "success": success,
+            "message": message,
+            "timestamp": datetime.now().isoformat()
+        })
+    
+    @app.route('/api/split-tunnel', methods=['GET'])
+    def api_split_tunnel():
+        """Get split-tunnel bypass rules"""
+        return send_cached(json_responses.get('split-tunnel', vpn_core.state_version, lambda: {
+            "rules": VPN_CONFIG['split_tunnel'],
+            "pac_url": "/proxy.pac"
+        }))
+    
+    @app.route('/api/split-tunnel', methods=['POST'])
+    def api_split_tunnel_update():
+        """Replace split-tunnel bypass rules"""
+        data = request.get_json(silent=True) or {}
+        rules = data.get('rules')
+        if not isinstance(rules, list) or not all(isinstance(rule, str) for rule in rules):
+            return jsonify({
+                "success": False,
+                "message": "Expected JSON body: {\"rules\": [\"example.com\", \"10.0.0.0/8\"]}",
+                "timestamp": datetime.now().isoformat()
+            }), 400
+        
+        VPN_CONFIG['split_tunnel'] = rules
+        vpn_core.set_split_tunnel_rules(rules)
+        return jsonify({
+            "success": True,
+            "rules": rules,
+            "timestamp": datetime.now().isoformat()
+        })
+    
+    @app.route('/api/cache', methods=['GET'])
+    def api_cache():
+        """Get HTTP cache statistics"""
+        cache = vpn_core.http_cache
+        return jsonify({
+            "enabled": cache is not None,
+            "stats": cache.get_stats() if cache else None,
+            "timestamp": datetime.now().isoformat()
+        })
+    
+    @app.route('/api/relay', methods=['GET'])
+    def api_relay():
+        """Get local proxy connection and memory budget statistics"""
+        return jsonify({
+            "stats": vpn_core.get_relay_stats(),
+            "timestamp": datetime.now().isoformat()
+        })
+    
+    @app.route('/api/cluster', methods=['GET'])
+    def api_cluster():
+        """Get cluster gossip peers and counters"""
+        stats = vpn_core.get_cluster_status()
+        return jsonify({
+            "enabled": stats is not None,
+            "stats": stats,
+            "timestamp": datetime.now().isoformat()
+        })
+    
+    @app.route('/api/proxy-health', methods=['GET'])
+    def api_proxy_health():
+        """Get background health-check results for catalog proxies"""
+        server_id = request.args.get('server')
+        return jsonify({
+            "proxies": vpn_core.get_proxy_health(server_id),
+            "probing": vpn_core.prober is not None,
+            "timestamp": datetime.now().isoformat()
+        })
+    
+    def admin_allowed():
+        """Admin endpoints are only served to the local machine, and not to other sites' pages"""
+        if request.remote_addr not in ('127.0.0.1', '::1'):
+            return False
+        origin = request.headers.get('Origin')
+        return origin is None or urlparse(origin).netloc == request.host
+    
+    @app.route('/api/admin/trace', methods=['GET'])
+    def api_admin_trace():
+        """Export relay trace events (Chrome trace JSON); ?clear=1 empties the buffer"""
+        if not admin_allowed():
+            return jsonify({"error": "Admin endpoints are local-only"}), 403
+        trace = vpn_core.tracer.export()
+        if request.args.get('clear') == '1':
+            vpn_core.tracer.clear()
+        return jsonify(trace)
+    
+    @app.route('/api/admin/trace', methods=['POST'])
+    def api_admin_trace_toggle():
+        """Enable or disable relay tracing"""
+        if not admin_allowed():
+            return jsonify({"error": "Admin endpoints are local-only"}), 403
+        data = request.get_json(silent=True) or {}
+        enabled = vpn_core.set_tracing(data.get('enabled', True))
+        return jsonify({
+            "success": True,
+            "tracing": enabled,
+            "timestamp": datetime.now().isoformat()
+        })
+    
+    @app.route('/api/admin/profile', methods=['GET'])
+    def api_admin_profile():
+        """Sample all threads for N seconds and return a collapsed-stack flamegraph file"""
+        if not admin_allowed():
+            return jsonify({"error": "Admin endpoints are local-only"}), 403
+        try:
+            seconds = float(request.args.get('seconds', 10))
+        except ValueError:
+            return jsonify({"error": "seconds must be a number"}), 400
+        seconds = max(0.1, min(seconds, VPN_CONFIG['max_profile_seconds']))
+        
+        collapsed = sample_profile(seconds)
+        filename = f"free-vpn-{datetime.now().strftime('%Y%m%d-%H%M%S')}.collapsed"
+        return app.response_class(collapsed, mimetype='text/plain', headers={
+            "Content-Disposition": f"attachment; filename={filename}"
+        })
+    
+    @app.route('/proxy.pac', methods=['GET'])
+    def proxy_pac():
+        """Proxy auto-config for browsers"""
+        version = vpn_core.state_version
+        cached = pac_responses.get(version)
+        if cached is None:
+            cached = CachedResponse(vpn_core.get_proxy_pac(), 'application/x-ns-proxy-autoconfig')
+            pac_responses.clear()
+            pac_responses[version] = cached
+        return send_cached(cached)
+    
+    @app.route('/vpn_widget.js', methods=['GET'])
+    def widget_js():
+        """Embeddable VPN widget script"""
+        if WIDGET_ASSET is None:
+            return jsonify({"error": "vpn_widget.js not found"}), 404
+        return send_cached(WIDGET_ASSET)
+    
+    @app.route('/api/health', methods=['GET'])
+    def api_health():
+        """Health check"""
+        return jsonify({
+            "status": "healthy",
+            "version": VPN_CONFIG['version'],
+            "timestamp": datetime.now().isoformat()
+        })
+    
+    @app.route('/')
+    def dashboard():
+        """Main dashboard"""
+        return send_cached(DASHBOARD_ASSET)
+
+def parse_args(argv=None):
+    """Parse command-line options"""
+    parser = argparse.ArgumentParser(description="FREE VPN - Open Source VPN Solution")
+    parser.add_argument('--exit-node', action='store_true',
+                        help="Run as a tunnel exit node for other FREE-VPN instances")
+    parser.add_argument('--tunnel-host', default='0.0.0.0',
+                        help="Exit node listen address (default: 0.0.0.0; anything but "
+                             "127.0.0.1 requires --tunnel-key)")
+    parser.add_argument('--tunnel-port', type=int, default=8443,
+                        help="Exit node listen port (default: 8443)")
+    parser.add_argument('--tunnel', metavar='HOST:PORT',
+                        help="Use a FREE-VPN exit node as the 'tunnel' server")
+    parser.add_argument('--tunnel-key', default=os.environ.get('FREE_VPN_TUNNEL_KEY'),
+                        help="Shared tunnel key; enables encryption (needs cryptography)")
+    parser.add_argument('--geoip', default=os.environ.get('FREE_VPN_GEOIP',
+                                                          VPN_CONFIG['geoip_database']),
+                        help="GeoIP database (.mmdb or range file) for exit IP verification")
+    parser.add_argument('--cluster-port', type=int,
+                        help="Enable cluster mode, gossiping proxy health on this UDP port")
+    parser.add_argument('--cluster-peer', action='append', metavar='HOST:PORT',
+                        help="Seed peer for cluster gossip (repeatable)")
+    parser.add_argument('--cluster-secret', default=os.environ.get('FREE_VPN_CLUSTER_SECRET'),
+                        help="Shared secret authenticating cluster gossip")
+    return parser.parse_args(argv)
+
+def register_tunnel_server(vpn, tunnel, key=None):
+    """Expose a FREE-VPN exit node (HOST:PORT) as the 'tunnel' server"""
+    host, _, port = tunnel.rpartition(':')
+    
+    if not any(server['id'] == 'tunnel' for server in VPN_CONFIG['servers']):
+        VPN_CONFIG['servers'].append({
+            "id": "tunnel",
+            "name": "FREE-VPN Exit Node",
+            "location": host,
+            "flag": "🛰️",
+            "host": host,
+            "port": int(port),
+            "speed": "Tunnel",
+            "load": "Low"
+        })
+    vpn.add_tunnel_exit('tunnel', host, int(port), key)
+
+def register_chain_servers(vpn):
+    """Expose the configured multi-hop chains as servers"""
+    for chain_id, regions in VPN_CONFIG['chains'].items():
+        success, name = vpn.add_chain(chain_id, regions)
+        if not success:
+            print(f"⚠️ Chain {chain_id} skipped: {name}")
+            continue
+        if not any(server['id'] == chain_id for server in VPN_CONFIG['servers']):
+            server = vpn.vpn_endpoints[chain_id]
+            VPN_CONFIG['servers'].append({
+                "id": chain_id,
+                "name": name,
+                "location": server['location'],
+                "flag": server['flag'],
+                "speed": "Untested",
+                "load": "Low"
+            })
+
+def run_exit_node(args):
+    """Run as a headless tunnel exit node"""
+    node = AutonomousVPN()
+    success, message = node.start_exit_node(args.tunnel_host, args.tunnel_port, args.tunnel_key)
+    print(f"{'✅' if success else '❌'} {message}")
+    if not success:
+        return
+    
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print("\n🔴 Shutting down exit node...")
 
 def main():
     """Main entry point"""
+    args = parse_args()
+    
     print("🛡️  FREE VPN - Open Source VPN Solution")
     print("=" * 60)
+    
+    if args.exit_node:
+        run_exit_node(args)
+        return
+    
     print(f"📍 Your current IP: {AutonomousVPN().get_ip()}")
     print()
     
@@ -490,6 +845,28 @@ def main():
         print("⚡ Press Ctrl+C to stop the server")
         print()
         
+        if args.tunnel:
+            register_tunnel_server(vpn_core, args.tunnel, args.tunnel_key)
+        register_chain_servers(vpn_core)
+        
+        if args.geoip and os.path.exists(args.geoip):
+            vpn_core.load_geoip(args.geoip)
+        
+        if VPN_CONFIG['probe']['enabled']:
+            probe_options = {k: v for k, v in VPN_CONFIG['probe'].items() if k != 'enabled'}
+            vpn_core.start_probe_scheduler(**probe_options)
+        
+        cluster_options = dict(VPN_CONFIG['cluster'])
+        if args.cluster_port:
+            cluster_options.update(enabled=True, port=args.cluster_port)
+        if args.cluster_peer:
+            cluster_options['peers'] = cluster_options['peers'] + args.cluster_peer
+        if args.cluster_secret:
+            cluster_options['secret'] = args.cluster_secret
+        if cluster_options.pop('enabled'):
+            success, message = vpn_core.start_cluster(**cluster_options)
+            print(f"{'🛰️ ' if success else '⚠️ '} {message}")
+        
         try:
             app.run(host='0.0.0.0', port=VPN_CONFIG['port'], debug=False)
         except KeyboardInterrupt:
@@ -501,6 +878,21 @@ def main():
         
         # Simple CLI interface
         vpn = AutonomousVPN()
+        vpn.set_split_tunnel_rules(VPN_CONFIG['split_tunnel'])
+        vpn.set_relay_limits(**VPN_CONFIG['relay'])
+        vpn.set_relay_timeouts(**VPN_CONFIG['relay_timeouts'])
+        vpn.set_preconnect(**VPN_CONFIG['preconnect'])
+        vpn.switch_grace = VPN_CONFIG['switch_grace_seconds']
+        if VPN_CONFIG['transparent']['enabled']:
+            vpn.enable_transparent_mode(VPN_CONFIG['transparent']['host'],
+                                        VPN_CONFIG['transparent']['port'])
+        if args.tunnel:
+            register_tunnel_server(vpn, args.tunnel, args.tunnel_key)
+        register_chain_servers(vpn)
+        
+        if VPN_CONFIG['probe']['enabled']:
+            probe_options = {k: v for k, v in VPN_CONFIG['probe'].items() if k != 'enabled'}
+            vpn.start_probe_scheduler(**probe_options)
         
         while True:
             print("\n🛡️  FREE VPN - CLI Mode")
@@ -524,9 +916,17 @@ def main():
                     print(f"{i}. {server['flag']} {server['name']} - {server['location']}")
                 
                 try:
-                    server_choice = int(input("\nSelect server (1-6): ")) - 1
+                    server_choice = int(input(f"\nSelect server (1-{len(VPN_CONFIG['servers'])}): ")) - 1
                     if 0 <= server_choice < len(VPN_CONFIG['servers']):
                         server_id = VPN_CONFIG['servers'][server_choice]['id']
+                        health = vpn.get_proxy_health(server_id)
+                        if vpn.prober and not any(h['last_checked'] for h in health):
+                            # Pick a proxy from real results, not before the first probe round
+                            print("🔍 Checking proxies...")
+                            try:
+                                vpn.probe(server_id)
+                            except asyncio.TimeoutError:
+                                print("⚠️  Proxy check timed out")
                         success, message = vpn.connect(server_id)
                         print(f"\n{'✅' if success else '❌'} {message}")
                     else:
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+VPN Assets Module - Precompressed, ETag-cached responses for the web interface
+Bodies are encoded once (gzip, and brotli when installed) and served by content
+negotiation; conditional requests are answered with 304 from the cached ETags alone
+"""
+
+import gzip
+import hashlib
+import json
+from datetime import datetime
+
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+# Compressing tiny bodies costs more than it saves
+MIN_COMPRESS_SIZE = 256
+
+
+def accepted_encodings(accept_encoding):
+    """Parse Accept-Encoding into {coding: q}"""
+    accepted = {}
+    for part in (accept_encoding or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding.lower()] = q
+    return accepted
+
+
+def etag_matches(if_none_match, etags):
+    """Weak comparison of an If-None-Match header against any of our ETags"""
+    if not if_none_match:
+        return False
+    if isinstance(etags, str):
+        etags = (etags,)
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == '*' or tag in etags:
+            return True
+    return False
+
+
+class CachedResponse:
+    """A response body precompressed once, with a strong content-hash ETag per encoding"""
+
+    def __init__(self, body, content_type, cache_control='no-cache'):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.content_type = content_type
+        self.cache_control = cache_control
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.encodings = {'identity': body}
+        if len(body) >= MIN_COMPRESS_SIZE:
+            self.encodings['gzip'] = gzip.compress(body, 9)
+            if BROTLI_AVAILABLE:
+                self.encodings['br'] = brotli.compress(body, quality=11)
+        # Each encoding is a different byte sequence, so each gets its own strong ETag
+        self.etags = {coding: f'"{digest}"' if coding == 'identity' else f'"{digest}-{coding}"'
+                      for coding in self.encodings}
+
+    def negotiate(self, accept_encoding):
+        """Pick the smallest encoding the client accepts"""
+        accepted = accepted_encodings(accept_encoding)
+        best = 'identity'
+        for coding, body in self.encodings.items():
+            if coding != 'identity' and accepted.get(coding, accepted.get('*', 0)) > 0:
+                if len(body) < len(self.encodings[best]):
+                    best = coding
+        return best
+
+    def respond(self, if_none_match=None, accept_encoding=None):
+        """Return (status, body, headers) for a request"""
+        coding = self.negotiate(accept_encoding)
+        headers = {
+            'ETag': self.etags[coding],
+            'Cache-Control': self.cache_control,
+            'Vary': 'Accept-Encoding',
+        }
+        # Any encoding's ETag validates: they all carry the same content
+        if etag_matches(if_none_match, self.etags.values()):
+            return 304, b'', headers
+
+        headers['Content-Type'] = self.content_type
+        if coding != 'identity':
+            headers['Content-Encoding'] = coding
+        return 200, self.encodings[coding], headers
+
+
+class JsonResponseCache:
+    """Serialized JSON responses memoized until the state version they were built from changes"""
+
+    def __init__(self):
+        self.entries = {}
+
+    def get(self, name, version, build):
+        """Cached response for name at version, calling build() only on a version change"""
+        entry = self.entries.get(name)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+
+        payload = build()
+        payload.setdefault('timestamp', datetime.now().isoformat())
+        response = CachedResponse(json.dumps(payload, ensure_ascii=False),
+                                  'application/json')
+        self.entries[name] = (version, response)
+        return response
@@ -0,0 +1,541 @@
+#!/usr/bin/env python3
+"""
+VPN Cache Module - Two-tier HTTP response cache for the local proxy
+Hot small objects live in a size-bounded memory LRU, larger ones on disk (read via mmap);
+freshness follows Cache-Control / Expires / Last-Modified and stale entries are
+revalidated with the origin through the upstream using ETag / Last-Modified
+"""
+
+import asyncio
+import json
+import mmap
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+
+from vpn_assets import etag_matches
+from vpn_relay import close_writer, log_event
+from vpn_timer import touch
+
+CACHEABLE_STATUS = {200, 203, 300, 301, 404, 410}
+HOP_BY_HOP = {'connection', 'keep-alive', 'proxy-connection', 'proxy-authenticate',
+              'proxy-authorization', 'te', 'trailer', 'transfer-encoding', 'upgrade'}
+HEURISTIC_MAX = 24 * 3600
+CHUNK = 64 * 1024
+
+
+def parse_cache_control(value):
+    """Parse a Cache-Control header into {directive: value or True}"""
+    directives = {}
+    for part in (value or '').split(','):
+        name, _, arg = part.strip().partition('=')
+        if name:
+            directives[name.lower()] = arg.strip('"') if arg else True
+    return directives
+
+
+def directive_seconds(value):
+    """Delta-seconds argument of a Cache-Control directive (0 when missing or malformed)"""
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return 0
+
+
+def header_value(headers, name):
+    """First value of a header from a (name, value) list"""
+    name = name.lower()
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+def http_date(value):
+    try:
+        return parsedate_to_datetime(value).timestamp() if value else None
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+class CacheEntry:
+    """Stored response metadata; the body lives in memory or in a file"""
+
+    def __init__(self, url, status, reason, headers, vary, stored_at, body=None, path=None, size=0):
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.vary = vary
+        self.stored_at = stored_at
+        self.body = body
+        self.path = path
+        self.size = size if body is None else len(body)
+
+    @property
+    def cache_control(self):
+        return parse_cache_control(header_value(self.headers, 'Cache-Control'))
+
+    def freshness_lifetime(self):
+        cc = self.cache_control
+        if 'max-age' in cc:
+            try:
+                return int(cc['max-age'])
+            except ValueError:
+                return 0
+        date = http_date(header_value(self.headers, 'Date')) or self.stored_at
+        expires = header_value(self.headers, 'Expires')
+        if expires is not None:
+            expires_at = http_date(expires)
+            return max(0, expires_at - date) if expires_at else 0
+        last_modified = http_date(header_value(self.headers, 'Last-Modified'))
+        if last_modified and self.status in (200, 203, 300, 301, 410):
+            return min(HEURISTIC_MAX, max(0, (date - last_modified) / 10))
+        return 0
+
+    def age(self, now):
+        try:
+            initial = int(header_value(self.headers, 'Age') or 0)
+        except ValueError:
+            initial = 0
+        return initial + max(0, now - self.stored_at)
+
+    def is_fresh(self, now):
+        return 'no-cache' not in self.cache_control and self.age(now) < self.freshness_lifetime()
+
+    def satisfies(self, request_cc, now):
+        """Whether the request's Cache-Control lets this entry be served without revalidating"""
+        if 'no-cache' in request_cc:
+            return False
+        age = self.age(now)
+        lifetime = self.freshness_lifetime()
+        if 'max-age' in request_cc and age >= directive_seconds(request_cc['max-age']):
+            return False  # Includes a browser reload's max-age=0
+        if 'min-fresh' in request_cc and \
+                lifetime - age < directive_seconds(request_cc['min-fresh']):
+            return False
+        if self.is_fresh(now):
+            return True
+        if 'max-stale' not in request_cc:
+            return False
+        cc = self.cache_control
+        if 'must-revalidate' in cc or 'proxy-revalidate' in cc or 'no-cache' in cc:
+            return False
+        max_stale = request_cc['max-stale']
+        return max_stale is True or age - lifetime <= directive_seconds(max_stale)
+
+    def has_validators(self):
+        return bool(header_value(self.headers, 'ETag') or header_value(self.headers, 'Last-Modified'))
+
+    def not_modified(self, request_headers):
+        """Whether the client's own validators already match this entry"""
+        if_none_match = header_value(request_headers, 'If-None-Match')
+        if if_none_match:
+            etag = header_value(self.headers, 'ETag') or ''
+            etag = etag[2:] if etag.startswith('W/') else etag
+            return etag_matches(if_none_match, (etag,) if etag else ())
+        since = http_date(header_value(request_headers, 'If-Modified-Since'))
+        last_modified = http_date(header_value(self.headers, 'Last-Modified'))
+        return since is not None and last_modified is not None and last_modified <= since
+
+    def matches_vary(self, request_headers):
+        return all((header_value(request_headers, name) or '') == value
+                   for name, value in self.vary.items())
+
+    def to_meta(self):
+        return {'url': self.url, 'status': self.status, 'reason': self.reason,
+                'headers': self.headers, 'vary': self.vary, 'stored_at': self.stored_at,
+                'size': self.size}
+
+
+class HttpCache:
+    """Memory LRU in front of a disk store, both bounded in bytes"""
+
+    def __init__(self, memory_bytes=32 * 1024 * 1024, memory_object_max=256 * 1024,
+                 disk_dir=None, disk_bytes=512 * 1024 * 1024, disk_object_max=64 * 1024 * 1024):
+        self.memory_bytes = memory_bytes
+        self.memory_object_max = memory_object_max
+        self.disk_bytes = disk_bytes
+        self.disk_object_max = disk_object_max
+        self.memory = OrderedDict()
+        self.memory_used = 0
+        self.disk = OrderedDict()
+        self.disk_used = 0
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.stats = {'hits': 0, 'misses': 0, 'revalidated': 0, 'stored': 0}
+        if self.disk_dir:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            self._load_disk_index()
+
+    # Storage tiers
+
+    def _load_disk_index(self):
+        for tmp_path in self.disk_dir.glob('*.tmp'):
+            tmp_path.unlink(missing_ok=True)  # Bodies still being written when we last stopped
+        for body_path in self.disk_dir.glob('*.body'):
+            if not body_path.with_suffix('.meta').exists():
+                body_path.unlink(missing_ok=True)  # Stopped before its metadata was written
+        metas = sorted(self.disk_dir.glob('*.meta'), key=lambda p: p.stat().st_mtime)
+        for meta_path in metas:
+            body_path = meta_path.with_suffix('.body')
+            try:
+                meta = json.loads(meta_path.read_text())
+                entry = CacheEntry(meta['url'], meta['status'], meta['reason'],
+                                   [tuple(h) for h in meta['headers']], meta['vary'],
+                                   meta['stored_at'], path=body_path, size=meta['size'])
+            except (OSError, ValueError, KeyError):
+                meta_path.unlink(missing_ok=True)
+                body_path.unlink(missing_ok=True)
+                continue
+            self.remove(entry.url)  # An older copy left behind by a replacement cut short
+            self.disk[entry.url] = entry
+            self.disk_used += entry.size
+
+    def get(self, url):
+        entry = self.memory.get(url)
+        if entry is not None:
+            self.memory.move_to_end(url)
+            return entry
+        entry = self.disk.get(url)
+        if entry is not None:
+            self.disk.move_to_end(url)
+        return entry
+
+    def put(self, entry):
+        self.remove(entry.url)
+        if entry.body is not None:
+            self.memory[entry.url] = entry
+            self.memory_used += entry.size
+            while self.memory_used > self.memory_bytes and self.memory:
+                _, old = self.memory.popitem(last=False)
+                self.memory_used -= old.size
+        else:
+            self.disk[entry.url] = entry
+            self.disk_used += entry.size
+            while self.disk_used > self.disk_bytes and self.disk:
+                _, old = self.disk.popitem(last=False)
+                self.disk_used -= old.size
+                self._unlink(old)
+        self.stats['stored'] += 1
+
+    def remove(self, url):
+        entry = self.memory.pop(url, None)
+        if entry is not None:
+            self.memory_used -= entry.size
+        entry = self.disk.pop(url, None)
+        if entry is not None:
+            self.disk_used -= entry.size
+            self._unlink(entry)
+
+    @staticmethod
+    async def run_io(func, *args):
+        """Run blocking file I/O on the default executor, off the event loop"""
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    @staticmethod
+    def write_meta(entry):
+        entry.path.with_suffix('.meta').write_text(json.dumps(entry.to_meta()))
+
+    def create_body_file(self, head):
+        """Open a uniquely named temp file for a disk body, starting with what was buffered"""
+        # Unique per response: concurrent misses for one URL must not share a file
+        fd, name = tempfile.mkstemp(suffix='.tmp', dir=self.disk_dir)
+        disk_file = os.fdopen(fd, 'wb')
+        try:
+            disk_file.write(head)
+        except OSError:
+            disk_file.close()
+            Path(name).unlink(missing_ok=True)
+            raise
+        return disk_file, Path(name)
+
+    def commit_body_file(self, tmp_path, entry):
+        """Move a finished body into place, then record its metadata"""
+        os.replace(tmp_path, entry.path)
+        try:
+            self.write_meta(entry)
+        except OSError:
+            entry.path.unlink(missing_ok=True)
+            raise
+
+    @staticmethod
+    def _unlink(entry):
+        for path in (entry.path, entry.path.with_suffix('.meta')):
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+    def clear(self):
+        for url in list(self.memory) + list(self.disk):
+            self.remove(url)
+
+    def get_stats(self):
+        return dict(self.stats, memory_entries=len(self.memory), memory_bytes=self.memory_used,
+                    disk_entries=len(self.disk), disk_bytes=self.disk_used)
+
+    # Proxy integration
+
+    def cacheable_request(self, method, headers):
+        if method not in ('GET', 'HEAD'):
+            return False
+        if header_value(headers, 'Authorization') or header_value(headers, 'Range'):
+            return False
+        return 'no-store' not in parse_cache_control(header_value(headers, 'Cache-Control'))
+
+    async def handle(self, proxy, reader, writer, method, url, path, version, headers, host, port):
+        """Serve a GET/HEAD from cache, revalidating or fetching through the upstream as needed"""
+        request_cc = parse_cache_control(header_value(headers, 'Cache-Control'))
+        if header_value(headers, 'Pragma') == 'no-cache' and not request_cc:
+            request_cc = {'no-cache': True}
+        now = time.time()
+
+        entry = self.get(url)
+        if entry is not None and not entry.matches_vary(headers):
+            entry = None
+
+        if entry is not None and entry.satisfies(request_cc, now):
+            self.stats['hits'] += 1
+            await self.serve_entry(writer, entry, method, headers, 'HIT')
+            return
+        if 'only-if-cached' in request_cc:
+            writer.write(b"HTTP/1.1 504 Gateway Timeout\r\nContent-Length: 0\r\n"
+                         b"X-Cache: MISS\r\nConnection: close\r\n\r\n")
+            close_writer(writer)
+            return
+
+        upstream_reader, upstream_writer = await proxy.open_upstream(writer, host, port)
+        if upstream_writer is None:
+            return
+
+        try:
+            forwarded = [f"{method} /{path} {version}"]
+            forwarded += [f"{name}: {value}" for name, value in headers
+                          if name.lower() not in HOP_BY_HOP]
+            # Only a 304 answering the entry's own validators says the entry is still good;
+            # one answering the client's validators goes back to the client as is
+            revalidating = (entry is not None
+                            and not any(name.lower().startswith('if-') for name, _ in headers))
+            if revalidating:
+                etag = header_value(entry.headers, 'ETag')
+                last_modified = header_value(entry.headers, 'Last-Modified')
+                if etag:
+                    forwarded.append(f"If-None-Match: {etag}")
+                if last_modified:
+                    forwarded.append(f"If-Modified-Since: {last_modified}")
+            forwarded.append("Connection: close")
+            upstream_writer.write(("\r\n".join(forwarded) + "\r\n\r\n").encode('latin-1'))
+
+            head = await upstream_reader.readuntil(b"\r\n\r\n")
+            lines = head.decode('latin-1').split("\r\n")
+            status_parts = lines[0].split(" ", 2)
+            status = int(status_parts[1])
+            reason = status_parts[2] if len(status_parts) > 2 else ''
+            response_headers = [(name.strip(), value.strip()) for name, _, value in
+                                (line.partition(':') for line in lines[1:] if line)]
+
+            if status == 304 and revalidating:
+                self.stats['revalidated'] += 1
+                entry.headers = self.merge_headers(entry.headers, response_headers)
+                entry.stored_at = time.time()
+                if entry.path is not None:
+                    try:
+                        await self.run_io(self.write_meta, entry)
+                    except OSError as e:
+                        log_event(f"Cache metadata update for {url} failed: {e}", 'WARNING')
+                await self.serve_entry(writer, entry, method, headers, 'REVALIDATED')
+                return
+
+            self.stats['misses'] += 1
+            await self.forward_and_store(upstream_reader, writer, method, url, headers,
+                                         status, reason, response_headers, lines[0])
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError, IndexError):
+            writer.write(b"HTTP/1.1 502 Bad Gateway\r\nContent-Length: 0\r\n"
+                         b"Connection: close\r\n\r\n")
+        finally:
+            close_writer(upstream_writer)
+            close_writer(writer)
+
+    @staticmethod
+    def merge_headers(stored, updated):
+        """Apply the headers of a 304 to the stored response"""
+        replaced = {name.lower() for name, _ in updated} - {'content-length'}
+        merged = [(name, value) for name, value in stored if name.lower() not in replaced]
+        merged += [(name, value) for name, value in updated if name.lower() in replaced]
+        return merged
+
+    def storable(self, method, status, response_headers, request_headers):
+        if method != 'GET' or status not in CACHEABLE_STATUS:
+            return False
+        cc = parse_cache_control(header_value(response_headers, 'Cache-Control'))
+        if 'no-store' in cc or 'private' in cc or header_value(response_headers, 'Set-Cookie'):
+            return False  # Per-user responses never go into the shared cache
+        if header_value(request_headers, 'Authorization') and \
+                not ('public' in cc or 's-maxage' in cc or 'must-revalidate' in cc):
+            return False
+        if header_value(response_headers, 'Vary') == '*':
+            return False
+        probe = CacheEntry('', status, '', response_headers, {}, time.time())
+        return probe.freshness_lifetime() > 0 or probe.has_validators() or 'no-cache' in cc
+
+    async def forward_and_store(self, upstream_reader, writer, method, url, request_headers,
+                                status, reason, response_headers, status_line):
+        """Stream the response to the client, keeping a copy when it may be cached"""
+        has_body = method != 'HEAD' and status not in (204, 304) and not 100 <= status < 200
+        store = self.storable(method, status, response_headers, request_headers)
+
+        # Body is re-framed as close-delimited, so chunked encoding is decoded on the way
+        client_headers = [(name, value) for name, value in response_headers
+                          if name.lower() not in HOP_BY_HOP]
+        head = [status_line] + [f"{name}: {value}" for name, value in client_headers]
+        head += ["X-Cache: MISS", "Connection: close"]
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode('latin-1'))
+
+        memory_body = bytearray()
+        disk_file = tmp_path = None
+        size = 0
+        try:
+            if has_body:
+                async for chunk in read_body(upstream_reader, response_headers):
+                    writer.write(chunk)
+                    await writer.drain()
+                    touch()
+                    if not store:
+                        continue
+                    size += len(chunk)
+                    too_big = self.disk_object_max if self.disk_dir else self.memory_object_max
+                    if size > too_big:
+                        store = False
+                        if disk_file is not None:
+                            await self.run_io(disk_file.close)
+                            disk_file = None
+                        continue
+                    try:
+                        if disk_file is None and size > self.memory_object_max:
+                            disk_file, tmp_path = await self.run_io(self.create_body_file,
+                                                                    bytes(memory_body))
+                            memory_body = None
+                        if disk_file is not None:
+                            await self.run_io(disk_file.write, chunk)
+                        else:
+                            memory_body.extend(chunk)
+                    except OSError as e:
+                        # A full or unwritable cache disk only stops caching, not the response
+                        log_event(f"Cache write for {url} failed: {e}", 'WARNING')
+                        store = False
+        except (ConnectionError, OSError, ValueError, asyncio.IncompleteReadError):
+            store = False
+
+        if disk_file is not None:
+            try:
+                await self.run_io(disk_file.close)
+            except OSError:
+                store = False
+        if not store:
+            if tmp_path is not None:
+                tmp_path.unlink(missing_ok=True)
+            return
+
+        vary = {}
+        for name in (header_value(response_headers, 'Vary') or '').split(','):
+            if name.strip():
+                vary[name.strip()] = header_value(request_headers, name.strip()) or ''
+        stored_headers = [(name, value) for name, value in client_headers
+                          if name.lower() != 'content-length']
+        if tmp_path is not None:
+            # Files keep the temp file's unique stem, so the previous copy stays intact
+            # (and servable) until put() replaces it
+            entry = CacheEntry(url, status, reason, stored_headers, vary, time.time(),
+                               path=tmp_path.with_suffix('.body'), size=size)
+            try:
+                await self.run_io(self.commit_body_file, tmp_path, entry)
+            except OSError as e:
+                log_event(f"Cache store for {url} failed: {e}", 'WARNING')
+                tmp_path.unlink(missing_ok=True)
+                return
+            self.put(entry)
+        else:
+            entry = CacheEntry(url, status, reason, stored_headers, vary, time.time(),
+                               body=bytes(memory_body))
+            self.put(entry)
+
+    async def serve_entry(self, writer, entry, method, request_headers, cache_status):
+        """Write a stored response to the client"""
+        if entry.not_modified(request_headers):
+            head = ["HTTP/1.1 304 Not Modified"]
+            head += [f"{name}: {value}" for name, value in entry.headers
+                     if name.lower() in ('etag', 'last-modified', 'cache-control', 'expires',
+                                         'vary')]
+            send_body = False
+        else:
+            head = [f"HTTP/1.1 {entry.status} {entry.reason}".rstrip()]
+            head += [f"{name}: {value}" for name, value in entry.headers
+                     if name.lower() not in ('age', 'date')]
+            head.append(f"Content-Length: {entry.size}")
+            send_body = method != 'HEAD'
+        head += [f"Date: {formatdate(usegmt=True)}", f"Age: {int(entry.age(time.time()))}",
+                 f"X-Cache: {cache_status}", "Connection: close"]
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode('latin-1'))
+
+        if send_body and entry.size:
+            if entry.body is not None:
+                writer.write(entry.body)
+            else:
+                await self.send_file(writer, entry)
+        await writer.drain()
+        close_writer(writer)
+
+    async def send_file(self, writer, entry):
+        """Stream a disk entry through an mmap so the body never lands on the heap whole"""
+        try:
+            with open(entry.path, 'rb') as body_file, \
+                    mmap.mmap(body_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                for offset in range(0, len(mapped), CHUNK):
+                    writer.write(mapped[offset:offset + CHUNK])
+                    await writer.drain()
+                    touch()
+        except (OSError, ValueError) as e:
+            log_event(f"Cache read failed for {entry.url}: {e}", 'WARNING')
+            self.remove(entry.url)
+            close_writer(writer)
+
+
+async def read_body(reader, headers):
+    """Yield the decoded response body (Content-Length, chunked, or until close)"""
+    encoding = (header_value(headers, 'Transfer-Encoding') or '').lower()
+    length = header_value(headers, 'Content-Length')
+
+    if 'chunked' in encoding:
+        while True:
+            size_line = await reader.readuntil(b"\r\n")
+            size = int(size_line.split(b";", 1)[0].strip(), 16)
+            if size == 0:
+                # Trailers end with an empty line
+                while await reader.readuntil(b"\r\n") != b"\r\n":
+                    pass
+                return
+            remaining = size
+            while remaining:
+                chunk = await reader.read(min(remaining, CHUNK))
+                if not chunk:
+                    raise asyncio.IncompleteReadError(b"", remaining)
+                remaining -= len(chunk)
+                yield chunk
+            await reader.readexactly(2)
+    elif length is not None:
+        remaining = int(length)
+        while remaining:
+            chunk = await reader.read(min(remaining, CHUNK))
+            if not chunk:
+                raise asyncio.IncompleteReadError(b"", remaining)
+            remaining -= len(chunk)
+            yield chunk
+    else:
+        while True:
+            chunk = await reader.read(CHUNK)
+            if not chunk:
+                return
+            yield chunk
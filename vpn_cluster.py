@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""
+VPN Cluster Module - Gossip of proxy health between FREE-VPN gateway instances
+Every interval each node sends a few random peers one UDP datagram of compact health
+digests (freshest first, the rest in rotation) under a size cap; receivers keep whichever
+observation is newer, so one node's probe spares the others from repeating it
+"""
+
+import asyncio
+import hashlib
+import hmac
+import json
+import math
+import random
+import socket
+import sys
+import time
+
+from vpn_relay import log_event
+
+GOSSIP_MAGIC = b"FVC1"
+MAC_SIZE = 16
+DEFAULT_PORT = 7946
+MAX_MESSAGE = 1200
+
+
+def parse_peer(peer, default_port=DEFAULT_PORT):
+    """'host:port' (or bare host) as a (host, port) pair"""
+    if isinstance(peer, (list, tuple)):
+        return peer[0], int(peer[1])
+    host, _, port = peer.rpartition(':')
+    if not host:
+        return peer, default_port
+    return host.strip('[]'), int(port)
+
+
+class _GossipProtocol(asyncio.DatagramProtocol):
+    def __init__(self, node):
+        self.node = node
+
+    def datagram_received(self, data, addr):
+        self.node.handle_packet(data, addr)
+
+    def error_received(self, exc):
+        # ICMP unreachable from a peer that is down; it will simply go stale
+        pass
+
+
+class ClusterNode:
+    """Shares a ProbeScheduler's results with peer gateways and merges theirs"""
+
+    def __init__(self, prober, node_id=None, host='0.0.0.0', port=DEFAULT_PORT, peers=(),
+                 secret=None, interval=2.0, fanout=2, max_message=MAX_MESSAGE, peer_timeout=60):
+        self.prober = prober
+        self.node_id = node_id or f"{socket.gethostname()}:{port}"
+        self.host = host
+        self.port = port
+        self.seeds = [parse_peer(peer) for peer in peers]
+        self.secret = secret.encode() if isinstance(secret, str) else secret
+        self.interval = interval
+        self.fanout = fanout
+        self.max_message = max_message
+        self.peer_timeout = peer_timeout
+        # Survives restarts, so peers never mistake a fresh sequence for a replay
+        self.sequence = time.time_ns() // 1_000_000
+        self.envelope = envelope_size(self.node_id)
+        if self.envelope > self.max_message // 2:
+            raise ValueError(f"Cluster node id is too long for {max_message}-byte messages")
+        # (ip, port) -> {'node': id, 'last_seen': monotonic}
+        self.peers = {}
+        # Node id -> last accepted sequence; by id, so a replay from another address fails
+        self.sequences = {}
+        self.seed_addrs = set()
+        self.cursor = 0
+        self.last_round = 0.0
+        self.transport = None
+        self.task = None
+        self.stats = {'sent': 0, 'received': 0, 'rejected': 0, 'merged': 0, 'last_message_bytes': 0}
+
+    async def start(self):
+        """Bind the gossip socket and start gossiping on the running loop"""
+        if not self.secret and self.host not in ('127.0.0.1', 'localhost', '::1'):
+            raise RuntimeError(f"Refusing unauthenticated gossip on {self.host}: set a cluster "
+                               f"secret or listen on 127.0.0.1")
+        loop = asyncio.get_running_loop()
+        self.transport, _ = await loop.create_datagram_endpoint(
+            lambda: _GossipProtocol(self), local_addr=(self.host, self.port))
+        self.port = self.transport.get_extra_info('sockname')[1]
+        for host, port in self.seeds:
+            try:
+                infos = await loop.getaddrinfo(host, port, family=socket.AF_INET,
+                                               type=socket.SOCK_DGRAM)
+            except OSError as e:
+                log_event(f"Cluster peer {host}:{port} does not resolve: {e}", 'WARNING')
+                continue
+            self.seed_addrs.add(infos[0][4][:2])
+        self.task = asyncio.ensure_future(self.run())
+        log_event(f"🛰️ Cluster node {self.node_id} gossiping on {self.host}:{self.port} "
+                  f"with {len(self.seed_addrs)} seed peer(s)")
+        return self
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval * random.uniform(0.8, 1.2))
+            try:
+                self.gossip_round()
+            except Exception as e:
+                log_event(f"Gossip round failed: {e}", 'WARNING')
+
+    def live_peers(self):
+        """Seed peers plus peers heard from recently"""
+        now = time.monotonic()
+        for addr in [addr for addr, peer in self.peers.items()
+                     if now - peer['last_seen'] > self.peer_timeout]:
+            del self.peers[addr]
+        return list(self.seed_addrs | set(self.peers))
+
+    def gossip_round(self):
+        targets = self.live_peers()
+        if not targets or self.transport is None:
+            return
+        packet = self.encode(self.select_entries())
+        self.last_round = time.time()
+        for addr in random.sample(targets, min(self.fanout, len(targets))):
+            self.transport.sendto(packet, addr)
+            self.stats['sent'] += 1
+        self.stats['last_message_bytes'] = len(packet)
+
+    # Wire format: magic, truncated HMAC-SHA256 (zeros without a secret), compact JSON
+
+    def select_entries(self):
+        """Digests that fit one datagram: news since the last round first, then a rotating slice"""
+        checked = sorted((health for health in list(self.prober.health.values())
+                          if health.last_checked), key=lambda health: -health.last_checked)
+        fresh = [health for health in checked if health.last_checked > self.last_round]
+        rest = [health for health in checked if health.last_checked <= self.last_round]
+        if rest:
+            start = self.cursor % len(rest)
+            rest = rest[start:] + rest[:start]
+
+        now = time.time()
+        budget = self.max_message - len(GOSSIP_MAGIC) - MAC_SIZE - self.envelope
+        entries = []
+        for index, health in enumerate(fresh + rest):
+            entry = digest(health, now)
+            size = len(json.dumps(entry, separators=(',', ':'))) + 1
+            if size > budget:
+                break
+            budget -= size
+            entries.append(entry)
+            if index >= len(fresh):
+                self.cursor += 1
+        return entries
+
+    def encode(self, entries):
+        self.sequence += 1
+        payload = json.dumps({'n': self.node_id, 's': self.sequence, 'e': entries},
+                             separators=(',', ':')).encode()
+        return GOSSIP_MAGIC + self.sign(payload) + payload
+
+    def sign(self, payload):
+        if not self.secret:
+            return bytes(MAC_SIZE)
+        return hmac.new(self.secret, GOSSIP_MAGIC + payload, hashlib.sha256).digest()[:MAC_SIZE]
+
+    def handle_packet(self, data, addr):
+        header = len(GOSSIP_MAGIC) + MAC_SIZE
+        if (len(data) > self.max_message * 2 or not data.startswith(GOSSIP_MAGIC)
+                or not hmac.compare_digest(data[len(GOSSIP_MAGIC):header], self.sign(data[header:]))):
+            self.stats['rejected'] += 1
+            return
+        try:
+            message = json.loads(data[header:])
+            node, sequence, entries = message['n'], int(message['s']), message['e']
+        except (ValueError, KeyError, TypeError):
+            self.stats['rejected'] += 1
+            return
+        if node == self.node_id:
+            return
+
+        if not isinstance(node, str) or not isinstance(entries, list):
+            self.stats['rejected'] += 1
+            return
+        if sequence <= self.sequences.get(node, -1):
+            self.stats['rejected'] += 1  # Duplicate or replayed datagram
+            return
+        self.sequences[node] = sequence
+
+        addr = addr[:2]
+        if addr not in self.peers:
+            log_event(f"🛰️ Cluster peer {node} joined from {addr[0]}:{addr[1]}")
+        self.peers[addr] = {'node': node, 'last_seen': time.monotonic()}
+        self.stats['received'] += 1
+
+        now = time.time()
+        for entry in entries:
+            try:
+                if self.merge(entry, node, now):
+                    self.stats['merged'] += 1
+            except (ValueError, TypeError, IndexError):
+                self.stats['rejected'] += 1
+
+    def merge(self, entry, node, now):
+        """Validate one digest and hand it to the prober; ValueError/TypeError if malformed"""
+        key, alive, latency_ms, exit_ip, exit_country, age, failures, mbps, speed_age = entry
+        if not isinstance(key, str) or alive not in (0, 1):
+            raise ValueError("Malformed digest")
+        if any(value is not None and not isinstance(value, str)
+               for value in (exit_ip, exit_country)):
+            raise ValueError("Malformed digest")
+        if alive:
+            latency_ms = non_negative(latency_ms)  # ranked() sorts on it
+        elif latency_ms is not None:
+            latency_ms = None
+        if mbps is not None:
+            mbps = non_negative(mbps)
+        # Ages rather than timestamps keep merging independent of peers' clock skew; a
+        # negative age would claim an observation from the future and win every merge
+        checked_at = now - non_negative(age)
+        speed_at = None if speed_age is None else now - non_negative(speed_age)
+        return self.prober.merge_remote(
+            key, bool(alive), latency_ms, exit_ip, exit_country, checked_at,
+            int(non_negative(failures)), mbps, speed_at, node)
+
+    def get_stats(self):
+        now = time.monotonic()
+        return dict(self.stats,
+                    node_id=self.node_id,
+                    port=self.port,
+                    peers=[{'address': f"{addr[0]}:{addr[1]}", 'node': peer['node'],
+                            'last_seen_seconds': round(now - peer['last_seen'], 1)}
+                           for addr, peer in list(self.peers.items())],
+                    seeds=[f"{host}:{port}" for host, port in self.seed_addrs])
+
+
+def non_negative(value):
+    """A finite number from a gossip digest, clamped at zero"""
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise ValueError(f"Not a number: {value!r}")
+    return max(0, value)
+
+
+def envelope_size(node_id):
+    """Bytes of a message around its entries, with the longest sequence number"""
+    return len(json.dumps({'n': node_id, 's': 10 ** 20, 'e': []}, separators=(',', ':')))
+
+
+def digest(health, now):
+    """Compact list form of one proxy's latest observation"""
+    speed = health.speed if health.speed and health.speed.mbps is not None else None
+    return [health.key, 1 if health.alive else 0, health.latency_ms, health.exit_ip,
+            health.exit_country, round(now - health.last_checked, 1), health.failures,
+            speed.mbps if speed else None,
+            round(now - speed.measured_at, 1) if speed else None]
+
+
+def run_demo_node(index, nodes, base_port, seconds):
+    """One process of the local demo: probe a shard of a synthetic catalog, gossip the rest"""
+    from vpn_probe import ProbeScheduler
+
+    catalog = {region: {'proxies': [{'host': f"10.{r}.0.{i}", 'port': 8080, 'type': 'http'}
+                                    for i in range(8)]}
+               for r, region in enumerate(['us', 'uk', 'de', 'nl'])}
+    prober = ProbeScheduler(catalog)
+    prober.sync_catalog()
+    keys = sorted(prober.health)
+    for key in keys[index::nodes]:
+        prober.record_success(prober.health[key], random.uniform(20, 200), f"203.0.113.{index}")
+
+    async def run():
+        node = ClusterNode(prober, node_id=f"node-{index}", host='127.0.0.1',
+                           port=base_port + index, interval=0.5,
+                           peers=[f"127.0.0.1:{base_port + i}" for i in range(nodes) if i != index])
+        await node.start()
+        await asyncio.sleep(seconds)
+        node.stop()
+        return node
+
+    node = asyncio.run(run())
+    known = sum(1 for health in prober.health.values() if health.last_checked)
+    print(json.dumps({'node': node.node_id, 'probed': len(keys[index::nodes]), 'known': known,
+                      'total': len(keys), 'merged': node.stats['merged'],
+                      'message_bytes': node.stats['last_message_bytes']}))
+
+
+if __name__ == "__main__":
+    import subprocess
+
+    if len(sys.argv) == 6 and sys.argv[1] == 'node':
+        run_demo_node(*(int(arg) for arg in sys.argv[2:5]), float(sys.argv[5]))
+    elif len(sys.argv) in (2, 3) and sys.argv[1] == 'demo':
+        count = int(sys.argv[2]) if len(sys.argv) == 3 else 3
+        print(f"🛰️  Gossip demo with {count} local processes")
+        print("=" * 40)
+        children = [subprocess.Popen([sys.executable, __file__, 'node', str(i), str(count),
+                                      '17946', '5'], stdout=subprocess.PIPE, text=True)
+                    for i in range(count)]
+        for child in children:
+            output, _ = child.communicate()
+            result = json.loads(output.strip().splitlines()[-1])
+            print(f"{result['node']}: probed {result['probed']}, knows "
+                  f"{result['known']}/{result['total']} ({result['merged']} merged, "
+                  f"{result['message_bytes']} B messages)")
+    else:
+        print("Usage: python vpn_cluster.py demo [nodes]")
@@ -1,35 +1,125 @@
 #!/usr/bin/env python3
 """
 VPN Core Module - Autonomous VPN without OpenVPN dependency
-Creates real VPN tunnels using pure Python implementation
+Creates real VPN tunnels using pure Python implementation; AsyncAutonomousVPN is the
+engine and runs on the caller's event loop, AutonomousVPN drives it from blocking code
 """
 
+import asyncio
+import functools
 import socket
-import threading
+import ssl
 import time
-import requests
 import subprocess
 import sys
 import os
 import json
 import random
+import urllib.parse
 from datetime import datetime
 
-class AutonomousVPN:
-    """Autonomous VPN implementation without external dependencies"""
+from vpn_relay import (BackgroundLoop, LocalProxyServer, DirectDialer, FlowControl, MemoryBudget,
+                       HOP_HANDSHAKES, close_writer, make_dialer)
+from vpn_probe import ProbeScheduler, proxy_key
+from vpn_speedtest import SpeedTester, format_speed
+from vpn_timer import ConnectionTimeouts
+from vpn_trace import Tracer
+from vpn_split import SplitTunnelRules
+
+IP_CHECK_URLS = [('https://api.ipify.org?format=json', 'ip'), ('https://httpbin.org/ip', 'origin')]
+PROXY_TEST_URL = 'http://httpbin.org/ip'
+MAX_JSON_RESPONSE = 64 * 1024
+
+@functools.lru_cache(maxsize=None)
+def tls_context():
+    # Loading the CA bundle takes milliseconds; do it once rather than per request
+    return ssl.create_default_context()
+
+async def fetch_json(url, dialer=None):
+    """GET a small JSON document over asyncio streams, directly or through a dialer"""
+    parts = urllib.parse.urlsplit(url)
+    secure = parts.scheme == 'https'
+    port = parts.port or (443 if secure else 80)
+    path = (parts.path or '/') + (f"?{parts.query}" if parts.query else '')
+    if dialer is not None:
+        if secure:
+            raise ValueError("Only http:// URLs can be fetched through a dialer")
+        reader, writer = await dialer.open_connection(parts.hostname, port)
+    else:
+        reader, writer = await asyncio.open_connection(
+            parts.hostname, port, ssl=tls_context() if secure else None)
+    
+    try:
+        # HTTP/1.0 keeps the body unchunked, and the server closes when done
+        writer.write(f"GET {path} HTTP/1.0\r\nHost: {parts.netloc}\r\n"
+                     f"Accept: application/json\r\n\r\n".encode())
+        response = b""
+        while len(response) < MAX_JSON_RESPONSE:
+            chunk = await reader.read(MAX_JSON_RESPONSE)
+            if not chunk:
+                break
+            response += chunk
+    finally:
+        close_writer(writer)
+    
+    head, _, body = response.partition(b"\r\n\r\n")
+    status = head.split(None, 2)[1:2]
+    if status != [b"200"]:
+        raise ConnectionError(f"{url} returned {head[:32]!r}")
+    return json.loads(body.decode(errors='replace'))
+
+def bounded(method):
+    """Run an engine coroutine under a timeout; timeout= overrides the engine default"""
+    @functools.wraps(method)
+    async def wrapper(self, *args, timeout=None, **kwargs):
+        return await asyncio.wait_for(method(self, *args, **kwargs),
+                                      self.timeout if timeout is None else timeout)
+    return wrapper
+
+class AsyncAutonomousVPN:
+    """Autonomous VPN engine; every I/O method is a coroutine on the caller's event loop"""
     
-    def __init__(self):
+    def __init__(self, event_loop=None, timeout=30):
+        # BackgroundLoop the engine's background tasks run on; None adopts the caller's loop
+        self.event_loop = event_loop
+        # Default seconds for connect, disconnect, status and probe calls
+        self.timeout = timeout
+        # Serialises connect/disconnect; created on first use, on the engine's loop
+        self.transition = None
         self.connected = False
         self.current_server = None
         self.original_ip = None
         self.tunnel_socket = None
         self.proxy_thread = None
+        self.local_proxy = None
+        self.local_proxy_port = 9999
+        # Listener for iptables/nftables-redirected traffic (Linux); None disables it
+        self.transparent_host = '0.0.0.0'
+        self.transparent_port = None
+        # Seconds in-flight connections may keep using the old upstream after a server switch
+        self.switch_grace = 30
+        self.exit_node = None
+        self.split_tunnel = SplitTunnelRules()
+        self.http_cache = None
+        self.relay_flow = FlowControl()
+        self.memory_budget = MemoryBudget(256 * 1024 * 1024)
+        self.relay_timeouts = ConnectionTimeouts()
+        # Options for warming hot destinations each proxy session; None disables it
+        self.preconnect_options = None
+        self.prober = None
+        self.cluster = None
+        self.active_proxy = None
+        self.geoip = None
+        self.tracer = Tracer()
+        # Bumped on every change that read APIs render; lets responses be memoized
+        self.state_version = 0
         self.dns_servers = ['1.1.1.1', '1.0.0.1', '8.8.8.8', '8.8.4.4']
         
         # Free VPN endpoints (real working proxies)
         self.vpn_endpoints = {
             'us': {
                 'name': 'United States',
+                'country': 'US',
                 'location': 'New York',
                 'flag': '🇺🇸',
                 'proxies': [
@@ -40,6 +130,7 @@ class AutonomousVPN:
             },
             'uk': {
                 'name': 'United Kingdom', 
+                'country': 'GB',
                 'location': 'London',
                 'flag': '🇬🇧',
                 'proxies': [
@@ -50,6 +141,7 @@ class AutonomousVPN:
             },
             'de': {
                 'name': 'Germany',
+                'country': 'DE',
                 'location': 'Frankfurt', 
                 'flag': '🇩🇪',
                 'proxies': [
@@ -60,6 +152,7 @@ class AutonomousVPN:
             },
             'nl': {
                 'name': 'Netherlands',
+                'country': 'NL',
                 'location': 'Amsterdam',
                 'flag': '🇳🇱', 
                 'proxies': [
@@ -70,6 +163,7 @@ class AutonomousVPN:
             },
             'ca': {
                 'name': 'Canada',
+                'country': 'CA',
                 'location': 'Toronto',
                 'flag': '🇨🇦',
                 'proxies': [
@@ -80,6 +174,7 @@ class AutonomousVPN:
             },
             'jp': {
                 'name': 'Japan',
+                'country': 'JP',
                 'location': 'Tokyo',
                 'flag': '🇯🇵',
                 'proxies': [
@@ -95,38 +190,54 @@ class AutonomousVPN:
         timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         print(f"[{timestamp}] [AUTONOMOUS-VPN] [{level}] {message}")
     
-    def get_current_ip(self):
+    def ensure_loop(self):
+        """BackgroundLoop for background tasks: the one given, else the running loop"""
+        if self.event_loop is None:
+            self.event_loop = BackgroundLoop.attach(asyncio.get_running_loop())
+        return self.event_loop
+    
+    async def get_current_ip(self):
         """Get current public IP"""
-        try:
-            response = requests.get('https://api.ipify.org?format=json', timeout=10)
-            return response.json()['ip']
-        except:
+        for url, field in IP_CHECK_URLS:
             try:
-                response = requests.get('https://httpbin.org/ip', timeout=10)
-                return response.json()['origin'].split(',')[0]
-            except:
-                return 'Unknown'
+                data = await asyncio.wait_for(fetch_json(url), 10)
+                return data[field].split(',')[0].strip()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                continue
+        return 'Unknown'
     
-    def test_proxy(self, proxy_config):
+    @bounded
+    async def test_proxy(self, proxy_config):
         """Test if a proxy is working"""
+        dialer = None
         try:
-            proxy_url = f"http://{proxy_config['host']}:{proxy_config['port']}"
-            proxies = {
-                'http': proxy_url,
-                'https': proxy_url
-            }
-            
-            response = requests.get('https://httpbin.org/ip', 
-                                  proxies=proxies, 
-                                  timeout=10)
-            
-            if response.status_code == 200:
-                new_ip = response.json()['origin'].split(',')[0]
-                return True, new_ip
-            return False, None
-            
+            dialer = make_dialer(proxy_config)
+            data = await fetch_json(PROXY_TEST_URL, dialer)
+            return True, data['origin'].split(',')[0]
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
-            return False, str(e)
+            return False, str(e) or e.__class__.__name__
+        finally:
+            if hasattr(dialer, 'close'):
+                await dialer.close()
+    
+    @bounded
+    async def probe(self, server_id=None):
+        """Health-check a server's proxies (all when None) now; returns their results"""
+        prober = self.prober
+        if prober is None:
+            # One-off check; results are kept only while background probing runs
+            prober = ProbeScheduler(self.vpn_endpoints, geoip=self.geoip)
+        prober.sync_catalog()
+        checks = [health for health in list(prober.health.values())
+                  if server_id is None or health.region == server_id
+                  or health.listed_region == server_id]
+        await asyncio.gather(*(prober.probe(health) for health in checks
+                               if health.key not in prober.in_flight))
+        return [health.to_dict() for health in checks]
     
     def setup_system_proxy(self, proxy_config):
         """Setup system-wide proxy"""
@@ -144,7 +255,7 @@ class AutonomousVPN:
                 winreg.SetValueEx(key, "ProxyServer", 0, winreg.REG_SZ, proxy_server)
                 winreg.SetValueEx(key, "ProxyEnable", 0, winreg.REG_DWORD, 1)
                 winreg.SetValueEx(key, "ProxyOverride", 0, winreg.REG_SZ, 
-                                "localhost;127.*;10.*;172.*;192.168.*;<local>")
+                                self.split_tunnel.to_windows_override())
                 
                 winreg.CloseKey(key)
                 
@@ -156,13 +267,16 @@ class AutonomousVPN:
                 return True
                 
             elif sys.platform.startswith('linux'):
-                # Linux proxy setup
+                # Linux proxy setup; these variables only reach this process and its children,
+                # transparent mode (enable_transparent_mode) covers other applications
                 proxy_url = f"http://{proxy_config['host']}:{proxy_config['port']}"
                 
                 os.environ['http_proxy'] = proxy_url
                 os.environ['https_proxy'] = proxy_url
                 os.environ['HTTP_PROXY'] = proxy_url
                 os.environ['HTTPS_PROXY'] = proxy_url
+                os.environ['no_proxy'] = self.split_tunnel.to_no_proxy()
+                os.environ['NO_PROXY'] = os.environ['no_proxy']
                 
                 self.log_event(f"Linux proxy configured: {proxy_url}")
                 return True
@@ -198,7 +312,8 @@ class AutonomousVPN:
                 
             elif sys.platform.startswith('linux'):
                 # Remove proxy environment variables
-                for var in ['http_proxy', 'https_proxy', 'HTTP_PROXY', 'HTTPS_PROXY']:
+                for var in ['http_proxy', 'https_proxy', 'HTTP_PROXY', 'HTTPS_PROXY',
+                            'no_proxy', 'NO_PROXY']:
                     if var in os.environ:
                         del os.environ[var]
                 
@@ -211,7 +326,7 @@ class AutonomousVPN:
             self.log_event(f"Proxy disable failed: {e}", 'ERROR')
             return False
     
-    def create_vpn_tunnel(self, server_id):
+    async def create_vpn_tunnel(self, server_id):
         """Create VPN tunnel using working proxy"""
         if server_id not in self.vpn_endpoints:
             return False, "Server not found"
@@ -219,111 +334,429 @@ class AutonomousVPN:
         server = self.vpn_endpoints[server_id]
         self.log_event(f"Creating VPN tunnel to {server['name']}...")
         
-        # Skip proxy testing for now and go directly to simulated VPN
+        if server.get('chain'):
+            return await self.create_chain_tunnel(server)
+        
+        # FREE-VPN exit nodes carry real traffic over a single multiplexed connection
+        tunnels = [p for p in server['proxies'] if p.get('type') == 'tunnel']
+        if tunnels:
+            return await self.create_mux_tunnel(server, tunnels[0])
+        
+        # Health comes from the background prober, so picking a proxy costs no round trips
+        proxy = self.prober.best_proxy(server_id) if self.prober else None
+        if proxy:
+            return await self.create_proxy_tunnel(server, proxy)
+        
+        # No proxy known to be good yet; fall back to the simulated VPN
         # This ensures the VPN always works
         self.log_event("Creating reliable VPN connection...")
-        return self.create_simulated_vpn(server)
+        return await self.create_simulated_vpn(server)
     
-    def create_simulated_vpn(self, server):
-        """Create simulated VPN that changes apparent IP"""
+    async def create_proxy_tunnel(self, server, proxy_config):
+        """Route the local proxy through a catalog proxy already known to be healthy"""
+        try:
+            dialer = make_dialer(proxy_config)
+        except ValueError as e:
+            return False, str(e)
+        
+        if not await self.start_local_proxy_server(dialer):
+            return False, "Local proxy server could not start"
+        
+        self.active_proxy = proxy_config
+        hops = proxy_config.get('hops', [proxy_config])
+        self.log_event("✅ Relaying via " + " → ".join(f"{hop['host']}:{hop['port']}" for hop in hops))
+        health = self.prober.health.get(proxy_key(proxy_config)) if self.prober else None
+        if health is not None and health.exit_ip:
+            self.log_event(f"🌍 Exit IP {health.exit_ip} ({health.exit_country or 'location unknown'})")
+        return True, (f"Connected to {server['name']}! "
+                      f"Use proxy 127.0.0.1:{self.local_proxy.port}")
+    
+    async def create_chain_tunnel(self, server):
+        """Route the local proxy through the best alive proxy of each region in a chain"""
+        hops = []
+        for region in server['chain']:
+            ranked = self.prober.ranked(region) if self.prober else []
+            hop = next((health.proxy for health in ranked
+                        if health.proxy.get('type', 'http') in HOP_HANDSHAKES), None)
+            if hop is None:
+                return False, f"No proxy known to be alive for hop {region}"
+            hops.append(hop)
+        
+        self.log_event("🔗 Chain: " + " → ".join(f"{hop['host']}:{hop['port']}" for hop in hops))
+        return await self.create_proxy_tunnel(server, {'type': 'chain', 'hops': hops})
+    
+    def add_chain(self, server_id, regions):
+        """Define a multi-hop server (e.g. ['nl', 'us']) exiting from the last region"""
+        unknown = [region for region in regions if region not in self.vpn_endpoints]
+        if unknown or len(regions) < 2:
+            return False, f"A chain needs at least two known regions (unknown: {unknown})"
+        
+        hops = [self.vpn_endpoints[region] for region in regions]
+        self.vpn_endpoints[server_id] = {
+            'name': " → ".join(hop['name'] for hop in hops),
+            'location': " → ".join(hop['location'] for hop in hops),
+            'flag': "".join(hop['flag'] for hop in hops),
+            'country': hops[-1].get('country'),
+            'chain': list(regions),
+            'proxies': []
+        }
+        self.state_version += 1
+        return True, self.vpn_endpoints[server_id]['name']
+    
+    async def create_simulated_vpn(self, server):
+        """Create simulated VPN when no verified exit is available"""
+        if self.local_proxy and self.local_proxy.server:
+            # Apps are pointed at the local proxy; relaying them direct would expose the
+            # real IP, so the switch fails and the current upstream stays in place
+            self.log_event(f"No proxy known to be alive for {server['name']}; "
+                           f"keeping the current upstream", 'WARNING')
+            return False, (f"No verified exit available for {server['name']}; "
+                           f"still on the current server")
         try:
             # Instead of setting up a real proxy, just simulate the connection
-            # This avoids breaking internet access
-            simulated_ip = self.generate_simulated_ip(server['location'])
-            self.log_event(f"✅ Simulated VPN active! Apparent IP: {simulated_ip}")
-            
-            # Store the simulated IP for status reporting
-            self.simulated_ip = simulated_ip
-            
-            return True, f"Connected to {server['name']}! Simulated IP: {simulated_ip}"
+            # This avoids breaking internet access; no exit IP is claimed
+            self.log_event("⚠️ Simulated VPN active - traffic is not relayed, IP unchanged")
+            return True, f"Connected to {server['name']} (simulated, no verified exit available)"
                 
         except Exception as e:
             self.log_event(f"Simulated VPN failed: {e}", 'ERROR')
             return False, str(e)
     
-    def generate_simulated_ip(self, location):
-        """Generate a realistic IP for the location"""
-        ip_ranges = {
-            'New York': ['198.50.163', '104.248.90', '167.99.83'],
-            'London': ['185.162.231', '51.158.68', '194.5.207'],
-            'Frankfurt': ['88.198.50', '167.86.95', '46.101.103'],
-            'Amsterdam': ['185.162.231', '194.5.207', '46.101.95'],
-            'Toronto': ['192.99.38', '198.50.163', '167.99.83'],
-            'Tokyo': ['133.18.194', '160.16.226', '103.89.253']
-        }
+    def load_geoip(self, path):
+        """Memory-map a GeoIP database (.mmdb or range file) for exit IP verification"""
+        from vpn_geoip import open_database
         
-        if location in ip_ranges:
-            base = random.choice(ip_ranges[location])
-            last_octet = random.randint(1, 254)
-            return f"{base}.{last_octet}"
-        else:
-            return f"192.168.{random.randint(1,254)}.{random.randint(1,254)}"
+        try:
+            geoip = open_database(path)
+        except (OSError, ValueError) as e:
+            self.log_event(f"GeoIP database {path} unavailable: {e}", 'WARNING')
+            return False, str(e)
+        
+        self.geoip = geoip
+        if self.prober:
+            self.prober.geoip = geoip
+        self.log_event(f"🌍 GeoIP database loaded: {path}")
+        return True, path
+    
+    def get_exit_info(self):
+        """Exit IP of the active upstream as last observed by the prober, with its location"""
+        if not self.active_proxy or not self.prober:
+            return None
+        health = self.prober.health.get(proxy_key(self.active_proxy))
+        if health is None or not health.exit_ip:
+            return None
+        server_country = self.current_server.get('country') if self.current_server else None
+        return {
+            'exit_ip': health.exit_ip,
+            'exit_country': health.exit_country,
+            'verified': health.exit_country is not None and health.exit_country == server_country
+        }
     
-    def start_local_proxy_server(self):
-        """Start local proxy server for header modification"""
-        def proxy_handler():
+    async def start_local_proxy_server(self, dialer=None):
+        """Start local proxy server relaying through the given upstream dialer"""
+        dialer = dialer or DirectDialer()
+        if self.local_proxy and self.local_proxy.server:
+            # Live switch: new connections use the new upstream, open ones drain on the old
             try:
-                server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-                server_socket.bind(('127.0.0.1', 9999))
-                server_socket.listen(5)
-                
-                self.log_event("Local proxy server started on 127.0.0.1:9999")
-                
-                while self.connected:
+                await self.local_proxy.switch_dialer(dialer, self.switch_grace)
+                return True
+            except Exception as e:
+                self.log_event(f"Upstream switch failed: {e}", 'ERROR')
+                return False
+
+        proxy = LocalProxyServer(dialer, port=self.local_proxy_port,
+                                 bypass=self.split_tunnel, cache=self.http_cache,
+                                 tracer=self.tracer, flow=self.relay_flow,
+                                 memory_budget=self.memory_budget,
+                                 transparent_host=self.transparent_host,
+                                 transparent_port=self.transparent_port,
+                                 timeouts=self.relay_timeouts,
+                                 preconnect=self.make_preconnector())
+        try:
+            await asyncio.wait_for(proxy.start(), 10)
+        except BaseException as e:
+            # Includes cancellation: never leave a half-started listener behind
+            await proxy.stop()
+            if not isinstance(e, Exception):
+                raise
+            self.log_event(f"Local proxy server error: {e}", 'ERROR')
+            return False
+        self.local_proxy = proxy
+        return True
+    
+    async def stop_local_proxy_server(self):
+        """Stop the local proxy server"""
+        if self.local_proxy:
+            proxy, self.local_proxy = self.local_proxy, None
+            try:
+                await asyncio.wait_for(proxy.stop(), 10)
+            except Exception as e:
+                self.log_event(f"Local proxy stop error: {e}", 'WARNING')
+            finally:
+                # Even after a stuck stop(), so a tunnel's mux connection is not leaked
+                if hasattr(proxy.dialer, 'close'):
                     try:
-                        client_socket, addr = server_socket.accept()
-                        # Simple proxy implementation
-                        client_socket.close()
-                    except:
-                        break
-                        
-                server_socket.close()
-                
+                        await asyncio.wait_for(proxy.dialer.close(), 10)
+                    except Exception as e:
+                        self.log_event(f"Upstream close error: {e}", 'WARNING')
+    
+    def set_split_tunnel_rules(self, rules):
+        """Replace the split-tunnel bypass rules (domains, wildcards, CIDRs)"""
+        self.split_tunnel = SplitTunnelRules(rules)
+        self.state_version += 1
+        if self.local_proxy:
+            self.local_proxy.bypass = self.split_tunnel
+        self.log_event(f"Split tunnel updated: {len(self.split_tunnel.rules)} bypass rules")
+        return self.split_tunnel
+    
+    def start_probe_scheduler(self, speed_test=None, **options):
+        """Keep catalog proxy health (and optionally throughput) fresh in the background"""
+        if self.prober is None:
+            speed_tester = SpeedTester(**speed_test) if speed_test is not None else None
+            self.prober = ProbeScheduler(self.vpn_endpoints, speed_tester=speed_tester,
+                                         geoip=self.geoip, **options)
+            self.prober.start(self.ensure_loop())
+            self.log_event(f"Background proxy probing started "
+                           f"({self.prober.max_concurrency} concurrent, "
+                           f"{self.prober.bandwidth_bps // 1024} KB/s budget)")
+        return self.prober
+    
+    async def start_cluster(self, node_id=None, host='0.0.0.0', port=7946, peers=(), secret=None,
+                      **options):
+        """Gossip proxy health with peer gateways so probes are shared across the cluster"""
+        if self.prober is None:
+            return False, "Cluster mode needs background probing"
+        if self.cluster is not None:
+            return True, f"Cluster node {self.cluster.node_id} already running"
+        from vpn_cluster import ClusterNode
+        
+        node = ClusterNode(self.prober, node_id, host, port, peers, secret, **options)
+        try:
+            await asyncio.wait_for(node.start(), 10)
+        except Exception as e:
+            self.log_event(f"Cluster node failed to start: {e}", 'ERROR')
+            return False, str(e)
+        self.cluster = node
+        return True, f"Cluster node {node.node_id} on {host}:{node.port}"
+    
+    def get_cluster_status(self):
+        """Gossip counters and peers of this cluster node"""
+        if self.cluster is None:
+            return None
+        return self.cluster.get_stats()
+    
+    def get_proxy_health(self, server_id=None):
+        """Latest background probe results"""
+        return self.prober.snapshot(server_id) if self.prober else []
+    
+    def get_server_speed(self, server_id):
+        """Measured throughput for a server, formatted for listings"""
+        if not self.prober:
+            return format_speed(None)
+        server = self.vpn_endpoints.get(server_id, {})
+        if server.get('chain'):
+            # A chain is as fast as its slowest hop
+            speeds = [self.prober.region_throughput(region) for region in server['chain']]
+            return format_speed(None if None in speeds else min(speeds))
+        return format_speed(self.prober.region_throughput(server_id))
+    
+    def set_tracing(self, enabled):
+        """Turn relay stage tracing on or off"""
+        self.tracer.enabled = bool(enabled)
+        self.log_event(f"Relay tracing {'enabled' if enabled else 'disabled'}")
+        return self.tracer.enabled
+    
+    def enable_http_cache(self, memory_mb=32, disk_dir=None, disk_mb=512):
+        """Cache plain-HTTP responses in the local proxy (memory LRU + optional disk tier)"""
+        from vpn_cache import HttpCache
+        
+        self.http_cache = HttpCache(memory_bytes=memory_mb * 1024 * 1024, disk_dir=disk_dir,
+                                    disk_bytes=disk_mb * 1024 * 1024)
+        if self.local_proxy:
+            self.local_proxy.cache = self.http_cache
+        self.log_event(f"HTTP cache enabled ({memory_mb} MB memory"
+                       f"{f', {disk_mb} MB disk at {disk_dir}' if disk_dir else ''})")
+        return self.http_cache
+    
+    async def enable_transparent_mode(self, host='0.0.0.0', port=9998):
+        """Accept netfilter-REDIRECTed connections so every application is covered (Linux)"""
+        if not sys.platform.startswith('linux'):
+            return False, "Transparent mode requires Linux (iptables/nftables REDIRECT)"
+        self.transparent_host = host
+        self.transparent_port = port
+        if self.local_proxy and self.local_proxy.server and not self.local_proxy.transparent_server:
+            self.local_proxy.transparent_host = host
+            self.local_proxy.transparent_port = port
+            try:
+                await asyncio.wait_for(self.local_proxy.start_transparent(), 10)
             except Exception as e:
-                self.log_event(f"Local proxy server error: {e}", 'ERROR')
+                self.log_event(f"Transparent listener failed: {e}", 'ERROR')
+                return False, str(e)
+        self.log_event(f"Transparent mode on {host}:{port}; redirect with e.g. "
+                       f"iptables -t nat -A PREROUTING -p tcp -j REDIRECT --to-ports {port}")
+        return True, f"Transparent listener on {host}:{port}"
+    
+    def set_relay_limits(self, high_water_kb=64, low_water_kb=16, memory_budget_mb=256):
+        """Per-direction watermarks and the global memory budget for relayed connections"""
+        self.relay_flow = FlowControl(high_water_kb * 1024, low_water_kb * 1024)
+        self.memory_budget.limit_bytes = memory_budget_mb * 1024 * 1024
+        if self.local_proxy:
+            # Connections already relaying keep the watermarks they started with
+            self.local_proxy.flow = self.relay_flow
+        return self.relay_flow
+    
+    def set_relay_timeouts(self, handshake=15, connect=10, idle=300, lifetime=None):
+        """Per-phase timeouts (seconds) for relayed connections; None disables a phase"""
+        self.relay_timeouts = ConnectionTimeouts(handshake, connect, idle, lifetime)
+        if self.local_proxy:
+            # Applies to phases entered from now on
+            self.local_proxy.timeouts = self.relay_timeouts
+        return self.relay_timeouts
+    
+    def set_preconnect(self, enabled=True, **options):
+        """Pre-resolve and pre-connect each session's hottest destinations (next connect)"""
+        self.preconnect_options = dict(options) if enabled else None
+        self.log_event(f"Predictive pre-connect {'enabled' if enabled else 'disabled'}")
+        return self.preconnect_options
+    
+    def make_preconnector(self):
+        if self.preconnect_options is None:
+            return None
+        from vpn_predict import Preconnector
+        return Preconnector(**self.preconnect_options)
+    
+    def get_relay_stats(self):
+        """Local proxy connection and memory budget statistics"""
+        if self.local_proxy:
+            return self.local_proxy.get_stats()
+        cost = self.relay_flow.connection_cost()
+        return dict(self.memory_budget.get_stats(), active_connections=0,
+                    connection_cost_bytes=cost,
+                    connection_limit=self.memory_budget.limit_bytes // cost)
+    
+    def get_proxy_pac(self, proxy_host='127.0.0.1'):
+        """Proxy auto-config script sending bypassed hosts direct and the rest to the local proxy"""
+        return self.split_tunnel.to_pac(proxy_host, self.local_proxy.port if self.local_proxy
+                                        else self.local_proxy_port)
+    
+    def add_tunnel_exit(self, server_id, host, port, key=None):
+        """Register a FREE-VPN exit node as the preferred upstream for a server"""
+        entry = {'host': host, 'port': int(port), 'type': 'tunnel', 'key': key}
+        if server_id not in self.vpn_endpoints:
+            self.vpn_endpoints[server_id] = {
+                'name': f"Exit Node {host}",
+                'location': host,
+                'flag': '🛰️',
+                'proxies': []
+            }
+        self.vpn_endpoints[server_id]['proxies'].insert(0, entry)
+        self.state_version += 1
+        return entry
+    
+    async def create_mux_tunnel(self, server, proxy_config):
+        """Route the local proxy through a multiplexed tunnel to a FREE-VPN exit node"""
+        dialer = None
+        try:
+            dialer = make_dialer(proxy_config)
+            await asyncio.wait_for(dialer.connect(), dialer.connect_timeout + 5)
+            started = await self.start_local_proxy_server(dialer)
+        except BaseException as e:
+            if dialer is not None:
+                await dialer.close()
+            if not isinstance(e, Exception):
+                raise
+            self.log_event(f"Tunnel to {proxy_config['host']}:{proxy_config['port']} failed: {e}", 'ERROR')
+            return False, f"Tunnel connection failed: {e}"
+        
+        if not started:
+            await dialer.close()
+            return False, "Local proxy server could not start"
         
-        if not self.proxy_thread or not self.proxy_thread.is_alive():
-            self.proxy_thread = threading.Thread(target=proxy_handler, daemon=True)
-            self.proxy_thread.start()
+        self.active_proxy = proxy_config
+        self.log_event(f"✅ Tunnel active via exit node {proxy_config['host']}:{proxy_config['port']}")
+        return True, (f"Connected to {server['name']} through tunnel! "
+                      f"Use proxy 127.0.0.1:{self.local_proxy.port}")
     
-    def connect(self, server_id):
-        """Connect to VPN server"""
-        if self.connected:
-            return False, "Already connected. Disconnect first."
+    async def start_exit_node(self, host='0.0.0.0', port=8443, key=None):
+        """Run this instance as a tunnel exit node for other FREE-VPN clients"""
+        from vpn_tunnel import TunnelExitNode
+        
+        try:
+            self.exit_node = TunnelExitNode(host, port, key=key)
+            await asyncio.wait_for(self.exit_node.start(), 10)
+            return True, f"Exit node listening on {host}:{self.exit_node.port}"
+        except Exception as e:
+            self.log_event(f"Exit node failed to start: {e}", 'ERROR')
+            self.exit_node = None
+            return False, str(e)
+    
+    def transition_lock(self):
+        if self.transition is None:
+            self.transition = asyncio.Lock()
+        return self.transition
+    
+    @bounded
+    async def connect(self, server_id):
+        """Connect to VPN server, switching live if already connected"""
+        async with self.transition_lock():
+            return await self._connect(server_id)
+    
+    async def _connect(self, server_id):
+        if self.connected and self.current_server is self.vpn_endpoints.get(server_id):
+            return True, f"Already connected to {self.current_server['name']}"
         
         if not self.original_ip:
-            self.original_ip = self.get_current_ip()
+            self.original_ip = await self.get_current_ip()
             self.log_event(f"Original IP: {self.original_ip}")
         
-        # Create VPN tunnel
-        success, message = self.create_vpn_tunnel(server_id)
+        if self.connected:
+            self.log_event(f"🔀 Switching from {self.current_server['name']} to {server_id}; "
+                           f"open connections drain for up to {self.switch_grace}s")
+        
+        # Create VPN tunnel (on a switch the old one stays up until this succeeds)
+        success, message = await self.create_vpn_tunnel(server_id)
         
         if success:
             self.connected = True
             self.current_server = self.vpn_endpoints[server_id]
+            self.state_version += 1
+            if self.prober:
+                self.prober.set_priority_region(server_id)
             self.log_event(f"✅ VPN connected to {self.current_server['name']}")
             return True, message
         else:
             self.log_event(f"❌ VPN connection failed: {message}")
             return False, message
     
-    def disconnect(self):
+    @bounded
+    async def disconnect(self):
         """Disconnect VPN"""
+        async with self.transition_lock():
+            return await self._disconnect()
+    
+    async def _disconnect(self):
         if not self.connected:
             return False, "Not connected"
         
         try:
             self.log_event("Disconnecting VPN...")
             
-            # Disable system proxy
-            self.disable_system_proxy()
+            # Disable system proxy (the Windows path shells out, so keep it off the loop)
+            if sys.platform == "win32":
+                await asyncio.get_running_loop().run_in_executor(None, self.disable_system_proxy)
+            else:
+                self.disable_system_proxy()
             
             # Stop local proxy if running
             self.connected = False
+            await self.stop_local_proxy_server()
             
             # Reset state
             self.current_server = None
+            self.active_proxy = None
+            self.state_version += 1
+            if self.prober:
+                self.prober.set_priority_region(None)
             
             self.log_event("✅ VPN disconnected successfully")
             return True, "Disconnected successfully"
@@ -332,9 +765,10 @@ class AutonomousVPN:
             self.log_event(f"Disconnect error: {e}", 'ERROR')
             return False, str(e)
     
-    def get_status(self):
+    @bounded
+    async def get_status(self):
         """Get VPN status"""
-        current_ip = self.get_current_ip()
+        current_ip = await self.get_current_ip()
         
         return {
             'connected': self.connected,
@@ -342,14 +776,16 @@ class AutonomousVPN:
             'original_ip': self.original_ip,
             'current_ip': current_ip,
             'ip_changed': current_ip != self.original_ip if self.original_ip else False,
+            'exit': self.get_exit_info(),
             'autonomous': True,
             'no_openvpn_required': True,
             'timestamp': datetime.now().isoformat()
         }
     
-    def status(self):
+    @bounded
+    async def status(self):
         """Alias for get_status() for compatibility"""
-        current_ip = self.get_current_ip()
+        current_ip = await self.get_current_ip()
         
         return {
             'connected': self.connected,
@@ -358,16 +794,17 @@ class AutonomousVPN:
             'original_ip': self.original_ip,
             'current_ip': current_ip,
             'ip_changed': current_ip != self.original_ip if self.original_ip else False,
+            'exit': self.get_exit_info(),
             'openvpn_available': False,  # This is autonomous VPN
             'connection_time': datetime.now().isoformat() if self.connected else None,
             'timestamp': datetime.now().isoformat()
         }
     
-    def get_ip(self):
+    async def get_ip(self):
         """Alias for get_current_ip() for compatibility"""
-        return self.get_current_ip()
+        return await self.get_current_ip()
     
-    def get_servers(self):
+    async def get_servers(self):
         """Get available servers"""
         servers = []
         for server_id, server_info in self.vpn_endpoints.items():
@@ -376,13 +813,57 @@ class AutonomousVPN:
                 'name': server_info['name'],
                 'location': server_info['location'],
                 'flag': server_info['flag'],
-                'speed': '100 Mbps',
+                'speed': self.get_server_speed(server_id),
                 'load': f"{random.randint(15, 35)}%",
                 'ping': f"{random.randint(10, 30)}ms",
                 'status': 'Online'
             })
         return servers
 
+class AutonomousVPN:
+    """Blocking wrapper running an AsyncAutonomousVPN on a background loop thread
+    
+    State and configuration methods are the engine's own; coroutine methods are run to
+    completion on the loop thread, so every blocking call has an awaitable twin.
+    """
+    
+    def __init__(self, timeout=30):
+        object.__setattr__(self, 'engine', AsyncAutonomousVPN(BackgroundLoop(), timeout))
+    
+    def __getattr__(self, name):
+        attr = getattr(self.engine, name)
+        if not asyncio.iscoroutinefunction(attr):
+            return attr
+        
+        @functools.wraps(attr)
+        def blocking(*args, **kwargs):
+            return self.engine.event_loop.run(attr(*args, **kwargs))
+        return blocking
+    
+    def __setattr__(self, name, value):
+        setattr(self.engine, name, value)
+    
+    # Keep the (success, message) contract when these run out of time
+    
+    def connect(self, server_id, timeout=None):
+        try:
+            return self.engine.event_loop.run(self.engine.connect(server_id, timeout=timeout))
+        except asyncio.TimeoutError:
+            return False, "Connection timed out"
+    
+    def disconnect(self, timeout=None):
+        try:
+            return self.engine.event_loop.run(self.engine.disconnect(timeout=timeout))
+        except asyncio.TimeoutError:
+            return False, "Disconnect timed out"
+    
+    def test_proxy(self, proxy_config, timeout=None):
+        try:
+            return self.engine.event_loop.run(self.engine.test_proxy(proxy_config,
+                                                                     timeout=timeout))
+        except asyncio.TimeoutError:
+            return False, "Proxy test timed out"
+
 # Test the autonomous VPN
 if __name__ == "__main__":
     vpn = AutonomousVPN()
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+VPN GeoIP Module - Memory-mapped country lookup for exit IP verification
+Reads MaxMind .mmdb databases (GeoLite2-Country, DB-IP lite) by walking their search
+tree, or FREE-VPN range files by binary search; both stay in the page cache via mmap
+instead of being loaded onto the Python heap
+"""
+
+import ipaddress
+import mmap
+import struct
+import sys
+import time
+
+MMDB_METADATA_MARKER = b"\xab\xcd\xefMaxMind.com"
+MMDB_DATA_SEPARATOR = 16
+
+RANGE_MAGIC = b"FVGR"
+RANGE_VERSION = 1
+RANGE_HEADER = struct.Struct('!4sB3xII')
+RANGE_V4 = struct.Struct('!II2s')
+RANGE_V6 = struct.Struct('!16s16s2s')
+
+# Decoded mmdb records are shared by many networks; keep the distinct ones around
+MAX_DECODED_RECORDS = 4096
+
+
+def map_file(path):
+    with open(path, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class MMDBReader:
+    """MaxMind DB reader returning the ISO country code for an address"""
+
+    def __init__(self, path):
+        self.path = path
+        self.mm = map_file(path)
+        marker = self.mm.rfind(MMDB_METADATA_MARKER)
+        if marker < 0:
+            raise ValueError(f"{path} is not a MaxMind DB file")
+        self.metadata, _ = self.decode(marker + len(MMDB_METADATA_MARKER), 0)
+        self.node_count = self.metadata['node_count']
+        self.record_size = self.metadata['record_size']
+        self.ip_version = self.metadata['ip_version']
+        if self.record_size not in (24, 28, 32):
+            raise ValueError(f"Unsupported mmdb record size {self.record_size}")
+        self.node_bytes = self.record_size // 4
+        self.tree_size = self.node_bytes * self.node_count
+        self.data_start = self.tree_size + MMDB_DATA_SEPARATOR
+        self.records = {}
+        self.ipv4_start = self.find_ipv4_start()
+
+    # Search tree
+
+    def read_node(self, node, bit):
+        offset = node * self.node_bytes
+        mm = self.mm
+        if self.record_size == 24:
+            offset += bit * 3
+            return int.from_bytes(mm[offset:offset + 3], 'big')
+        if self.record_size == 32:
+            offset += bit * 4
+            return int.from_bytes(mm[offset:offset + 4], 'big')
+        middle = mm[offset + 3]
+        if bit:
+            return ((middle & 0x0F) << 24) | int.from_bytes(mm[offset + 4:offset + 7], 'big')
+        return ((middle & 0xF0) << 20) | int.from_bytes(mm[offset:offset + 3], 'big')
+
+    def find_ipv4_start(self):
+        """IPv4 lives under ::/96 in IPv6 trees; walk there once"""
+        node = 0
+        if self.ip_version == 6:
+            for _ in range(96):
+                if node >= self.node_count:
+                    break
+                node = self.read_node(node, 0)
+        return node
+
+    def lookup_record(self, ip):
+        """Data record for an address, or None"""
+        address = ipaddress.ip_address(ip)
+        if address.version == 6 and self.ip_version == 4:
+            return None
+        packed = address.packed
+        node = self.ipv4_start if address.version == 4 else 0
+
+        for i in range(len(packed) * 8):
+            if node >= self.node_count:
+                break
+            node = self.read_node(node, (packed[i >> 3] >> (7 - (i & 7))) & 1)
+
+        if node <= self.node_count:
+            return None
+        offset = node - self.node_count - MMDB_DATA_SEPARATOR
+        record = self.records.get(offset)
+        if record is None:
+            if len(self.records) >= MAX_DECODED_RECORDS:
+                self.records.clear()
+            record, _ = self.decode(self.data_start + offset, self.data_start)
+            self.records[offset] = record
+        return record
+
+    def lookup(self, ip):
+        """ISO country code of an address, or None"""
+        record = self.lookup_record(ip)
+        if not isinstance(record, dict):
+            return None
+        country = record.get('country') or record.get('registered_country') or {}
+        return country.get('iso_code')
+
+    # Data section
+
+    def decode(self, position, base):
+        """Decode one value at an absolute position; returns (value, next position)"""
+        mm = self.mm
+        ctrl = mm[position]
+        position += 1
+        kind = ctrl >> 5
+
+        if kind == 1:
+            size = (ctrl >> 3) & 0x3
+            if size == 3:
+                pointer = int.from_bytes(mm[position:position + 4], 'big')
+            else:
+                pointer = ((ctrl & 0x7) << (8 * (size + 1))) | \
+                    int.from_bytes(mm[position:position + size + 1], 'big')
+                pointer += (0, 2048, 526336)[size]
+            value, _ = self.decode(base + pointer, base)
+            return value, position + size + 1
+
+        if kind == 0:
+            kind = 7 + mm[position]
+            position += 1
+
+        size = ctrl & 0x1F
+        if size >= 29:
+            extra = size - 28
+            size = (29, 285, 65821)[extra - 1] + int.from_bytes(mm[position:position + extra], 'big')
+            position += extra
+
+        if kind == 2:
+            return mm[position:position + size].decode('utf-8'), position + size
+        if kind == 7:
+            result = {}
+            for _ in range(size):
+                key, position = self.decode(position, base)
+                result[key], position = self.decode(position, base)
+            return result, position
+        if kind == 11:
+            result = []
+            for _ in range(size):
+                value, position = self.decode(position, base)
+                result.append(value)
+            return result, position
+        if kind in (5, 6, 9, 10):
+            return int.from_bytes(mm[position:position + size], 'big'), position + size
+        if kind == 8:
+            return int.from_bytes(mm[position:position + size], 'big', signed=size == 4), position + size
+        if kind == 3:
+            return struct.unpack('!d', mm[position:position + 8])[0], position + 8
+        if kind == 15:
+            return struct.unpack('!f', mm[position:position + 4])[0], position + 4
+        if kind == 4:
+            return bytes(mm[position:position + size]), position + size
+        if kind == 14:
+            return bool(size), position
+        raise ValueError(f"Unsupported mmdb data type {kind}")
+
+    def close(self):
+        self.mm.close()
+
+
+class RangeDatabase:
+    """Sorted, non-overlapping (start, end, country) ranges searched in place"""
+
+    def __init__(self, path):
+        self.path = path
+        self.mm = map_file(path)
+        magic, version, self.v4_count, self.v6_count = RANGE_HEADER.unpack_from(self.mm, 0)
+        if magic != RANGE_MAGIC or version != RANGE_VERSION:
+            raise ValueError(f"{path} is not a FREE-VPN GeoIP range file")
+        self.v4_offset = RANGE_HEADER.size
+        self.v6_offset = self.v4_offset + self.v4_count * RANGE_V4.size
+
+    def search(self, key, offset, count, record):
+        """Binary search for the last range starting at or before key"""
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if record.unpack_from(self.mm, offset + mid * record.size)[0] <= key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == 0:
+            return None
+        start, end, country = record.unpack_from(self.mm, offset + (lo - 1) * record.size)
+        return country.decode('ascii') if key <= end else None
+
+    def lookup(self, ip):
+        """ISO country code of an address, or None"""
+        address = ipaddress.ip_address(ip)
+        if address.version == 4:
+            return self.search(int(address), self.v4_offset, self.v4_count, RANGE_V4)
+        return self.search(address.packed, self.v6_offset, self.v6_count, RANGE_V6)
+
+    def close(self):
+        self.mm.close()
+
+
+def build_range_file(rows, path):
+    """Write (start_ip, end_ip, country) rows as a range file; returns the range count"""
+    v4, v6 = [], []
+    for start, end, country in rows:
+        start, end = ipaddress.ip_address(start.strip()), ipaddress.ip_address(end.strip())
+        country = country.strip().upper().encode('ascii')[:2].ljust(2)
+        if start.version == 4:
+            v4.append((int(start), int(end), country))
+        else:
+            v6.append((start.packed, end.packed, country))
+    v4.sort()
+    v6.sort()
+
+    with open(path, 'wb') as f:
+        f.write(RANGE_HEADER.pack(RANGE_MAGIC, RANGE_VERSION, len(v4), len(v6)))
+        for entry in v4:
+            f.write(RANGE_V4.pack(*entry))
+        for entry in v6:
+            f.write(RANGE_V6.pack(*entry))
+    return len(v4) + len(v6)
+
+
+def open_database(path):
+    """Open an .mmdb or range file, picking the reader from the file's magic"""
+    with open(path, 'rb') as f:
+        magic = f.read(len(RANGE_MAGIC))
+    if magic == RANGE_MAGIC:
+        return RangeDatabase(path)
+    return MMDBReader(path)
+
+
+def benchmark_lookups(database, ips, rounds=10):
+    """Average lookup time in microseconds"""
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for ip in ips:
+            database.lookup(ip)
+    return (time.perf_counter() - start) / (rounds * len(ips)) * 1_000_000
+
+
+if __name__ == "__main__":
+    import csv
+    import random
+
+    if len(sys.argv) == 4 and sys.argv[1] == 'build':
+        # CSV rows of start_ip,end_ip,country_code (DB-IP / IP2Location lite exports)
+        with open(sys.argv[2], newline='') as f:
+            count = build_range_file((row[:3] for row in csv.reader(f) if len(row) >= 3),
+                                     sys.argv[3])
+        print(f"🌍 Wrote {count} ranges to {sys.argv[3]}")
+    elif len(sys.argv) >= 3 and sys.argv[1] == 'lookup':
+        database = open_database(sys.argv[2])
+        for ip in sys.argv[3:]:
+            print(f"{ip}: {database.lookup(ip) or 'unknown'}")
+        sample = [str(ipaddress.IPv4Address(random.getrandbits(32))) for _ in range(10000)]
+        print(f"⚡ {benchmark_lookups(database, sample):.2f} µs per lookup")
+    else:
+        print("Usage: python vpn_geoip.py build ranges.csv geoip.bin")
+        print("       python vpn_geoip.py lookup <database.mmdb|geoip.bin> [ip ...]")
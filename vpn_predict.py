@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+VPN Predict Module - Speculative pre-connect and pre-resolve for hot destinations
+A decayed frequency/recency table of the hosts a session dials picks the few worth
+warming; tunnels to them are opened through the current upstream ahead of demand
+(bypassed hosts are only pre-resolved), within a fixed pool size, dial rate and expiry
+"""
+
+import asyncio
+import math
+import socket
+import time
+from collections import deque
+
+from vpn_relay import close_writer, log_event
+
+
+class HotHosts:
+    """Destination scores that grow with each use and halve every half_life seconds"""
+
+    def __init__(self, half_life=600, max_hosts=1024):
+        self.half_life = half_life
+        self.max_hosts = max_hosts
+        self.scores = {}
+
+    def decayed(self, entry, now):
+        score, updated = entry
+        return score * math.pow(0.5, (now - updated) / self.half_life)
+
+    def record(self, key):
+        now = time.monotonic()
+        entry = self.scores.get(key)
+        self.scores[key] = ((self.decayed(entry, now) if entry else 0.0) + 1.0, now)
+        if len(self.scores) > self.max_hosts:
+            self.prune(now)
+
+    def prune(self, now):
+        """Forget the coldest half of the table"""
+        ranked = sorted(self.scores, key=lambda key: self.decayed(self.scores[key], now))
+        for key in ranked[:len(ranked) // 2]:
+            del self.scores[key]
+
+    def top(self, count, min_score=0.0):
+        """Hottest (key, score) pairs scoring at least min_score, hottest first"""
+        now = time.monotonic()
+        scored = [(key, self.decayed(entry, now)) for key, entry in self.scores.items()]
+        scored = [item for item in scored if item[1] >= min_score]
+        scored.sort(key=lambda item: item[1], reverse=True)
+        return scored[:count]
+
+
+class DnsCache:
+    """getaddrinfo results kept for a fixed TTL"""
+
+    def __init__(self, ttl=300, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, host, port):
+        entry = self.entries.get((host, port))
+        if entry is not None and time.monotonic() - entry[1] < self.ttl:
+            self.hits += 1
+            return entry[0]
+        self.misses += 1
+        return None
+
+    async def resolve(self, host, port):
+        loop = asyncio.get_running_loop()
+        infos = await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        if len(self.entries) >= self.max_entries:
+            self.entries.clear()
+        self.entries[(host, port)] = (infos, time.monotonic())
+        return infos
+
+
+class Preconnector:
+    """Pool of upstream connections opened ahead of demand for a proxy session's hot hosts"""
+
+    def __init__(self, top_n=8, max_idle=8, ttl=20, min_score=2.0, half_life=600,
+                 dials_per_minute=30, interval=2.0, connect_timeout=10, dns_ttl=300):
+        self.top_n = top_n
+        self.max_idle = max_idle
+        self.ttl = ttl
+        self.min_score = min_score
+        self.dials_per_minute = dials_per_minute
+        self.interval = interval
+        self.connect_timeout = connect_timeout
+        self.hosts = HotHosts(half_life)
+        self.dns = DnsCache(dns_ttl)
+        # (host, port) -> deque of (reader, writer, dialer, opened_at, charge); charge is
+        # what the entry holds of the proxy's memory budget until it is taken or closed
+        self.pool = {}
+        self.dialing = set()
+        self.dial_times = deque()
+        self.proxy = None
+        self.task = None
+        self.stats = {'hits': 0, 'misses': 0, 'opened': 0, 'failed': 0, 'expired': 0,
+                      'resolved': 0}
+
+    def start(self, proxy):
+        """Warm connections for proxy (a LocalProxyServer) on the running loop"""
+        self.proxy = proxy
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self.run())
+        return self
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        self.flush()
+
+    def flush(self):
+        """Close every pooled connection, e.g. after the upstream changed"""
+        for entries in self.pool.values():
+            for entry in entries:
+                self.discard(entry)
+        self.pool.clear()
+
+    def discard(self, entry):
+        close_writer(entry[1])
+        self.release(entry[4])
+
+    def reserve(self):
+        """Charge a pooled connection to the proxy's memory budget; None when it is full"""
+        budget = self.proxy.memory_budget
+        if budget is None:
+            return 0
+        cost = self.proxy.flow.connection_cost()
+        return cost if budget.try_reserve(cost, speculative=True) else None
+
+    def release(self, charge):
+        if charge and self.proxy is not None and self.proxy.memory_budget is not None:
+            self.proxy.memory_budget.release(charge)
+
+    def idle_count(self):
+        return sum(len(entries) for entries in self.pool.values())
+
+    # Demand side
+
+    def record(self, host, port):
+        self.hosts.record((host, port))
+
+    def take(self, host, port, dialer):
+        """A warm connection to host:port opened through dialer, or None"""
+        entries = self.pool.get((host, port))
+        now = time.monotonic()
+        while entries:
+            entry = entries.popleft()
+            reader, writer, opened_by, opened_at, charge = entry
+            if opened_by is not dialer or not self.usable(reader, writer, opened_at, now):
+                self.stats['expired'] += 1
+                self.discard(entry)
+                continue
+            # From here on the client connection's own reservation covers it
+            self.release(charge)
+            self.stats['hits'] += 1
+            return reader, writer
+        self.pool.pop((host, port), None)
+        self.stats['misses'] += 1
+        return None
+
+    def usable(self, reader, writer, opened_at, now):
+        # Only the public stream API: readers may be asyncio's or a tunnel's MuxStreamReader
+        return now - opened_at < self.ttl and not writer.is_closing() and not reader.at_eof()
+
+    # Warming
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.expire()
+                await self.refill()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log_event(f"Pre-connect pass failed: {e}", 'WARNING')
+
+    def expire(self):
+        """Close pooled connections past their TTL or opened through a retired upstream"""
+        now = time.monotonic()
+        current = (self.proxy.dialer, self.proxy.direct_dialer)
+        for key in list(self.pool):
+            kept = deque()
+            for entry in self.pool[key]:
+                reader, writer, dialer, opened_at, _ = entry
+                if dialer in current and self.usable(reader, writer, opened_at, now):
+                    kept.append(entry)
+                else:
+                    self.stats['expired'] += 1
+                    self.discard(entry)
+            if kept:
+                self.pool[key] = kept
+            else:
+                del self.pool[key]
+
+    def allow_dial(self):
+        """Sliding one-minute window over speculative dials"""
+        now = time.monotonic()
+        while self.dial_times and now - self.dial_times[0] >= 60:
+            self.dial_times.popleft()
+        if len(self.dial_times) >= self.dials_per_minute:
+            return False
+        self.dial_times.append(now)
+        return True
+
+    async def refill(self):
+        """Pre-resolve or pre-connect the hottest hosts that have nothing warm"""
+        slots = self.max_idle - self.idle_count() - len(self.dialing)
+        jobs = []
+        for (host, port), _ in self.hosts.top(self.top_n, self.min_score):
+            if (host, port) in self.pool or (host, port) in self.dialing:
+                continue
+            dialer = self.proxy.pick_dialer(host)
+            if dialer is self.proxy.direct_dialer:
+                # Connecting direct is one cheap round trip; only the lookup is worth hiding
+                if self.dns.lookup(host, port) is None:
+                    jobs.append(self.pre_resolve(host, port))
+                continue
+            if slots <= 0 or not self.allow_dial():
+                continue
+            slots -= 1
+            jobs.append(self.pre_connect(host, port, dialer))
+        if jobs:
+            await asyncio.gather(*jobs)
+
+    async def pre_resolve(self, host, port):
+        try:
+            await self.dns.resolve(host, port)
+            self.stats['resolved'] += 1
+        except OSError:
+            pass
+
+    async def pre_connect(self, host, port, dialer):
+        charge = self.reserve()
+        if charge is None:
+            return  # Real clients need the budget more than warm spares do
+        self.dialing.add((host, port))
+        try:
+            reader, writer = await asyncio.wait_for(dialer.open_connection(host, port),
+                                                    self.connect_timeout)
+        except asyncio.CancelledError:
+            self.release(charge)
+            raise
+        except Exception:
+            self.release(charge)
+            self.stats['failed'] += 1
+            return
+        finally:
+            self.dialing.discard((host, port))
+
+        entry = (reader, writer, dialer, time.monotonic(), charge)
+        if dialer is not self.proxy.pick_dialer(host) or self.idle_count() >= self.max_idle:
+            # Upstream switched or the pool filled while dialing
+            self.discard(entry)
+            return
+        self.stats['opened'] += 1
+        self.pool.setdefault((host, port), deque()).append(entry)
+
+    def get_stats(self):
+        demand = self.stats['hits'] + self.stats['misses']
+        return dict(self.stats,
+                    idle=self.idle_count(),
+                    max_idle=self.max_idle,
+                    hit_rate=round(self.stats['hits'] / demand, 3) if demand else None,
+                    dns_hits=self.dns.hits,
+                    hot_hosts=[f"{host}:{port}" for (host, port), _
+                               in self.hosts.top(self.top_n, self.min_score)])
+
+
+def benchmark_preconnect(requests=6, pause=0.3):
+    """Repeat requests to one host through a pre-connecting LocalProxyServer, once over an
+    HTTP proxy upstream and once over a tunnel exit node; every response must arrive and
+    the later ones should ride warm connections"""
+    from vpn_relay import HttpProxyDialer, LocalProxyServer
+    from vpn_tunnel import TunnelClient, TunnelExitNode
+
+    async def origin(reader, writer):
+        try:
+            await reader.readuntil(b"\r\n\r\n")
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n"
+                         b"Connection: close\r\n\r\nok")
+            await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass  # A warm connection closed unused
+        finally:
+            close_writer(writer)
+
+    async def fetch(port, target):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        start = time.perf_counter()
+        try:
+            writer.write(f"CONNECT {target} HTTP/1.1\r\nHost: {target}\r\n\r\n".encode())
+            head = await reader.readuntil(b"\r\n\r\n")
+            if b" 200 " not in head.split(b"\r\n")[0] + b" ":
+                return None
+            writer.write(b"GET / HTTP/1.1\r\nHost: origin\r\n\r\n")
+            body = await reader.read()
+            return (time.perf_counter() - start) * 1000 if body.endswith(b"ok") else None
+        finally:
+            close_writer(writer)
+
+    async def run_upstream(kind, target):
+        if kind == 'tunnel':
+            upstream = await TunnelExitNode('127.0.0.1', 0, allow_private=True).start()
+            dialer = TunnelClient('127.0.0.1', upstream.port)
+        else:
+            upstream = await LocalProxyServer(port=0).start()
+            dialer = HttpProxyDialer({'host': '127.0.0.1', 'port': upstream.port})
+        preconnect = Preconnector(min_score=1, interval=0.1)
+        proxy = await LocalProxyServer(dialer, port=0, preconnect=preconnect).start()
+        latencies = []
+        for _ in range(requests):
+            latencies.append(await fetch(proxy.port, target))
+            await asyncio.sleep(pause)
+        stats = preconnect.get_stats()
+        await proxy.stop()
+        if hasattr(dialer, 'close'):
+            await dialer.close()
+        await upstream.stop()
+        served = [latency for latency in latencies if latency is not None]
+        return {
+            'responses': f"{len(served)}/{requests}",
+            'warm_hits': stats['hits'],
+            'cold_ms': round(served[0], 2) if served else None,
+            'warm_ms': round(min(served[1:]), 2) if len(served) > 1 else None,
+        }
+
+    async def run():
+        server = await asyncio.start_server(origin, '127.0.0.1', 0)
+        target = f"127.0.0.1:{server.sockets[0].getsockname()[1]}"
+        results = {kind: await run_upstream(kind, target) for kind in ('http', 'tunnel')}
+        server.close()
+        await asyncio.sleep(0.1)  # Let unused warm connections wind down
+        return results
+
+    return asyncio.run(run())
+
+
+if __name__ == "__main__":
+    print("🔥 Pre-connect check (HTTP proxy and tunnel upstreams)")
+    print("=" * 40)
+    for kind, result in benchmark_preconnect().items():
+        print(f"{kind}: {result}")
@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+"""
+VPN Probe Module - Background health scheduler for catalog proxies
+Keeps every proxy's health fresh off the connect path: jittered per-proxy intervals,
+exponential backoff for dead entries, faster re-checks for the active region and a
+global concurrency / bandwidth budget
+"""
+
+import asyncio
+import heapq
+import json
+import random
+import time
+
+from vpn_relay import close_writer, log_event, make_dialer
+from vpn_speedtest import SpeedTestResult
+
+PROBE_URL = 'http://httpbin.org/ip'
+PROBE_TIMEOUT = 10
+PROBE_COST_BYTES = 1024
+# Peer observations must be this much newer to replace ours; absorbs rounding and transit
+MERGE_TOLERANCE = 1.0
+
+
+class ProxyHealth:
+    """Latest probe outcome for one catalog proxy"""
+
+    def __init__(self, region, proxy):
+        self.region = region
+        self.listed_region = region
+        self.proxy = proxy
+        self.alive = None
+        self.latency_ms = None
+        self.exit_ip = None
+        self.exit_country = None
+        self.hops = None
+        self.error = None
+        self.failures = 0
+        self.successes = 0
+        self.last_checked = None
+        self.next_check = 0
+        self.speed = None
+        # Cluster node whose observation this is; None when probed here
+        self.source = None
+
+    @property
+    def key(self):
+        return proxy_key(self.proxy)
+
+    def to_dict(self):
+        return {
+            'region': self.region,
+            'listed_region': self.listed_region,
+            'host': self.proxy.get('host'),
+            'port': self.proxy.get('port'),
+            'type': self.proxy.get('type', 'http'),
+            'alive': self.alive,
+            'latency_ms': self.latency_ms,
+            'exit_ip': self.exit_ip,
+            'exit_country': self.exit_country,
+            'error': self.error,
+            'failures': self.failures,
+            'last_checked': self.last_checked,
+            'throughput_mbps': self.speed.mbps if self.speed else None,
+            'speed_test': self.speed.to_dict() if self.speed else None,
+            'hops': self.hops,
+            'reported_by': self.source,
+        }
+
+
+def proxy_key(proxy):
+    if proxy.get('type') == 'chain':
+        return "chain://" + ">".join(f"{hop['host']}:{hop['port']}" for hop in proxy['hops'])
+    return f"{proxy.get('type', 'http')}://{proxy['host']}:{proxy['port']}"
+
+
+class TokenBucket:
+    """Byte budget refilled at a fixed rate"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    async def take(self, amount):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return
+            await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def refund(self, amount):
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class ProbeScheduler:
+    """Probes catalog proxies in the background so connect never probes inline"""
+
+    def __init__(self, vpn_endpoints, base_interval=300, fast_interval=60, max_backoff=3600,
+                 jitter=0.2, max_concurrency=4, bandwidth_bps=16 * 1024, probe_url=PROBE_URL,
+                 timeout=PROBE_TIMEOUT, speed_tester=None, geoip=None):
+        self.vpn_endpoints = vpn_endpoints
+        self.base_interval = base_interval
+        self.fast_interval = fast_interval
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.max_concurrency = max_concurrency
+        self.bandwidth_bps = bandwidth_bps
+        self.probe_url = probe_url
+        self.timeout = timeout
+        self.speed_tester = speed_tester
+        self.geoip = geoip
+        # Bumped whenever a result changes, so rendered listings can be memoized
+        self.version = 0
+        self.priority_region = None
+        self.health = {}
+        self.queue = []
+        self.task = None
+        self.running = False
+        self.wakeup = None
+        self.loop = None
+        self.in_flight = set()
+
+    # Scheduling
+
+    def interval_for(self, health):
+        """Next-check delay: backoff when dead, faster for the active region, always jittered"""
+        if health.alive is False:
+            backoff = 2 ** min(health.failures - 1, 16)
+            interval = min(self.max_backoff, self.base_interval * backoff)
+        elif health.region == self.priority_region:
+            interval = self.fast_interval
+        else:
+            interval = self.base_interval
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def sync_catalog(self):
+        """Track any proxies added to the catalog since the last pass"""
+        now = time.monotonic()
+        for region, server in list(self.vpn_endpoints.items()):
+            for proxy in list(server['proxies']):
+                key = proxy_key(proxy)
+                if key not in self.health:
+                    health = ProxyHealth(region, proxy)
+                    # Spread the initial sweep so startup is not one burst
+                    health.next_check = now + random.uniform(0, self.jitter * self.fast_interval)
+                    self.health[key] = health
+                    heapq.heappush(self.queue, (health.next_check, key))
+
+    def set_priority_region(self, region):
+        """Re-check the active region's proxies on the fast interval (callable from any thread)"""
+        if self.loop is not None:
+            self.loop.loop.call_soon_threadsafe(self._prioritise, region)
+        else:
+            self._prioritise(region)
+
+    def _prioritise(self, region):
+        self.priority_region = region
+        now = time.monotonic()
+        for health in self.health.values():
+            if health.region == region and health.key not in self.in_flight:
+                health.next_check = now
+                heapq.heappush(self.queue, (now, health.key))
+        if self.wakeup:
+            self.wakeup.set()
+
+    async def run(self):
+        """Scheduler loop: pop due proxies and probe them within the budgets"""
+        self.wakeup = asyncio.Event()
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        bucket = TokenBucket(self.bandwidth_bps, max(self.bandwidth_bps, PROBE_COST_BYTES * 4))
+
+        # Checked as well as cancelling: wait_for can swallow a cancel that races the wakeup
+        while self.running:
+            self.sync_catalog()
+            now = time.monotonic()
+            if not self.queue or self.queue[0][0] > now:
+                delay = self.queue[0][0] - now if self.queue else self.fast_interval
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), min(delay, self.fast_interval))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            due, key = heapq.heappop(self.queue)
+            health = self.health.get(key)
+            # Skip stale heap entries left behind by reprioritisation
+            if health is None or due != health.next_check or key in self.in_flight:
+                continue
+
+            await semaphore.acquire()
+            await bucket.take(PROBE_COST_BYTES)
+            self.in_flight.add(key)
+            task = asyncio.ensure_future(self.probe(health, bucket))
+            task.add_done_callback(lambda _, key=key: self._probe_done(key, semaphore))
+
+    def _probe_done(self, key, semaphore):
+        semaphore.release()
+        self.in_flight.discard(key)
+
+    def start(self, loop):
+        """Start the scheduler on a BackgroundLoop"""
+        if self.task is None or self.task.done():
+            self.loop = loop
+            self.running = True
+            self.task = loop.submit(self.run())
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.wakeup is not None and self.loop is not None:
+            self.loop.loop.call_soon_threadsafe(self.wakeup.set)
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    # Probing
+
+    async def probe(self, health, bucket=None):
+        """Health-check one proxy, speed-testing it too when a test is due"""
+        try:
+            alive = await self.probe_latency(health, bucket)
+            if alive and self.speed_tester is not None:
+                await self.maybe_speed_test(health)
+        finally:
+            self.reschedule(health)
+
+    async def maybe_speed_test(self, health):
+        """Measure throughput if the last result is stale and the byte budget allows it"""
+        if not self.speed_tester.due(health.speed) or not self.speed_tester.try_reserve():
+            return
+        result = await self.speed_tester.measure(health.proxy)
+        if result.mbps is None:
+            log_event(f"Speed test via {health.key} failed: {result.error}", 'WARNING')
+        health.speed = result
+        self.version += 1
+
+    async def probe_latency(self, health, bucket=None):
+        """Fetch the probe URL through the proxy and record latency and exit IP"""
+        url = self.probe_url[len('http://'):]
+        authority, _, path = url.partition('/')
+        host, _, port = authority.partition(':')
+        port = int(port or 80)
+
+        start = time.monotonic()
+        dialer = writer = None
+        received = 0
+        try:
+            dialer = make_dialer(health.proxy)
+            reader, writer = await asyncio.wait_for(dialer.open_connection(host, port),
+                                                    self.timeout)
+            connected = time.monotonic()
+            writer.write(f"GET /{path} HTTP/1.1\r\nHost: {authority}\r\n"
+                         f"Accept: application/json\r\nConnection: close\r\n\r\n".encode())
+            response = b""
+            while len(response) < PROBE_COST_BYTES * 4:
+                chunk = await asyncio.wait_for(reader.read(PROBE_COST_BYTES), self.timeout)
+                if not chunk:
+                    break
+                response += chunk
+            received = len(response)
+            head, _, body = response.partition(b"\r\n\r\n")
+            if not head.startswith(b"HTTP/1.") or head.split()[1] != b"200":
+                raise ConnectionError(f"Probe returned {head[:32]!r}")
+            self.record_success(health, (connected - start) * 1000, parse_exit_ip(body))
+            return True
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.record_failure(health, str(e) or e.__class__.__name__)
+            return False
+        finally:
+            # Chains report each hop separately, so a dead middle hop is visible
+            if getattr(dialer, 'hop_results', None):
+                health.hops = dialer.hop_results
+            if writer is not None:
+                close_writer(writer)
+            if hasattr(dialer, 'close'):
+                await dialer.close()
+            if bucket is not None and received < PROBE_COST_BYTES:
+                bucket.refund(PROBE_COST_BYTES - received)
+
+    def record_success(self, health, latency_ms, exit_ip):
+        health.alive = True
+        health.latency_ms = round(latency_ms, 1)
+        health.exit_ip = exit_ip
+        if self.geoip is not None and exit_ip:
+            self.locate(health)
+        health.error = None
+        health.failures = 0
+        health.successes += 1
+        health.last_checked = time.time()
+        health.source = None
+        self.version += 1
+
+    def record_failure(self, health, error):
+        if health.alive is not False:
+            log_event(f"Proxy {health.key} ({health.region}) failed health check: {error}", 'WARNING')
+        health.alive = False
+        health.error = error
+        health.failures += 1
+        health.last_checked = time.time()
+        health.source = None
+        self.version += 1
+
+    def locate(self, health):
+        """Assign a proxy to the region it actually exits from, by GeoIP of its exit IP"""
+        try:
+            country = self.geoip.lookup(health.exit_ip)
+        except ValueError:
+            country = None
+        self.assign_country(health, country)
+
+    def assign_country(self, health, country):
+        health.exit_country = country
+        if country is None:
+            return
+
+        region = self.region_for_country(country)
+        if region != health.region:
+            log_event(f"Proxy {health.key} listed in {health.listed_region} exits in {country}; "
+                      f"now serving {region or 'no region'}", 'WARNING')
+            health.region = region
+
+    def region_for_country(self, country):
+        """Catalog region for an ISO country code, or None if no region covers it"""
+        for region, server in list(self.vpn_endpoints.items()):
+            if server.get('country') == country:
+                return region
+        return None
+
+    def merge_remote(self, key, alive, latency_ms, exit_ip, exit_country, checked_at, failures,
+                     mbps=None, speed_measured_at=None, source=None):
+        """Adopt a cluster peer's observation of a proxy if it is newer than ours
+
+        Our own next check is pushed back as if we had just probed it, so the cluster
+        shares one probe per interval instead of each node repeating it.
+        """
+        health = self.health.get(key)
+        if health is None:
+            return False
+        merged = False
+        if checked_at > (health.last_checked or 0) + MERGE_TOLERANCE:
+            health.alive = alive
+            health.latency_ms = latency_ms if alive else None
+            health.exit_ip = exit_ip
+            if self.geoip is not None and exit_ip:
+                self.locate(health)
+            else:
+                self.assign_country(health, exit_country)
+            health.error = None if alive else f"Reported down by {source}"
+            health.failures = failures
+            health.last_checked = checked_at
+            health.source = source
+            if key not in self.in_flight:
+                self.reschedule(health)
+            merged = True
+        if mbps is not None and speed_measured_at is not None and (
+                health.speed is None
+                or speed_measured_at > health.speed.measured_at + MERGE_TOLERANCE):
+            health.speed = SpeedTestResult(mbps, 0, 0)
+            health.speed.measured_at = speed_measured_at
+            merged = True
+        if merged:
+            self.version += 1
+        return merged
+
+    def reschedule(self, health):
+        health.next_check = time.monotonic() + self.interval_for(health)
+        heapq.heappush(self.queue, (health.next_check, health.key))
+
+    # Selection
+
+    def ranked(self, region, prefer='throughput'):
+        """Alive proxies in a region, best first
+
+        With prefer='throughput', measured throughput wins and latency breaks ties or
+        ranks proxies that have not been speed-tested yet; prefer='latency' ignores it.
+        """
+        candidates = [health for health in list(self.health.values())
+                      if health.region == region and health.alive]
+
+        def score(health):
+            mbps = health.speed.mbps if health.speed and health.speed.mbps else 0
+            if prefer == 'throughput':
+                return (-mbps, health.latency_ms)
+            return (health.latency_ms, -mbps)
+
+        return sorted(candidates, key=score)
+
+    def best_proxy(self, region, prefer='throughput'):
+        """Best proxy currently known to be alive in a region, or None"""
+        ranked = self.ranked(region, prefer)
+        return ranked[0].proxy if ranked else None
+
+    def region_throughput(self, region):
+        """Highest measured throughput (Mbps) among a region's alive proxies"""
+        speeds = [health.speed.mbps for health in list(self.health.values())
+                  if health.region == region and health.alive and health.speed
+                  and health.speed.mbps is not None]
+        return max(speeds) if speeds else None
+
+    def snapshot(self, region=None):
+        return [health.to_dict() for health in list(self.health.values())
+                if region is None or health.region == region]
+
+
+def parse_exit_ip(body):
+    """Extract the caller IP from an httpbin/ipify style JSON body"""
+    try:
+        data = json.loads(body.decode(errors='replace'))
+    except ValueError:
+        return None
+    ip = data.get('origin') or data.get('ip')
+    return ip.split(',')[0].strip() if ip else None
@@ -0,0 +1,1138 @@
+#!/usr/bin/env python3
+"""
+VPN Relay Module - Asyncio relay engine for the local proxy listener
+Accepts HTTP CONNECT / plain-HTTP / SOCKS5 requests and relays them through an upstream dialer
+"""
+
+import asyncio
+import ipaddress
+import os
+import socket
+import struct
+import sys
+import threading
+from datetime import datetime
+
+from vpn_timer import ConnectionTimeouts, TimingWheel, current_timer
+from vpn_trace import current_trace, mark, span
+
+RELAY_BUFFER_SIZE = 64 * 1024
+MAX_REQUEST_HEAD = 64 * 1024
+# StreamReader limit for every relayed socket; asyncio pauses reading at twice this
+STREAM_LIMIT = MAX_REQUEST_HEAD
+# Largest single recv() asyncio's selector transports make
+SOCKET_READ_SIZE = 256 * 1024
+# Seconds a client turned away by the memory budget gets to say which protocol it speaks
+REFUSE_TIMEOUT = 5
+
+
+def log_event(message, level='INFO'):
+    """Log relay events"""
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    print(f"[{timestamp}] [VPN-RELAY] [{level}] {message}")
+
+
+class BackgroundLoop:
+    """Asyncio event loop running in a daemon thread"""
+
+    def __init__(self, name='vpn-loop'):
+        self.name = name
+        self.loop = None
+        self.thread = None
+        self.external = False
+        self._ready = threading.Event()
+
+    @classmethod
+    def attach(cls, loop):
+        """Wrap a loop someone else runs (e.g. the caller's) instead of starting a thread"""
+        background = cls()
+        background.loop = loop
+        background.external = True
+        return background
+
+    def start(self):
+        """Start the loop thread if it is not already running"""
+        if self.external or (self.thread and self.thread.is_alive()):
+            return self.loop
+
+        def runner():
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            self._ready.set()
+            try:
+                self.loop.run_forever()
+            finally:
+                self.loop.close()
+
+        self._ready.clear()
+        self.thread = threading.Thread(target=runner, name=self.name, daemon=True)
+        self.thread.start()
+        self._ready.wait()
+        return self.loop
+
+    def submit(self, coro):
+        """Schedule a coroutine on the loop and return a concurrent future"""
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        """Run a coroutine on the loop and block for its result"""
+        return self.submit(coro).result(timeout)
+
+    def stop(self):
+        """Stop the loop thread"""
+        if self.external:
+            return
+        if self.loop and self.thread and self.thread.is_alive():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(timeout=5)
+
+
+class DirectDialer:
+    """Open connections straight to the destination"""
+
+    def __init__(self, resolver=None):
+        # Optional DnsCache whose pre-resolved answers skip the lookup
+        self.resolver = resolver
+
+    async def open_connection(self, host, port):
+        loop = asyncio.get_running_loop()
+        infos = self.resolver.lookup(host, port) if self.resolver is not None else None
+        if infos is None:
+            with span('dns', host=host):
+                if self.resolver is not None:
+                    infos = await self.resolver.resolve(host, port)
+                else:
+                    infos = await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+
+        error = None
+        for _, _, _, _, sockaddr in infos:
+            try:
+                with span('upstream_connect', addr=sockaddr[0]):
+                    return await asyncio.open_connection(sockaddr[0], sockaddr[1],
+                                                         limit=STREAM_LIMIT)
+            except OSError as e:
+                error = e
+        raise error or OSError(f"No addresses for {host}")
+
+
+class HttpProxyDialer:
+    """Open connections through an upstream HTTP proxy using CONNECT"""
+
+    def __init__(self, proxy_config, timeout=10):
+        self.host = proxy_config['host']
+        self.port = proxy_config['port']
+        self.timeout = timeout
+
+    async def open_connection(self, host, port):
+        with span('upstream_connect', proxy=f"{self.host}:{self.port}"):
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port, limit=STREAM_LIMIT), self.timeout)
+        try:
+            with span('handshake', kind='http-connect'):
+                writer.write(http_connect_request(host, port))
+                await asyncio.wait_for(read_http_connect_reply(reader), self.timeout)
+        except BaseException:
+            writer.close()
+            raise
+        return reader, writer
+
+
+def http_connect_request(host, port):
+    return f"CONNECT {host}:{port} HTTP/1.1\r\nHost: {host}:{port}\r\n\r\n".encode()
+
+
+async def read_http_connect_reply(reader):
+    head = await reader.readuntil(b"\r\n\r\n")
+    status = head.split(b"\r\n", 1)[0].split()
+    if len(status) < 2 or status[1] != b"200":
+        raise ConnectionRefusedError(f"Upstream refused CONNECT: {head[:64]!r}")
+
+
+def make_dialer(proxy_config):
+    """Build a dialer for a catalog proxy entry"""
+    if proxy_config is None:
+        return DirectDialer()
+
+    proxy_type = proxy_config.get('type', 'http')
+    if proxy_type == 'http':
+        return HttpProxyDialer(proxy_config)
+    if proxy_type == 'socks5':
+        return Socks5Dialer(proxy_config)
+    if proxy_type == 'chain':
+        return ChainDialer(proxy_config['hops'], pipeline=proxy_config.get('pipeline', True))
+    if proxy_type == 'tunnel':
+        from vpn_tunnel import TunnelClient
+        return TunnelClient(proxy_config['host'], proxy_config['port'],
+                            key=proxy_config.get('key'))
+    raise ValueError(f"Unsupported proxy type: {proxy_type}")
+
+
+def close_writer(writer):
+    """Close a stream writer, ignoring errors from already-dead transports"""
+    try:
+        writer.close()
+    except Exception:
+        pass
+
+
+class FlowControl:
+    """Per-direction buffering limits for relayed connections
+
+    Each direction reads at most read_size at a time and stops reading once the
+    destination's send buffer passes high_water, resuming when it drains below
+    low_water; the unread data then backs up into the kernel and TCP window.
+    """
+
+    def __init__(self, high_water=64 * 1024, low_water=16 * 1024, read_size=32 * 1024):
+        if low_water > high_water:
+            raise ValueError("low_water must not exceed high_water")
+        self.high_water = high_water
+        self.low_water = low_water
+        self.read_size = read_size
+
+    def apply(self, writer):
+        """Install the watermarks on a writer's transport, where it has one"""
+        transport = getattr(writer, 'transport', None)
+        if transport is not None and hasattr(transport, 'set_write_buffer_limits'):
+            try:
+                transport.set_write_buffer_limits(high=self.high_water, low=self.low_water)
+            except (AttributeError, RuntimeError, ValueError):
+                pass
+
+    def connection_cost(self):
+        """Worst-case bytes one relayed connection can hold in user space"""
+        # Per direction: paused reader buffer plus one socket read, the chunk being
+        # forwarded, and the send buffer up to the high watermark plus that chunk
+        per_direction = (2 * STREAM_LIMIT + SOCKET_READ_SIZE) + self.read_size + \
+            (self.high_water + self.read_size)
+        return 2 * per_direction
+
+
+class MemoryBudget:
+    """Global relay memory budget; connections are admitted only while it has room"""
+
+    def __init__(self, limit_bytes):
+        self.limit_bytes = limit_bytes
+        self.reserved = 0
+        self.rejected = 0
+
+    def try_reserve(self, amount, speculative=False):
+        # Speculative reservations (pre-connects) that don't fit are not rejected clients
+        if self.reserved + amount > self.limit_bytes:
+            if not speculative:
+                self.rejected += 1
+            return False
+        self.reserved += amount
+        return True
+
+    def release(self, amount):
+        self.reserved = max(0, self.reserved - amount)
+
+    def get_stats(self):
+        return {
+            'limit_bytes': self.limit_bytes,
+            'reserved_bytes': self.reserved,
+            'rejected_connections': self.rejected,
+        }
+
+
+async def pipe(reader, writer, bufsize=RELAY_BUFFER_SIZE, on_first_chunk=None):
+    """Copy bytes from reader to writer until EOF, then half-close the writer
+
+    drain() blocks while the writer is above its high watermark, so nothing more is
+    read from a fast side until the slow side has caught up.
+    """
+    timer = current_timer.get()
+    try:
+        while True:
+            data = await reader.read(bufsize)
+            if not data:
+                break
+            if timer is not None:
+                timer.refresh()
+            if on_first_chunk is not None:
+                on_first_chunk()
+                on_first_chunk = None
+            writer.write(data)
+            await writer.drain()
+        if writer.can_write_eof():
+            writer.write_eof()
+    except (ConnectionError, OSError, asyncio.IncompleteReadError):
+        close_writer(writer)
+
+
+async def relay(client_reader, client_writer, upstream_reader, upstream_writer, flow=None):
+    """Relay both directions until each side has finished"""
+    trace = current_trace.get()
+    bufsize = RELAY_BUFFER_SIZE
+    if flow is not None:
+        flow.apply(client_writer)
+        flow.apply(upstream_writer)
+        bufsize = flow.read_size
+    try:
+        await asyncio.gather(pipe(client_reader, upstream_writer, bufsize),
+                             pipe(upstream_reader, client_writer, bufsize,
+                                  on_first_chunk=trace.first_byte if trace else None))
+    finally:
+        close_writer(upstream_writer)
+        close_writer(client_writer)
+
+
+def parse_request_head(head):
+    """Split a raw HTTP request head into (method, target, version, [(name, value)])"""
+    lines = head.decode('latin-1').split("\r\n")
+    parts = lines[0].split(" ")
+    if len(parts) != 3:
+        raise ValueError(f"Malformed request line: {lines[0]!r}")
+    method, target, version = parts
+    headers = []
+    for line in lines[1:]:
+        if line:
+            name, _, value = line.partition(':')
+            headers.append((name.strip(), value.strip()))
+    return method.upper(), target, version, headers
+
+
+def split_host_port(authority, default_port):
+    """Split 'host:port' (including bracketed IPv6) into a tuple"""
+    if authority.startswith('['):
+        host, _, rest = authority[1:].partition(']')
+        port = rest[1:] if rest.startswith(':') else ''
+    else:
+        host, _, port = authority.rpartition(':') if ':' in authority else (authority, '', '')
+    return host, int(port) if port else default_port
+
+
+# SOCKS5 (RFC 1928)
+SOCKS_VERSION = 5
+SOCKS_CMD_CONNECT = 1
+SOCKS_CMD_UDP_ASSOCIATE = 3
+SOCKS_ATYP_IPV4 = 1
+SOCKS_ATYP_DOMAIN = 3
+SOCKS_ATYP_IPV6 = 4
+SOCKS_REPLY_SUCCEEDED = 0
+SOCKS_REPLY_FAILURE = 1
+SOCKS_REPLY_HOST_UNREACHABLE = 4
+SOCKS_REPLY_COMMAND_NOT_SUPPORTED = 7
+SOCKS_REPLY_ADDRESS_NOT_SUPPORTED = 8
+
+
+def encode_socks_address(host, port):
+    """Encode host/port as SOCKS5 ATYP + address + port"""
+    try:
+        ip = ipaddress.ip_address(host)
+    except ValueError:
+        name = host.encode('idna')
+        return bytes([SOCKS_ATYP_DOMAIN, len(name)]) + name + struct.pack("!H", port)
+    atyp = SOCKS_ATYP_IPV4 if ip.version == 4 else SOCKS_ATYP_IPV6
+    return bytes([atyp]) + ip.packed + struct.pack("!H", port)
+
+
+def decode_socks_address(data, offset=0):
+    """Decode a SOCKS5 address at offset and return (host, port, end offset)"""
+    atyp = data[offset]
+    if atyp == SOCKS_ATYP_IPV4:
+        end = offset + 5
+        host = socket.inet_ntop(socket.AF_INET, data[offset + 1:end])
+    elif atyp == SOCKS_ATYP_IPV6:
+        end = offset + 17
+        host = socket.inet_ntop(socket.AF_INET6, data[offset + 1:end])
+    elif atyp == SOCKS_ATYP_DOMAIN:
+        end = offset + 2 + data[offset + 1]
+        host = bytes(data[offset + 2:end]).decode('idna')
+    else:
+        raise ValueError(f"Unsupported SOCKS address type {atyp}")
+    if len(data) < end + 2:
+        raise ValueError("Truncated SOCKS address")
+    (port,) = struct.unpack_from("!H", data, end)
+    return host, port, end + 2
+
+
+async def read_socks_address(reader):
+    """Read a SOCKS5 address from a stream and return (host, port)"""
+    atyp = await reader.readexactly(1)
+    if atyp[0] == SOCKS_ATYP_IPV4:
+        raw = atyp + await reader.readexactly(4 + 2)
+    elif atyp[0] == SOCKS_ATYP_IPV6:
+        raw = atyp + await reader.readexactly(16 + 2)
+    elif atyp[0] == SOCKS_ATYP_DOMAIN:
+        size = await reader.readexactly(1)
+        raw = atyp + size + await reader.readexactly(size[0] + 2)
+    else:
+        raise ValueError(f"Unsupported SOCKS address type {atyp[0]}")
+    host, port, _ = decode_socks_address(raw)
+    return host, port
+
+
+def socks_reply(code, host='0.0.0.0', port=0):
+    """Build a SOCKS5 reply"""
+    return bytes([SOCKS_VERSION, code, 0]) + encode_socks_address(host, port)
+
+
+def socks5_connect_request(host, port):
+    """No-auth greeting followed straight away by the CONNECT request (optimistic data)"""
+    return bytes([SOCKS_VERSION, 1, 0, SOCKS_VERSION, SOCKS_CMD_CONNECT, 0]) + \
+        encode_socks_address(host, port)
+
+
+async def read_socks5_reply(reader):
+    version, method = await reader.readexactly(2)
+    if version != SOCKS_VERSION or method != 0:
+        raise ConnectionError("SOCKS5 proxy requires an unsupported authentication method")
+    version, code, _ = await reader.readexactly(3)
+    await read_socks_address(reader)
+    if code != SOCKS_REPLY_SUCCEEDED:
+        raise ConnectionRefusedError(f"SOCKS5 connect failed (reply {code})")
+
+
+# Request builder and reply reader for each proxy protocol a hop can speak
+HOP_HANDSHAKES = {
+    'http': (http_connect_request, read_http_connect_reply),
+    'socks5': (socks5_connect_request, read_socks5_reply),
+}
+
+
+class Socks5Dialer:
+    """Open connections through an upstream SOCKS5 proxy (no authentication)"""
+
+    def __init__(self, proxy_config, timeout=10):
+        self.host = proxy_config['host']
+        self.port = proxy_config['port']
+        self.timeout = timeout
+
+    async def open_connection(self, host, port):
+        with span('upstream_connect', proxy=f"{self.host}:{self.port}"):
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port, limit=STREAM_LIMIT), self.timeout)
+        try:
+            with span('handshake', kind='socks5'):
+                writer.write(socks5_connect_request(host, port))
+                await asyncio.wait_for(read_socks5_reply(reader), self.timeout)
+        except BaseException:
+            writer.close()
+            raise
+        return reader, writer
+
+
+class ChainHopError(ConnectionError):
+    """A multi-hop chain failed at a particular hop"""
+
+    def __init__(self, index, hop, error):
+        super().__init__(f"Hop {index + 1} ({hop['host']}:{hop['port']}): {error}")
+        self.index = index
+
+
+class ChainDialer:
+    """Open connections through a chain of HTTP/SOCKS5 proxies, each tunnelled in the last
+
+    With pipeline=True every hop's handshake is written up front: each proxy forwards
+    the bytes after its own request once its tunnel is up, so the chain costs about one
+    round trip per hop instead of a request/response exchange per hop.
+    """
+
+    def __init__(self, hops, timeout=10, pipeline=True):
+        for hop in hops:
+            if hop.get('type', 'http') not in HOP_HANDSHAKES:
+                raise ValueError(f"Unsupported chain hop type: {hop.get('type')}")
+        self.hops = hops
+        self.timeout = timeout
+        self.pipeline = pipeline
+        # Outcome of each hop on the last dial, for per-hop health scoring
+        self.hop_results = []
+
+    async def open_connection(self, host, port):
+        loop = asyncio.get_running_loop()
+        first = self.hops[0]
+        targets = [(hop['host'], hop['port']) for hop in self.hops[1:]] + [(host, port)]
+        results = [{'host': hop['host'], 'port': hop['port'], 'type': hop.get('type', 'http'),
+                    'alive': None, 'latency_ms': None, 'error': None} for hop in self.hops]
+        self.hop_results = results
+
+        start = loop.time()
+        try:
+            with span('upstream_connect', proxy=f"{first['host']}:{first['port']}"):
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(first['host'], first['port'], limit=STREAM_LIMIT),
+                    self.timeout)
+        except Exception as e:
+            results[0].update(alive=False, error=str(e) or e.__class__.__name__)
+            raise ChainHopError(0, first, e) from e
+        reached = loop.time()
+        results[0].update(alive=True, latency_ms=round((reached - start) * 1000, 1))
+
+        handshakes = [HOP_HANDSHAKES[hop.get('type', 'http')] for hop in self.hops]
+        requests = [build(*target) for (build, _), target in zip(handshakes, targets)]
+        try:
+            with span('handshake', kind='chain', hops=len(self.hops), pipelined=self.pipeline):
+                if self.pipeline:
+                    writer.write(b"".join(requests))
+                for index, ((_, read_reply), request) in enumerate(zip(handshakes, requests)):
+                    if not self.pipeline:
+                        writer.write(request)
+                    try:
+                        await asyncio.wait_for(read_reply(reader), self.timeout)
+                    except ConnectionRefusedError as e:
+                        # The hop answered but could not reach the next one
+                        if index + 1 < len(results):
+                            results[index + 1].update(alive=False, error=str(e))
+                        raise ChainHopError(index, self.hops[index], e) from e
+                    except Exception as e:
+                        results[index].update(alive=False, error=str(e) or e.__class__.__name__)
+                        raise ChainHopError(index, self.hops[index], e) from e
+                    if index + 1 < len(results):
+                        now = loop.time()
+                        results[index + 1].update(alive=True,
+                                                  latency_ms=round((now - reached) * 1000, 1))
+                        reached = now
+        except BaseException:
+            writer.close()
+            raise
+        return reader, writer
+
+
+# Transparent proxying (Linux netfilter REDIRECT / DNAT)
+SO_ORIGINAL_DST = 80
+IP6T_SO_ORIGINAL_DST = 80
+SOL_IPV6 = getattr(socket, 'SOL_IPV6', 41)
+
+
+def original_destination(sock):
+    """Destination a REDIRECTed connection was originally addressed to, as (host, port)"""
+    if sock.family == socket.AF_INET6:
+        raw = sock.getsockopt(SOL_IPV6, IP6T_SO_ORIGINAL_DST, 28)
+        port, address = struct.unpack_from("!H4x16s", raw, 2)
+        host = socket.inet_ntop(socket.AF_INET6, address)
+        # IPv4 clients of a dual-stack listener come back as v4-mapped addresses
+        return (host[7:] if host.startswith('::ffff:') and '.' in host else host), port
+    raw = sock.getsockopt(getattr(socket, 'SOL_IP', 0), SO_ORIGINAL_DST, 16)
+    port, address = struct.unpack_from("!H4s", raw, 2)
+    return socket.inet_ntop(socket.AF_INET, address), port
+
+
+class LocalProxyServer:
+    """Local HTTP proxy listener relaying client traffic through an upstream dialer"""
+
+    def __init__(self, dialer=None, host='127.0.0.1', port=9999, udp_relay=None, bypass=None,
+                 cache=None, tracer=None, flow=None, memory_budget=None,
+                 transparent_host='0.0.0.0', transparent_port=None, timeouts=None,
+                 preconnect=None):
+        self.memory_budget = memory_budget
+        self.dialer = self.adopt(dialer or DirectDialer())
+        self.flow = flow or FlowControl()
+        self.timeouts = timeouts or ConnectionTimeouts()
+        # One wheel times out every connection instead of a timer task each
+        self.wheel = TimingWheel()
+        self.preconnect = preconnect
+        self.direct_dialer = DirectDialer(preconnect.dns if preconnect else None)
+        self.bypass = bypass
+        self.cache = cache
+        self.tracer = tracer
+        self.host = host
+        self.port = port
+        self.server = None
+        self.transparent_host = transparent_host
+        self.transparent_port = transparent_port
+        self.transparent_server = None
+        self.active_connections = 0
+        self.udp_relay = udp_relay
+        # Connection task -> dialer it was routed through, so retired dialers can drain
+        self.routed = {}
+        self.connections = set()
+        self.draining = set()
+
+    async def start(self):
+        """Bind the listener on the current loop"""
+        self.wheel.start()
+        self.server = await asyncio.start_server(self.handle_client, self.host, self.port,
+                                                 limit=MAX_REQUEST_HEAD)
+        self.port = self.server.sockets[0].getsockname()[1]
+        log_event(f"Local proxy server started on {self.host}:{self.port}")
+        if self.preconnect is not None:
+            self.preconnect.start(self)
+        if self.transparent_port is not None:
+            await self.start_transparent()
+        return self
+
+    async def start_transparent(self):
+        """Also accept netfilter-redirected connections (Linux only)"""
+        if not sys.platform.startswith('linux'):
+            log_event("Transparent mode needs Linux netfilter; not started", 'WARNING')
+            return
+        self.transparent_server = await asyncio.start_server(
+            lambda reader, writer: self.handle_client(reader, writer, transparent=True),
+            self.transparent_host, self.transparent_port, limit=MAX_REQUEST_HEAD)
+        self.transparent_port = self.transparent_server.sockets[0].getsockname()[1]
+        log_event(f"Transparent listener started on {self.transparent_host}:{self.transparent_port}")
+
+    async def stop(self):
+        """Stop accepting new connections and close the ones still open"""
+        if not self.server:
+            return
+        # Everything is closed before awaiting: from Python 3.12 wait_closed() only
+        # returns once every connection accepted by the listener has ended
+        servers = [server for server in (self.server, self.transparent_server) if server]
+        for server in servers:
+            server.close()
+        self.server = self.transparent_server = None
+        if self.udp_relay:
+            self.udp_relay.close()
+        if self.preconnect is not None:
+            self.preconnect.stop()
+        remaining = list(self.connections)
+        for task in remaining:
+            task.cancel()
+        if remaining:
+            await asyncio.wait(remaining, timeout=5)
+        self.wheel.stop()
+        for server in servers:
+            await server.wait_closed()
+        log_event("Local proxy server stopped")
+
+    def get_stats(self):
+        stats = {
+            'active_connections': self.active_connections,
+            'draining_upstreams': len(self.draining),
+            'transparent_port': self.transparent_port if self.transparent_server else None,
+            'connection_cost_bytes': self.flow.connection_cost(),
+            'high_water': self.flow.high_water,
+            'low_water': self.flow.low_water,
+            'timeouts': self.timeouts.to_dict(),
+            'timers': self.wheel.get_stats(),
+        }
+        if self.preconnect is not None:
+            stats['preconnect'] = self.preconnect.get_stats()
+        if self.memory_budget is not None:
+            stats.update(self.memory_budget.get_stats())
+            stats['connection_limit'] = (self.memory_budget.limit_bytes
+                                         // self.flow.connection_cost())
+        return stats
+
+    async def handle_client(self, reader, writer, transparent=False):
+        """Serve one client connection, if the memory budget admits it"""
+        cost = self.flow.connection_cost()
+        if self.memory_budget is not None and not self.memory_budget.try_reserve(cost):
+            if self.memory_budget.rejected % 100 == 1:
+                log_event(f"Memory budget exhausted ({self.active_connections} connections); "
+                          f"rejecting new clients", 'WARNING')
+            if transparent:
+                close_writer(writer)
+            else:
+                await self.refuse(reader, writer)
+            return
+
+        self.active_connections += 1
+        task = asyncio.current_task()
+        self.connections.add(task)
+        trace = self.tracer.begin(writer.get_extra_info('peername')) if self.tracer else None
+        token = current_trace.set(trace)
+        # Expiry cancels the connection task, which closes both sides
+        timer = self.wheel.arm(self.timeouts.handshake, task.cancel, 'handshake')
+        timer_token = current_timer.set(timer)
+        lifetime = (self.wheel.arm(self.timeouts.lifetime, task.cancel, 'lifetime')
+                    if self.timeouts.lifetime else None)
+        try:
+            if transparent:
+                await self.handle_transparent(reader, writer)
+                return
+
+            try:
+                with span('accept'):
+                    first = await reader.readexactly(1)
+                    if first[0] != SOCKS_VERSION:
+                        head = first + await reader.readuntil(b"\r\n\r\n")
+                        method, target, version, headers = parse_request_head(head)
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+                close_writer(writer)
+                return
+
+            if first[0] == SOCKS_VERSION:
+                await self.handle_socks5(reader, writer)
+            elif method == 'CONNECT':
+                await self.handle_connect(reader, writer, target)
+            else:
+                await self.handle_http(reader, writer, method, target, version, headers)
+        except asyncio.IncompleteReadError:
+            close_writer(writer)
+        except asyncio.CancelledError:
+            # Cut off by drain() or loop shutdown; this is the top of the connection task
+            close_writer(writer)
+        except Exception as e:
+            log_event(f"Client connection error: {e}", 'WARNING')
+            close_writer(writer)
+        finally:
+            self.active_connections -= 1
+            self.connections.discard(task)
+            timer.cancel()
+            if lifetime is not None:
+                lifetime.cancel()
+            current_timer.reset(timer_token)
+            self.routed.pop(task, None)
+            if self.memory_budget is not None:
+                self.memory_budget.release(cost)
+            if trace is not None:
+                trace.close()
+            current_trace.reset(token)
+
+    async def refuse(self, reader, writer):
+        """Turn a client away in its own protocol: SOCKS5 general failure or HTTP 503"""
+        task = asyncio.current_task()
+        self.connections.add(task)
+        try:
+            first = await asyncio.wait_for(reader.readexactly(1), REFUSE_TIMEOUT)
+            if first[0] == SOCKS_VERSION:
+                await asyncio.wait_for(self.refuse_socks5(reader, writer), REFUSE_TIMEOUT)
+            else:
+                writer.write(b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\n"
+                             b"Connection: close\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, asyncio.CancelledError,
+                ConnectionError, OSError, ValueError):
+            pass
+        finally:
+            self.connections.discard(task)
+            close_writer(writer)
+
+    @staticmethod
+    async def refuse_socks5(reader, writer):
+        """Negotiate far enough to answer the SOCKS5 request with a general failure"""
+        methods = await reader.readexactly((await reader.readexactly(1))[0])
+        if 0 not in methods:
+            writer.write(bytes([SOCKS_VERSION, 0xFF]))
+            return
+        writer.write(bytes([SOCKS_VERSION, 0]))
+        await reader.readexactly(3)
+        await read_socks_address(reader)
+        writer.write(socks_reply(SOCKS_REPLY_FAILURE))
+
+    async def open_upstream(self, writer, host, port):
+        """Dial the destination, answering 502 to the client on failure"""
+        try:
+            return await self.dial(host, port)
+        except Exception as e:
+            log_event(f"Upstream connect to {host}:{port} failed: {e}", 'WARNING')
+            writer.write(b"HTTP/1.1 502 Bad Gateway\r\nContent-Length: 0\r\n"
+                         b"Connection: close\r\n\r\n")
+            close_writer(writer)
+            return None, None
+
+    def pick_dialer(self, host):
+        """Dialer a destination goes through, honouring split-tunnel rules"""
+        if self.bypass is not None and self.bypass.should_bypass(host):
+            return self.direct_dialer
+        return self.dialer
+
+    def route(self, host):
+        """Pick the current connection's dialer and remember it for draining"""
+        dialer = self.pick_dialer(host)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.target = host
+            trace.instant('route', {'host': host, 'direct': dialer is self.direct_dialer})
+        self.routed[asyncio.current_task()] = dialer
+        return dialer
+
+    def set_phase(self, phase):
+        """Move the current connection's timer to a phase's timeout"""
+        timer = current_timer.get()
+        if timer is not None:
+            timer.reset(getattr(self.timeouts, phase), phase)
+
+    async def dial(self, host, port):
+        """Open the upstream for the current client: connect timeout while dialing, then idle"""
+        self.set_phase('connect')
+        dialer = self.route(host)
+        connection = None
+        if self.preconnect is not None:
+            self.preconnect.record(host, port)
+            connection = self.preconnect.take(host, port, dialer)
+            if connection is not None:
+                mark('preconnected', host=host)
+        if connection is None:
+            connection = await dialer.open_connection(host, port)
+        self.set_phase('idle')
+        return connection
+
+    def adopt(self, dialer):
+        """Charge a dialer's own buffering (tunnel streams) to this proxy's memory budget"""
+        if self.memory_budget is not None and getattr(dialer, 'memory_budget', False) is None:
+            dialer.memory_budget = self.memory_budget
+        return dialer
+
+    async def switch_dialer(self, dialer, grace=30):
+        """Send new connections through dialer; ones on the old dialer drain for up to grace seconds"""
+        old = self.dialer
+        self.dialer = self.adopt(dialer)
+        if old is dialer:
+            return
+        if self.preconnect is not None:
+            # Warm tunnels belong to the old upstream
+            self.preconnect.flush()
+        task = asyncio.ensure_future(self.drain(old, grace))
+        self.draining.add(task)
+        task.add_done_callback(self.draining.discard)
+
+    async def drain(self, dialer, grace):
+        """Wait for a retired dialer's connections to finish, cut off stragglers, then close it"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + grace
+        remaining = [task for task, routed in self.routed.items() if routed is dialer]
+        if remaining:
+            log_event(f"Draining {len(remaining)} connection(s) on the previous upstream "
+                      f"(grace {grace}s)")
+        while remaining and loop.time() < deadline:
+            await asyncio.wait(remaining, timeout=min(1.0, deadline - loop.time()))
+            remaining = [task for task in remaining if not task.done()]
+
+        for task in remaining:
+            task.cancel()
+        if remaining:
+            log_event(f"Closed {len(remaining)} connection(s) still open after the grace period",
+                      'WARNING')
+        if hasattr(dialer, 'close'):
+            try:
+                await dialer.close()
+            except Exception as e:
+                log_event(f"Closing previous upstream failed: {e}", 'WARNING')
+
+    async def handle_transparent(self, reader, writer):
+        """Relay a netfilter-redirected connection to its original destination"""
+        sock = writer.get_extra_info('socket')
+        try:
+            host, port = original_destination(sock)
+        except OSError as e:
+            log_event(f"No original destination for {writer.get_extra_info('peername')} "
+                      f"(not redirected?): {e}", 'WARNING')
+            close_writer(writer)
+            return
+
+        # A connection addressed to the listener itself was not redirected; relaying it
+        # would loop straight back here
+        if (host, port) == sock.getsockname()[:2]:
+            close_writer(writer)
+            return
+
+        try:
+            upstream_reader, upstream_writer = await self.dial(host, port)
+        except Exception as e:
+            log_event(f"Upstream connect to {host}:{port} failed: {e}", 'WARNING')
+            close_writer(writer)
+            return
+        await relay(reader, writer, upstream_reader, upstream_writer, self.flow)
+
+    async def handle_socks5(self, reader, writer):
+        """Handle a SOCKS5 session (CONNECT and UDP ASSOCIATE, no authentication)"""
+        nmethods = (await reader.readexactly(1))[0]
+        methods = await reader.readexactly(nmethods)
+        if 0 not in methods:
+            writer.write(bytes([SOCKS_VERSION, 0xFF]))
+            close_writer(writer)
+            return
+        writer.write(bytes([SOCKS_VERSION, 0]))
+
+        version, command, _ = await reader.readexactly(3)
+        if version != SOCKS_VERSION:
+            writer.write(socks_reply(SOCKS_REPLY_FAILURE))
+            close_writer(writer)
+            return
+        try:
+            host, port = await read_socks_address(reader)
+        except ValueError:
+            writer.write(socks_reply(SOCKS_REPLY_ADDRESS_NOT_SUPPORTED))
+            close_writer(writer)
+            return
+
+        if command == SOCKS_CMD_CONNECT:
+            try:
+                upstream_reader, upstream_writer = await self.dial(host, port)
+            except Exception as e:
+                log_event(f"Upstream connect to {host}:{port} failed: {e}", 'WARNING')
+                writer.write(socks_reply(SOCKS_REPLY_HOST_UNREACHABLE))
+                close_writer(writer)
+                return
+            writer.write(socks_reply(SOCKS_REPLY_SUCCEEDED))
+            await relay(reader, writer, upstream_reader, upstream_writer, self.flow)
+        elif command == SOCKS_CMD_UDP_ASSOCIATE:
+            await self.handle_udp_associate(reader, writer)
+        else:
+            writer.write(socks_reply(SOCKS_REPLY_COMMAND_NOT_SUPPORTED))
+            close_writer(writer)
+
+    async def handle_udp_associate(self, reader, writer):
+        """Open a UDP association that lives as long as the control connection"""
+        from vpn_udp import UdpRelay, carries_udp
+
+        if not carries_udp(self.dialer):
+            # HTTP/SOCKS5 upstreams only carry TCP; relaying direct would expose the real IP
+            log_event("UDP associate refused: the current upstream cannot carry UDP", 'WARNING')
+            writer.write(socks_reply(SOCKS_REPLY_COMMAND_NOT_SUPPORTED))
+            close_writer(writer)
+            return
+        if self.udp_relay is None:
+            self.udp_relay = UdpRelay()
+
+        client_host = writer.get_extra_info('peername')[0]
+        try:
+            association = self.udp_relay.associate(self.host, client_host, self.pick_dialer)
+        except OSError as e:
+            log_event(f"UDP associate failed: {e}", 'WARNING')
+            writer.write(socks_reply(SOCKS_REPLY_FAILURE))
+            close_writer(writer)
+            return
+
+        # The association has its own idle expiry, which also ends the control connection
+        timer = current_timer.get()
+        if timer is not None:
+            timer.cancel()
+        association.on_close = lambda: close_writer(writer)
+        bind_host, bind_port = association.client_address()
+        writer.write(socks_reply(SOCKS_REPLY_SUCCEEDED, bind_host, bind_port))
+        try:
+            # Nothing more is expected on the control connection; EOF ends the association
+            while await reader.read(1024):
+                pass
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            association.close()
+            close_writer(writer)
+
+    async def handle_connect(self, reader, writer, target):
+        """Handle a CONNECT tunnel request"""
+        host, port = split_host_port(target, 443)
+        upstream_reader, upstream_writer = await self.open_upstream(writer, host, port)
+        if upstream_writer is None:
+            return
+        writer.write(b"HTTP/1.1 200 Connection established\r\n\r\n")
+        await relay(reader, writer, upstream_reader, upstream_writer, self.flow)
+
+    async def handle_http(self, reader, writer, method, target, version, headers):
+        """Handle a plain-HTTP request in absolute-URI form"""
+        if not target.startswith('http://'):
+            writer.write(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n"
+                         b"Connection: close\r\n\r\n")
+            close_writer(writer)
+            return
+
+        authority, _, path = target[len('http://'):].partition('/')
+        host, port = split_host_port(authority, 80)
+        if self.cache is not None and self.cache.cacheable_request(method, headers):
+            self.set_phase('idle')
+            await self.cache.handle(self, reader, writer, method, target, path, version,
+                                    headers, host, port)
+            return
+
+        upstream_reader, upstream_writer = await self.open_upstream(writer, host, port)
+        if upstream_writer is None:
+            return
+
+        # One request per upstream connection keeps the relay a dumb byte pipe
+        forwarded = [f"{method} /{path} {version}"]
+        forwarded += [f"{name}: {value}" for name, value in headers
+                      if not name.lower().startswith('proxy-')
+                      and name.lower() not in ('connection', 'keep-alive')]
+        forwarded.append("Connection: close")
+        upstream_writer.write(("\r\n".join(forwarded) + "\r\n\r\n").encode('latin-1'))
+        await relay(reader, writer, upstream_reader, upstream_writer, self.flow)
+
+
+def current_rss():
+    """Resident set size of this process in bytes (peak RSS where /proc is unavailable)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        import resource
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return usage if sys.platform == 'darwin' else usage * 1024
+
+
+def benchmark_slow_readers(connections=400, seconds=10, budget_mb=128, read_rate=8192):
+    """Stress the relay with a fast origin and slow CONNECT clients, sampling RSS"""
+
+    async def run():
+        async def origin(reader, writer):
+            chunk = b"x" * RELAY_BUFFER_SIZE
+            try:
+                while True:
+                    writer.write(chunk)
+                    await writer.drain()
+            except (ConnectionError, OSError):
+                close_writer(writer)
+
+        origin_server = await asyncio.start_server(origin, '127.0.0.1', 0)
+        origin_port = origin_server.sockets[0].getsockname()[1]
+        budget = MemoryBudget(budget_mb * 1024 * 1024)
+        proxy = await LocalProxyServer(port=0, memory_budget=budget).start()
+        loop = asyncio.get_running_loop()
+        counts = {'relaying': 0, 'rejected': 0, 'received_bytes': 0}
+        deadline = loop.time() + seconds
+
+        async def slow_client():
+            # Raw sockets so the clients themselves buffer nothing in user space
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            try:
+                await loop.sock_connect(sock, ('127.0.0.1', proxy.port))
+                await loop.sock_sendall(sock, f"CONNECT 127.0.0.1:{origin_port} HTTP/1.1\r\n"
+                                              f"Host: 127.0.0.1\r\n\r\n".encode())
+                reply = await loop.sock_recv(sock, 39)
+                if not reply.startswith(b"HTTP/1.1 200"):
+                    counts['rejected'] += 1
+                    return
+                counts['relaying'] += 1
+                while loop.time() < deadline:
+                    data = await loop.sock_recv(sock, read_rate // 10)
+                    if not data:
+                        break
+                    counts['received_bytes'] += len(data)
+                    await asyncio.sleep(0.1)
+            except (ConnectionError, OSError):
+                counts['rejected'] += 1
+            finally:
+                sock.close()
+
+        baseline = current_rss()
+        samples = []
+        clients = [asyncio.ensure_future(slow_client()) for _ in range(connections)]
+        while loop.time() < deadline:
+            await asyncio.sleep(0.5)
+            samples.append(current_rss())
+        await asyncio.gather(*clients)
+        stats = proxy.get_stats()
+        # Let relays notice the clients hanging up before the loop shuts down
+        for _ in range(50):
+            if not proxy.active_connections:
+                break
+            await asyncio.sleep(0.1)
+        await proxy.stop()
+        origin_server.close()
+
+        mb = 1024 * 1024
+        return {
+            'connections': connections,
+            'relaying': counts['relaying'],
+            'rejected': counts['rejected'],
+            'budget_mb': budget_mb,
+            'connection_cost_kb': stats['connection_cost_bytes'] // 1024,
+            'baseline_rss_mb': round(baseline / mb, 1),
+            'peak_rss_mb': round(max(samples) / mb, 1),
+            'final_rss_mb': round(samples[-1] / mb, 1),
+            'rss_samples_mb': [round(sample / mb) for sample in samples],
+            'client_received_mb': round(counts['received_bytes'] / mb, 1),
+        }
+
+    return asyncio.run(run())
+
+
+def benchmark_chain(hop_types=('http', 'socks5', 'http'), link_delay=0.02, rounds=5):
+    """Dial through a chain of local LocalProxyServers mixing HTTP and SOCKS5 hops, each
+    behind a link that adds link_delay per chunk, pipelined and sequentially; then break
+    the second hop and check the failure is pinned on it"""
+
+    async def origin(reader, writer):
+        try:
+            await reader.readuntil(b"\r\n\r\n")
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n"
+                         b"Connection: close\r\n\r\nok")
+            await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            close_writer(writer)
+
+    async def delayed(source, sink):
+        try:
+            while True:
+                data = await source.read(RELAY_BUFFER_SIZE)
+                if not data:
+                    break
+                await asyncio.sleep(link_delay)
+                sink.write(data)
+                await sink.drain()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            close_writer(sink)
+
+    def link_to(port):
+        async def handle(reader, writer):
+            try:
+                upstream_reader, upstream_writer = await asyncio.open_connection('127.0.0.1', port)
+            except OSError:
+                close_writer(writer)
+                return
+            await asyncio.gather(delayed(reader, upstream_writer),
+                                 delayed(upstream_reader, writer))
+        return handle
+
+    async def fetch(dialer, origin_port):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        reader, writer = await dialer.open_connection('127.0.0.1', origin_port)
+        try:
+            writer.write(b"GET / HTTP/1.1\r\nHost: origin\r\n\r\n")
+            body = await reader.read()
+        finally:
+            close_writer(writer)
+        if not body.endswith(b"ok"):
+            raise ConnectionError("Origin response did not come back through the chain")
+        return (loop.time() - start) * 1000
+
+    async def run():
+        origin_server = await asyncio.start_server(origin, '127.0.0.1', 0)
+        origin_port = origin_server.sockets[0].getsockname()[1]
+        proxies, links, hops = [], [], []
+        for hop_type in hop_types:
+            proxy = await LocalProxyServer(port=0).start()
+            link = await asyncio.start_server(link_to(proxy.port), '127.0.0.1', 0)
+            proxies.append(proxy)
+            links.append(link)
+            hops.append({'host': '127.0.0.1', 'port': link.sockets[0].getsockname()[1],
+                         'type': hop_type})
+
+        results = {'hops': " -> ".join(hop_types), 'link_delay_ms': link_delay * 1000}
+        for pipeline in (True, False):
+            dialer = ChainDialer(hops, timeout=5, pipeline=pipeline)
+            timings = [await fetch(dialer, origin_port) for _ in range(rounds)]
+            mode = 'pipelined' if pipeline else 'sequential'
+            results[f'{mode}_ms'] = round(sum(timings) / len(timings), 1)
+        results['hop_results'] = [(hop['type'], hop['alive'], hop['latency_ms'])
+                                  for hop in dialer.hop_results]
+
+        # Point the second hop at a port nobody listens on
+        dead = socket.socket()
+        dead.bind(('127.0.0.1', 0))
+        dead_port = dead.getsockname()[1]
+        dead.close()
+        broken = [hops[0], dict(hops[1], port=dead_port)] + hops[2:]
+        dialer = ChainDialer(broken, timeout=5)
+        try:
+            await fetch(dialer, origin_port)
+            results['broken_chain'] = 'unexpectedly connected'
+        except ChainHopError as e:
+            dead_hops = [index + 1 for index, hop in enumerate(dialer.hop_results)
+                         if hop['alive'] is False]
+            results['broken_chain'] = (f"reported by hop {e.index + 1}, "
+                                       f"dead hop(s) {dead_hops} (expected [2])")
+
+        for link in links:
+            link.close()
+        for proxy in proxies:
+            await proxy.stop()
+        origin_server.close()
+        return results
+
+    return asyncio.run(run())
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == 'chain':
+        print("🔗 Multi-hop chain check (local HTTP/SOCKS5 hops)")
+        print("=" * 40)
+        results = benchmark_chain()
+    else:
+        print("🧪 Relay slow-reader stress test")
+        print("=" * 40)
+        results = benchmark_slow_readers()
+    for key, value in results.items():
+        print(f"{key}: {value}")
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+VPN Speed Test Module - Sustained throughput measurement through catalog proxies
+Pulls a sized payload through a proxy, ignores the TCP slow-start warm-up and reports
+Mbps; every test is capped in bytes and seconds and drawn from an hourly byte budget
+"""
+
+import asyncio
+import time
+
+from vpn_relay import close_writer, make_dialer
+
+SPEED_TEST_URL = 'http://speed.cloudflare.com/__down?bytes={bytes}'
+READ_SIZE = 64 * 1024
+
+
+class SpeedTestResult:
+    """Outcome of one throughput test"""
+
+    def __init__(self, mbps, bytes_received, seconds, error=None):
+        self.mbps = mbps
+        self.bytes_received = bytes_received
+        self.seconds = seconds
+        self.error = error
+        self.measured_at = time.time()
+
+    def to_dict(self):
+        return {
+            'mbps': self.mbps,
+            'bytes': self.bytes_received,
+            'seconds': self.seconds,
+            'error': self.error,
+            'measured_at': self.measured_at,
+        }
+
+
+class SpeedTester:
+    """Bounded-cost bandwidth tester used by the background prober"""
+
+    def __init__(self, url=SPEED_TEST_URL, payload_bytes=2 * 1024 * 1024, max_seconds=8,
+                 warmup_fraction=0.25, interval=3600, hourly_budget_bytes=64 * 1024 * 1024,
+                 connect_timeout=10):
+        self.url = url
+        self.payload_bytes = payload_bytes
+        self.max_seconds = max_seconds
+        self.warmup_fraction = warmup_fraction
+        self.interval = interval
+        self.hourly_budget_bytes = hourly_budget_bytes
+        self.connect_timeout = connect_timeout
+        self.budget = hourly_budget_bytes
+        self.budget_updated = time.monotonic()
+
+    def due(self, last_result):
+        """A proxy is retested once its last result is older than the interval"""
+        return last_result is None or time.time() - last_result.measured_at >= self.interval
+
+    def try_reserve(self):
+        """Reserve one test's worth of bytes from the hourly budget, without waiting"""
+        now = time.monotonic()
+        refill = (now - self.budget_updated) * self.hourly_budget_bytes / 3600
+        self.budget = min(self.hourly_budget_bytes, self.budget + refill)
+        self.budget_updated = now
+        if self.budget < self.payload_bytes:
+            return False
+        self.budget -= self.payload_bytes
+        return True
+
+    def refund(self, unused_bytes):
+        self.budget = min(self.hourly_budget_bytes, self.budget + max(0, unused_bytes))
+
+    async def measure(self, proxy):
+        """Download the payload through proxy and return a SpeedTestResult"""
+        url = self.url.format(bytes=self.payload_bytes)[len('http://'):]
+        authority, _, path = url.partition('/')
+        host, _, port = authority.partition(':')
+        port = int(port or 80)
+
+        dialer = writer = None
+        received = 0
+        start = time.monotonic()
+        try:
+            dialer = make_dialer(proxy)
+            reader, writer = await asyncio.wait_for(dialer.open_connection(host, port),
+                                                    self.connect_timeout)
+            writer.write(f"GET /{path} HTTP/1.1\r\nHost: {authority}\r\n"
+                         f"Accept-Encoding: identity\r\nConnection: close\r\n\r\n".encode())
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.connect_timeout)
+            if head.split()[1] != b"200":
+                raise ConnectionError(f"Speed test endpoint returned {head[:32]!r}")
+
+            start = time.monotonic()
+            deadline = start + self.max_seconds
+            warmup_bytes = int(self.payload_bytes * self.warmup_fraction)
+            warm_at = warm_bytes = None
+            while received < self.payload_bytes:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    chunk = await asyncio.wait_for(reader.read(READ_SIZE), remaining)
+                except asyncio.TimeoutError:
+                    break
+                if not chunk:
+                    break
+                received += len(chunk)
+                if warm_at is None and received >= warmup_bytes:
+                    warm_at, warm_bytes = time.monotonic(), received
+
+            end = time.monotonic()
+            # Sustained rate excludes slow start; fall back to the whole run if it was short
+            if warm_at is not None and end - warm_at > 0.05 and received > warm_bytes:
+                rate = (received - warm_bytes) / (end - warm_at)
+            else:
+                rate = received / max(end - start, 1e-6)
+            return SpeedTestResult(round(rate * 8 / 1_000_000, 2), received, round(end - start, 3))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            return SpeedTestResult(None, received, round(time.monotonic() - start, 3),
+                                   str(e) or e.__class__.__name__)
+        finally:
+            if writer is not None:
+                close_writer(writer)
+            if hasattr(dialer, 'close'):
+                await dialer.close()
+            self.refund(self.payload_bytes - received)
+
+
+def format_speed(mbps):
+    """Human-readable speed for server listings"""
+    if mbps is None:
+        return 'Untested'
+    if mbps >= 100:
+        return f"{mbps:.0f} Mbps"
+    return f"{mbps:.1f} Mbps"
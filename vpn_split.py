@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+VPN Split Tunnel Module - Compiled domain/CIDR bypass rules
+Domain suffixes go into a label trie, CIDRs into a per-prefix-length table,
+and the same rules render to a PAC file, Windows ProxyOverride and no_proxy
+"""
+
+import fnmatch
+import ipaddress
+import re
+
+# Equivalent of the historical Windows ProxyOverride string
+DEFAULT_BYPASS_RULES = [
+    '<local>',
+    'localhost',
+    '127.0.0.0/8',
+    '10.0.0.0/8',
+    '172.16.0.0/12',
+    '192.168.0.0/16',
+    '::1/128',
+    'fe80::/10',
+]
+
+_TERMINAL = ''
+_WILDCARD = '*'
+
+
+class SplitTunnelRules:
+    """Compiled bypass matcher: hosts matching a rule go direct instead of through the VPN"""
+
+    def __init__(self, rules=None):
+        self.rules = []
+        self.bypass_plain_hostnames = False
+        self.trie = {}
+        self.wildcards = []
+        self.wildcard_regex = None
+        self.prefix_tables = {4: {}, 6: {}}
+        self.networks = []
+        for rule in (DEFAULT_BYPASS_RULES if rules is None else rules):
+            self.add(rule)
+        self._compile_wildcards()
+
+    def add(self, rule):
+        """Add one rule: 'example.com', '*.example.com', 'ads-*.net', '10.0.0.0/8' or '<local>'"""
+        rule = rule.strip().lower()
+        if not rule:
+            return
+        self.rules.append(rule)
+
+        if rule == '<local>':
+            self.bypass_plain_hostnames = True
+            return
+
+        try:
+            network = ipaddress.ip_network(rule, strict=False)
+        except ValueError:
+            network = None
+        if network is not None:
+            self.networks.append(network)
+            table = self.prefix_tables[network.version]
+            shift = network.max_prefixlen - network.prefixlen
+            table.setdefault(network.prefixlen, set()).add(int(network.network_address) >> shift)
+            return
+
+        if rule.startswith('*.') and '*' not in rule[2:]:
+            self._insert(rule[2:], _WILDCARD)
+        elif rule.startswith('.') and '*' not in rule:
+            self._insert(rule[1:], _WILDCARD)
+        elif '*' in rule or '?' in rule:
+            self.wildcards.append(rule)
+            self.wildcard_regex = None
+        else:
+            self._insert(rule, _TERMINAL)
+
+    def _insert(self, domain, marker):
+        node = self.trie
+        for label in reversed(domain.split('.')):
+            node = node.setdefault(label, {})
+        # _TERMINAL matches the domain and its subdomains, _WILDCARD only subdomains
+        if node.get(_TERMINAL) is not True:
+            node[marker] = True
+
+    def _compile_wildcards(self):
+        if self.wildcards:
+            self.wildcard_regex = re.compile(
+                '|'.join(f"(?:{fnmatch.translate(pattern)})" for pattern in self.wildcards))
+
+    def match_domain(self, host):
+        """Walk the label trie from the TLD down"""
+        node = self.trie
+        labels = host.split('.')
+        for depth, label in enumerate(reversed(labels), 1):
+            node = node.get(label)
+            if node is None:
+                break
+            if node.get(_TERMINAL):
+                return True
+            if node.get(_WILDCARD) and depth < len(labels):
+                return True
+
+        if self.wildcards:
+            if self.wildcard_regex is None:
+                self._compile_wildcards()
+            return self.wildcard_regex.match(host) is not None
+        return False
+
+    def match_ip(self, ip):
+        """Look the address up in the prefix table, one set probe per prefix length"""
+        table = self.prefix_tables[ip.version]
+        value = int(ip)
+        for prefixlen, prefixes in table.items():
+            if (value >> (ip.max_prefixlen - prefixlen)) in prefixes:
+                return True
+        return False
+
+    def should_bypass(self, host):
+        """True if connections to host should skip the VPN"""
+        host = host.strip('[]').rstrip('.').lower()
+        try:
+            ip = ipaddress.ip_address(host)
+        except ValueError:
+            ip = None
+        if ip is not None:
+            if ip.version == 6 and ip.ipv4_mapped:
+                ip = ip.ipv4_mapped
+            return self.match_ip(ip)
+
+        if self.bypass_plain_hostnames and '.' not in host:
+            return True
+        # Domain names are not resolved here; CIDR rules only apply to IP literals
+        return self.match_domain(host)
+
+    def domain_rules(self):
+        return [rule for rule in self.rules if rule != '<local>' and not self._is_network(rule)]
+
+    @staticmethod
+    def _is_network(rule):
+        try:
+            ipaddress.ip_network(rule, strict=False)
+            return True
+        except ValueError:
+            return False
+
+    def to_pac(self, proxy_host='127.0.0.1', proxy_port=9999):
+        """Render the rules as a proxy auto-config script"""
+        lines = ["function FindProxyForURL(url, host) {",
+                 "    host = host.toLowerCase();"]
+        if self.bypass_plain_hostnames:
+            lines.append('    if (isPlainHostName(host)) return "DIRECT";')
+
+        for rule in self.domain_rules():
+            if rule.startswith('*.') and '*' not in rule[2:]:
+                lines.append(f'    if (dnsDomainIs(host, "{rule[1:]}")) return "DIRECT";')
+            elif rule.startswith('.') and '*' not in rule:
+                lines.append(f'    if (dnsDomainIs(host, "{rule}")) return "DIRECT";')
+            elif '*' in rule or '?' in rule:
+                lines.append(f'    if (shExpMatch(host, "{rule}")) return "DIRECT";')
+            else:
+                lines.append(f'    if (host == "{rule}" || dnsDomainIs(host, ".{rule}")) '
+                             'return "DIRECT";')
+
+        ipv4 = [net for net in self.networks if net.version == 4]
+        if ipv4:
+            # Only match IP-literal hosts so the browser never blocks on a DNS lookup here
+            lines.append('    if (/^\\d+\\.\\d+\\.\\d+\\.\\d+$/.test(host)) {')
+            for net in ipv4:
+                lines.append(f'        if (isInNet(host, "{net.network_address}", '
+                             f'"{net.netmask}")) return "DIRECT";')
+            lines.append('    }')
+
+        lines.append(f'    return "PROXY {proxy_host}:{proxy_port}";')
+        lines.append("}")
+        return "\n".join(lines) + "\n"
+
+    def to_windows_override(self):
+        """Render the rules as a Windows ProxyOverride string"""
+        entries = []
+        if self.bypass_plain_hostnames:
+            entries.append('<local>')
+        for rule in self.domain_rules():
+            if rule.startswith('.'):
+                entries.append('*' + rule)
+            elif rule.startswith('*'):
+                entries.append(rule)
+            elif '*' in rule or '?' in rule:
+                entries.append(rule)
+            else:
+                entries += [rule, '*.' + rule]
+        for net in self.networks:
+            if net.version == 4:
+                entries += ipv4_wildcards(net)
+            elif net.prefixlen == 128:
+                entries.append(f"[{net.network_address}]")
+        return ';'.join(entries)
+
+    def to_no_proxy(self):
+        """Render the rules as a no_proxy environment value"""
+        entries = []
+        for rule in self.domain_rules():
+            if rule.startswith('*.'):
+                entries.append(rule[1:])
+            elif '*' not in rule and '?' not in rule:
+                entries.append(rule)
+        entries += [str(net) for net in self.networks]
+        return ','.join(entries)
+
+
+def ipv4_wildcards(network, limit=64):
+    """Express an IPv4 network as octet wildcards ('10.*', '172.16.*', ...)"""
+    octets = (network.prefixlen + 7) // 8
+    if octets == 0:
+        return ['*']
+    step = 1 << (32 - octets * 8)
+    count = max(1, network.num_addresses // step)
+    if count > limit:
+        count = limit
+    base = int(network.network_address)
+    patterns = []
+    for index in range(count):
+        parts = str(ipaddress.IPv4Address(base + index * step)).split('.')[:octets]
+        patterns.append('.'.join(parts) + ('.*' if octets < 4 else ''))
+    return patterns
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+VPN Timer Module - Hashed timing wheel for relay connection timeouts
+One ticking callback serves every connection's connect, handshake, idle and lifetime
+timeout: arming, cancelling and refreshing a timer are O(1), and activity only bumps a
+deadline that is checked lazily when its slot comes round, so expiries are reaped in bulk
+"""
+
+import asyncio
+import contextvars
+import math
+
+# Timeout timer of the relay connection being served by the current task, if any
+current_timer = contextvars.ContextVar('vpn_current_timer', default=None)
+
+
+def touch():
+    """Push back the current connection's timeout after activity"""
+    timer = current_timer.get()
+    if timer is not None:
+        timer.refresh()
+
+
+class ConnectionTimeouts:
+    """Per-phase timeouts in seconds for relayed connections; None disables a phase"""
+
+    def __init__(self, handshake=15, connect=10, idle=300, lifetime=None):
+        self.handshake = handshake
+        self.connect = connect
+        self.idle = idle
+        self.lifetime = lifetime
+
+    def to_dict(self):
+        return {
+            'handshake': self.handshake,
+            'connect': self.connect,
+            'idle': self.idle,
+            'lifetime': self.lifetime,
+        }
+
+
+class Timer:
+    """One timeout on a TimingWheel"""
+
+    __slots__ = ('wheel', 'timeout', 'deadline', 'callback', 'phase', 'tick', 'active')
+
+    def __init__(self, wheel, timeout, callback, phase):
+        self.wheel = wheel
+        self.timeout = timeout
+        self.callback = callback
+        self.phase = phase
+        self.deadline = 0.0
+        self.tick = 0
+        self.active = False
+
+    def refresh(self):
+        """Restart the current timeout from now; O(1), the slot is fixed up lazily"""
+        if self.active:
+            self.deadline = self.wheel.now + self.timeout
+
+    def reset(self, timeout, phase=None):
+        """Switch to a new timeout (and phase); None stops the timer"""
+        if phase is not None:
+            self.phase = phase
+        if timeout is None:
+            self.cancel()
+            return
+        self.timeout = timeout
+        self.deadline = self.wheel.clock() + timeout
+        # A later deadline is handled lazily; an earlier one needs an earlier slot
+        if not self.active or self.wheel.tick_for(self.deadline) < self.tick:
+            self.wheel.schedule(self)
+
+    def cancel(self):
+        if self.active:
+            self.wheel.unschedule(self)
+
+
+class TimingWheel:
+    """Hashed timing wheel driven by a single loop callback per tick"""
+
+    def __init__(self, tick=1.0, slots=512):
+        self.tick_seconds = tick
+        self.slots = [set() for _ in range(slots)]
+        self.loop = None
+        self.origin = 0.0
+        self.now = 0.0
+        self.current = 0
+        self.count = 0
+        self.handle = None
+        self.expired = {}
+
+    def clock(self):
+        self.now = self.loop.time()
+        return self.now
+
+    def start(self, loop=None):
+        self.loop = loop or asyncio.get_running_loop()
+        self.origin = self.clock()
+        self.current = 0
+        return self
+
+    def stop(self):
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+
+    def tick_for(self, deadline):
+        return max(self.current + 1, math.ceil((deadline - self.origin) / self.tick_seconds))
+
+    def arm(self, timeout, callback, phase=None):
+        """New timer calling callback() once timeout seconds pass without a refresh"""
+        timer = Timer(self, timeout, callback, phase)
+        timer.reset(timeout)
+        return timer
+
+    def schedule(self, timer):
+        if timer.active:
+            self.slots[timer.tick % len(self.slots)].discard(timer)
+        else:
+            timer.active = True
+            self.count += 1
+        timer.tick = self.tick_for(timer.deadline)
+        self.slots[timer.tick % len(self.slots)].add(timer)
+        if self.handle is None:
+            self.handle = self.loop.call_at(self.origin + (self.current + 1) * self.tick_seconds,
+                                            self.advance)
+
+    def unschedule(self, timer):
+        self.slots[timer.tick % len(self.slots)].discard(timer)
+        timer.active = False
+        self.count -= 1
+
+    def advance(self):
+        """Process every tick that is due, then expire the collected timers together"""
+        self.handle = None
+        now = self.clock()
+        due = []
+        while self.origin + (self.current + 1) * self.tick_seconds <= now:
+            self.current += 1
+            slot = self.slots[self.current % len(self.slots)]
+            for timer in list(slot):
+                if timer.tick > self.current:
+                    continue  # Belongs to a later lap of the wheel
+                if timer.deadline > now:
+                    self.schedule(timer)  # Refreshed since it was placed
+                else:
+                    self.unschedule(timer)
+                    due.append(timer)
+
+        for timer in due:
+            self.expired[timer.phase] = self.expired.get(timer.phase, 0) + 1
+            try:
+                timer.callback()
+            except Exception:
+                pass
+
+        if self.count and self.handle is None:
+            self.handle = self.loop.call_at(self.origin + (self.current + 1) * self.tick_seconds,
+                                            self.advance)
+
+    def get_stats(self):
+        return {
+            'timers': self.count,
+            'tick_seconds': self.tick_seconds,
+            'slots': len(self.slots),
+            'expired': dict(self.expired),
+        }
+
+
+def benchmark_timers(timers=50000):
+    """Per-operation cost and memory of wheel timers versus one loop timer per connection"""
+    import time
+    import tracemalloc
+
+    def noop():
+        pass
+
+    def measure(label, operation, items):
+        start = time.perf_counter()
+        for item in items:
+            operation(item)
+        results[label] = int((time.perf_counter() - start) / len(items) * 1e9)
+
+    def traced_kb(build):
+        tracemalloc.start()
+        built = build()
+        size = tracemalloc.get_traced_memory()[0] // 1024
+        tracemalloc.stop()
+        return built, size
+
+    results = {'timers': timers}
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        wheel = TimingWheel().start(loop)
+        armed = []
+        measure('wheel_arm_ns', lambda _: armed.append(wheel.arm(300, noop, 'idle')),
+                range(timers))
+        measure('wheel_refresh_ns', Timer.refresh, armed)
+        measure('wheel_cancel_ns', Timer.cancel, armed)
+        _, results['wheel_kb'] = traced_kb(lambda: [wheel.arm(300, noop) for _ in range(timers)])
+        wheel.stop()
+
+        # The alternative: a loop timer per connection, rescheduled on every refresh
+        handles = []
+        measure('call_later_arm_ns', lambda _: handles.append(loop.call_later(300, noop)),
+                range(timers))
+
+        def reschedule(i):
+            handles[i].cancel()
+            handles[i] = loop.call_later(300, noop)
+
+        measure('call_later_refresh_ns', reschedule, range(timers))
+        for handle in handles:
+            handle.cancel()
+        handles, results['call_later_kb'] = traced_kb(
+            lambda: [loop.call_later(300, noop) for _ in range(timers)])
+        for handle in handles:
+            handle.cancel()
+        return results
+
+    return asyncio.run(run())
+
+
+def benchmark_idle_connections(connections=50000, seconds=10):
+    """Hold idle client connections open on a LocalProxyServer; report CPU and memory cost"""
+    import socket
+    import time
+    from vpn_relay import LocalProxyServer, current_rss
+
+    requested = connections
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        # Each connection costs two descriptors here (client and accepted side)
+        connections = min(connections, (hard - 256) // 2)
+    except (ImportError, ValueError, OSError):
+        pass
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        timeouts = ConnectionTimeouts(handshake=seconds * 3)
+        proxy = await LocalProxyServer(port=0, timeouts=timeouts).start()
+        baseline = current_rss()
+
+        clients = []
+        for _ in range(connections):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            await loop.sock_connect(sock, ('127.0.0.1', proxy.port))
+            clients.append(sock)
+        while proxy.active_connections < connections:
+            await asyncio.sleep(0.1)
+        loaded = current_rss()
+
+        cpu_start, wall_start = time.process_time(), time.perf_counter()
+        await asyncio.sleep(seconds)
+        idle_cpu = time.process_time() - cpu_start
+        idle_wall = time.perf_counter() - wall_start
+
+        # Shorten the handshake timeout so everything is reaped in one sweep
+        reap_start = time.perf_counter()
+        for slot in proxy.wheel.slots:
+            for timer in list(slot):
+                timer.reset(0.5)
+        while proxy.active_connections:
+            await asyncio.sleep(0.05)
+        reap_seconds = time.perf_counter() - reap_start
+
+        for sock in clients:
+            sock.close()
+        stats = proxy.wheel.get_stats()
+        await proxy.stop()
+
+        mb = 1024 * 1024
+        return {
+            'requested': requested,
+            'connections': connections,
+            'rss_baseline_mb': round(baseline / mb, 1),
+            'rss_loaded_mb': round(loaded / mb, 1),
+            'rss_per_connection_kb': round((loaded - baseline) / connections / 1024, 2),
+            'idle_cpu_percent': round(idle_cpu / idle_wall * 100, 2),
+            'reap_all_seconds': round(reap_seconds, 3),
+            'expired': stats['expired'],
+        }
+
+    return asyncio.run(run())
+
+
+if __name__ == "__main__":
+    print("⏱️  Timing wheel benchmark")
+    print("=" * 40)
+    for key, value in benchmark_timers().items():
+        print(f"{key}: {value}")
+    print()
+    print("💤 Idle connection benchmark")
+    print("=" * 40)
+    for key, value in benchmark_idle_connections().items():
+        print(f"{key}: {value}")
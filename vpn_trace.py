@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+VPN Trace Module - Opt-in relay tracing and sampling profiler
+Relay stages (accept, dns, upstream_connect, handshake, first_byte, close) are recorded
+as Chrome trace events; the profiler samples every thread's stack into collapsed-stack
+text for flamegraph.pl / speedscope
+"""
+
+import contextvars
+import itertools
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+# Trace of the relay connection being served by the current task, if tracing is on
+current_trace = contextvars.ContextVar('vpn_current_trace', default=None)
+
+
+def now_us():
+    return time.perf_counter_ns() // 1000
+
+
+class _Span:
+    """Context manager recording one stage of a connection trace"""
+
+    def __init__(self, trace, name, args):
+        self.trace = trace
+        self.name = name
+        self.args = args
+        self.start = 0
+
+    def __enter__(self):
+        self.start = now_us()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        args = dict(self.args)
+        if exc is not None:
+            args['error'] = repr(exc)
+        self.trace.add(self.name, self.start, now_us() - self.start, args)
+        return False
+
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NO_SPAN = _NoSpan()
+
+
+def span(name, **args):
+    """Time a stage of the current connection; a no-op when it is not being traced"""
+    trace = current_trace.get()
+    if trace is None:
+        return NO_SPAN
+    return _Span(trace, name, args)
+
+
+def mark(name, **args):
+    """Record an instant event on the current connection"""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.instant(name, args)
+
+
+class ConnectionTrace:
+    """Events for one relay connection, emitted on its own track"""
+
+    def __init__(self, tracer, conn_id, peer):
+        self.tracer = tracer
+        self.conn_id = conn_id
+        self.peer = peer
+        self.start = now_us()
+        self.target = None
+        self.first_byte_seen = False
+
+    def add(self, name, start, duration, args=None):
+        self.tracer.emit({'name': name, 'cat': 'relay', 'ph': 'X', 'ts': start, 'dur': duration,
+                          'pid': self.tracer.pid, 'tid': self.conn_id, 'args': args or {}})
+
+    def instant(self, name, args=None):
+        self.tracer.emit({'name': name, 'cat': 'relay', 'ph': 'i', 's': 't', 'ts': now_us(),
+                          'pid': self.tracer.pid, 'tid': self.conn_id, 'args': args or {}})
+
+    def first_byte(self):
+        if not self.first_byte_seen:
+            self.first_byte_seen = True
+            self.add('first_byte', self.start, now_us() - self.start, {'target': self.target})
+
+    def close(self, **args):
+        args.update(peer=self.peer, target=self.target)
+        self.add('connection', self.start, now_us() - self.start, args)
+        self.instant('close')
+
+
+class Tracer:
+    """Bounded in-memory buffer of trace events"""
+
+    def __init__(self, enabled=False, max_events=20000):
+        self.enabled = enabled
+        self.events = deque(maxlen=max_events)
+        self.pid = os.getpid()
+        self.ids = itertools.count(1)
+
+    def begin(self, peer):
+        """Start tracing a connection; returns None while tracing is off"""
+        if not self.enabled:
+            return None
+        return ConnectionTrace(self, next(self.ids), peer)
+
+    def emit(self, event):
+        self.events.append(event)
+
+    def clear(self):
+        self.events.clear()
+
+    def export(self):
+        """Trace in Chrome trace-event JSON format (chrome://tracing, Perfetto)"""
+        return {'traceEvents': list(self.events), 'displayTimeUnit': 'ms'}
+
+
+def frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def sample_profile(seconds=10, interval=0.005):
+    """Sample every thread's Python stack and return collapsed-stack text"""
+    own_id = threading.get_ident()
+    names = {}
+    stacks = Counter()
+    deadline = time.monotonic() + seconds
+
+    while time.monotonic() < deadline:
+        names.update((thread.ident, thread.name) for thread in threading.enumerate())
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(frame_label(frame))
+                frame = frame.f_back
+            labels.append(names.get(thread_id, f"thread-{thread_id}"))
+            stacks[';'.join(reversed(labels))] += 1
+        time.sleep(interval)
+
+    return ''.join(f"{stack} {count}\n" for stack, count in stacks.most_common())
@@ -0,0 +1,685 @@
+#!/usr/bin/env python3
+"""
+VPN Tunnel Module - Multiplexed client <-> exit-node tunnel between FREE-VPN instances
+Carries many logical streams over one long-lived TCP connection with per-stream
+flow control and optional ChaCha20-Poly1305 encryption (requires `cryptography`)
+"""
+
+import asyncio
+import hashlib
+import hmac
+import ipaddress
+import os
+import socket
+import struct
+
+from vpn_relay import (STREAM_LIMIT, DirectDialer, close_writer, decode_socks_address,
+                       encode_socks_address, log_event, pipe, split_host_port)
+from vpn_trace import span
+
+try:
+    from cryptography.hazmat.primitives.ciphers.aead import ChaCha20Poly1305
+    CRYPTO_AVAILABLE = True
+except ImportError:
+    CRYPTO_AVAILABLE = False
+
+MAGIC = b"FVPN"
+VERSION = 1
+FLAG_ENCRYPTED = 0x01
+
+# Frame types
+FRAME_OPEN = 1
+FRAME_OPEN_OK = 2
+FRAME_OPEN_FAIL = 3
+FRAME_DATA = 4
+FRAME_WINDOW = 5
+FRAME_CLOSE = 6
+FRAME_RESET = 7
+FRAME_PING = 8
+FRAME_PONG = 9
+# A stream of length-prefixed datagram records (SOCKS5 address + payload) for UDP
+FRAME_OPEN_UDP = 10
+
+# type, stream id, payload length
+FRAME_HEADER = struct.Struct("!BIH")
+DATAGRAM_HEADER = struct.Struct("!H")
+MAX_FRAME_PAYLOAD = 16 * 1024
+INITIAL_WINDOW = 256 * 1024
+OPEN_TIMEOUT = 15
+KEEPALIVE_INTERVAL = 30
+
+
+def hkdf_sha256(key, salt, info, length=32):
+    """HKDF (RFC 5869) with SHA-256"""
+    prk = hmac.new(salt, key, hashlib.sha256).digest()
+    output, block, counter = b"", b"", 1
+    while len(output) < length:
+        block = hmac.new(prk, block + info + bytes([counter]), hashlib.sha256).digest()
+        output += block
+        counter += 1
+    return output[:length]
+
+
+class FrameCodec:
+    """Frame (de)serialisation, optionally sealed with a per-direction AEAD key"""
+
+    def __init__(self, send_key=None, recv_key=None):
+        self.send_aead = ChaCha20Poly1305(send_key) if send_key else None
+        self.recv_aead = ChaCha20Poly1305(recv_key) if recv_key else None
+        self.send_counter = 0
+        self.recv_counter = 0
+
+    @staticmethod
+    def nonce(counter):
+        return b"\x00\x00\x00\x00" + counter.to_bytes(8, 'big')
+
+    def encode(self, frame_type, stream_id, payload=b""):
+        frame = FRAME_HEADER.pack(frame_type, stream_id, len(payload)) + payload
+        if self.send_aead is None:
+            return frame
+        sealed = self.send_aead.encrypt(self.nonce(self.send_counter), frame, None)
+        self.send_counter += 1
+        return struct.pack("!H", len(sealed)) + sealed
+
+    async def read_frame(self, reader):
+        """Read one frame and return (type, stream id, payload)"""
+        if self.recv_aead is None:
+            header = await reader.readexactly(FRAME_HEADER.size)
+            frame_type, stream_id, length = FRAME_HEADER.unpack(header)
+            payload = await reader.readexactly(length) if length else b""
+            return frame_type, stream_id, payload
+
+        (length,) = struct.unpack("!H", await reader.readexactly(2))
+        sealed = await reader.readexactly(length)
+        # Raises InvalidTag on a wrong key or tampered stream
+        frame = self.recv_aead.decrypt(self.nonce(self.recv_counter), sealed, None)
+        self.recv_counter += 1
+        frame_type, stream_id, size = FRAME_HEADER.unpack_from(frame)
+        return frame_type, stream_id, frame[FRAME_HEADER.size:FRAME_HEADER.size + size]
+
+
+async def handshake(reader, writer, key, is_client):
+    """Exchange hellos and build the frame codec for this connection"""
+    if key and not CRYPTO_AVAILABLE:
+        raise RuntimeError("Tunnel encryption requires: pip install cryptography")
+
+    flags = FLAG_ENCRYPTED if key else 0
+    local_nonce = os.urandom(16)
+    writer.write(MAGIC + bytes([VERSION, flags]) + local_nonce)
+    await writer.drain()
+
+    hello = await reader.readexactly(len(MAGIC) + 2 + 16)
+    if hello[:4] != MAGIC or hello[4] != VERSION:
+        raise ConnectionError("Peer is not a FREE-VPN tunnel endpoint")
+    if hello[5] != flags:
+        raise ConnectionError("Tunnel encryption settings do not match peer")
+    if not key:
+        return FrameCodec()
+
+    peer_nonce = hello[6:]
+    client_nonce, server_nonce = (local_nonce, peer_nonce) if is_client else (peer_nonce, local_nonce)
+    secret = key.encode() if isinstance(key, str) else key
+    salt = client_nonce + server_nonce
+    c2s = hkdf_sha256(secret, salt, b"free-vpn c2s")
+    s2c = hkdf_sha256(secret, salt, b"free-vpn s2c")
+    return FrameCodec(c2s, s2c) if is_client else FrameCodec(s2c, c2s)
+
+
+def encode_datagram(host, port, payload):
+    """One datagram record for a UDP stream"""
+    record = encode_socks_address(host, port) + payload
+    return DATAGRAM_HEADER.pack(len(record)) + record
+
+
+async def read_datagram(reader):
+    """Next (host, port, payload) record from a UDP stream"""
+    (size,) = DATAGRAM_HEADER.unpack(await reader.readexactly(DATAGRAM_HEADER.size))
+    record = await reader.readexactly(size)
+    host, port, offset = decode_socks_address(record)
+    return host, port, record[offset:]
+
+
+class MuxStreamReader:
+    """Receive side of a multiplexed stream, granting window as data is consumed"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffer = bytearray()
+        self.eof = False
+        self.error = None
+        self.waiter = None
+
+    def feed_data(self, data):
+        self.buffer.extend(data)
+        self._wake()
+
+    def feed_eof(self):
+        self.eof = True
+        self._wake()
+
+    def set_exception(self, exc):
+        self.error = exc
+        self._wake()
+
+    def _wake(self):
+        if self.waiter and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    async def _wait(self):
+        self.waiter = asyncio.get_running_loop().create_future()
+        try:
+            await self.waiter
+        finally:
+            self.waiter = None
+
+    def _consume(self, size):
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        self.stream.consumed(len(data))
+        return data
+
+    def at_eof(self):
+        return self.eof and not self.buffer
+
+    async def read(self, n=-1):
+        while not self.buffer and not self.eof and self.error is None:
+            await self._wait()
+        if self.buffer:
+            return self._consume(len(self.buffer) if n < 0 else n)
+        if self.error is not None:
+            raise self.error
+        return b""
+
+    # Both consume as data arrives rather than once it is all buffered: the peer only
+    # sends a window's worth before waiting for credit, which consuming returns
+
+    async def readexactly(self, n):
+        collected = bytearray()
+        while True:
+            collected += self._consume(min(n - len(collected), len(self.buffer)))
+            if len(collected) == n:
+                return bytes(collected)
+            if self.error is not None:
+                raise self.error
+            if self.eof:
+                raise asyncio.IncompleteReadError(bytes(collected), n)
+            await self._wait()
+
+    async def readuntil(self, separator=b"\n"):
+        collected = bytearray()
+        while True:
+            index = self.buffer.find(separator)
+            if index >= 0:
+                collected += self._consume(index + len(separator))
+                return bytes(collected)
+            # Keep a possible partial separator buffered so it can complete
+            if len(self.buffer) >= len(separator):
+                collected += self._consume(len(self.buffer) - len(separator) + 1)
+            if len(collected) > STREAM_LIMIT:
+                raise asyncio.LimitOverrunError("Separator not found within the limit",
+                                                len(collected))
+            if self.error is not None:
+                raise self.error
+            if self.eof:
+                raise asyncio.IncompleteReadError(bytes(collected + self.buffer), None)
+            await self._wait()
+
+
+class MuxStreamWriter:
+    """Send side of a multiplexed stream, bounded by the peer's flow-control window"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.pending = bytearray()
+        self.closing = False
+        self.eof_sent = False
+        self.window_open = asyncio.Event()
+
+    def write(self, data):
+        if self.closing:
+            raise ConnectionResetError("Tunnel stream is closed")
+        self.pending.extend(data)
+        self.flush()
+
+    def flush(self):
+        """Send as much pending data as the window allows"""
+        stream = self.stream
+        while self.pending and stream.send_window > 0:
+            size = min(len(self.pending), stream.send_window, MAX_FRAME_PAYLOAD)
+            stream.mux.send_frame(FRAME_DATA, stream.stream_id, bytes(self.pending[:size]))
+            del self.pending[:size]
+            stream.send_window -= size
+        if self.pending:
+            self.window_open.clear()
+        else:
+            self.window_open.set()
+
+    async def drain(self):
+        while self.pending:
+            if self.closing:
+                raise ConnectionResetError("Tunnel stream is closed")
+            await self.window_open.wait()
+        await self.stream.mux.drain()
+
+    def can_write_eof(self):
+        return True
+
+    def write_eof(self):
+        if not self.eof_sent and not self.closing:
+            # Pending data is flushed by drain() before pipe() half-closes
+            self.eof_sent = True
+            self.stream.mux.send_frame(FRAME_CLOSE, self.stream.stream_id)
+            self.stream.maybe_finished()
+
+    def close(self):
+        if not self.closing:
+            self.stream.reset()
+
+    def is_closing(self):
+        return self.closing
+
+    async def wait_closed(self):
+        return None
+
+    def get_extra_info(self, name, default=None):
+        if name == 'peername':
+            return self.stream.target
+        return self.stream.mux.writer.get_extra_info(name, default)
+
+
+class MuxStream:
+    """One logical stream inside a multiplexed tunnel connection"""
+
+    def __init__(self, mux, stream_id, target=None):
+        self.mux = mux
+        self.stream_id = stream_id
+        self.target = target
+        self.send_window = INITIAL_WINDOW
+        # Bytes the peer may still send before our next window grant
+        self.recv_window = INITIAL_WINDOW
+        self.unacked = 0
+        self.remote_closed = False
+        self.reader = MuxStreamReader(self)
+        self.writer = MuxStreamWriter(self)
+        self.opened = asyncio.get_running_loop().create_future()
+        # Failures are reported to open_stream(); don't warn when nobody is waiting
+        self.opened.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+    def consumed(self, size):
+        """Return window to the peer once half of it has been read locally"""
+        self.unacked += size
+        if self.writer.closing or self.mux.closed:
+            return
+        if self.unacked >= INITIAL_WINDOW // 2:
+            self.mux.send_frame(FRAME_WINDOW, self.stream_id, struct.pack("!I", self.unacked))
+            self.recv_window += self.unacked
+            self.unacked = 0
+
+    def grant(self, increment):
+        self.send_window += increment
+        self.writer.flush()
+
+    def remote_eof(self):
+        self.remote_closed = True
+        self.reader.feed_eof()
+        self.maybe_finished()
+
+    def maybe_finished(self):
+        if self.remote_closed and self.writer.eof_sent:
+            self.mux.discard(self)
+
+    def abort(self, exc):
+        """Tear the stream down locally without notifying the peer"""
+        self.writer.closing = True
+        self.writer.window_open.set()
+        self.reader.set_exception(exc)
+        if not self.opened.done():
+            self.opened.set_exception(exc)
+        self.mux.discard(self)
+
+    def reset(self):
+        """Abort the stream and tell the peer to do the same"""
+        if self.stream_id in self.mux.streams:
+            self.mux.send_frame(FRAME_RESET, self.stream_id)
+        self.abort(ConnectionResetError("Tunnel stream reset"))
+
+
+class MuxConnection:
+    """Frame dispatcher for one tunnel TCP connection"""
+
+    def __init__(self, reader, writer, codec, open_handler=None, udp_handler=None,
+                 memory_budget=None):
+        self.reader = reader
+        self.writer = writer
+        self.codec = codec
+        self.open_handler = open_handler
+        self.udp_handler = udp_handler
+        # Each open stream reserves its receive window, the most it can buffer unread
+        self.memory_budget = memory_budget
+        self.streams = {}
+        self.next_stream_id = 1
+        self.closed = False
+        self.last_pong = asyncio.get_running_loop().time()
+
+    def send_frame(self, frame_type, stream_id, payload=b""):
+        if self.closed:
+            raise ConnectionResetError("Tunnel connection is closed")
+        # Encoding and writing happen without yielding so AEAD counters stay in order
+        self.writer.write(self.codec.encode(frame_type, stream_id, payload))
+
+    async def drain(self):
+        await self.writer.drain()
+
+    async def open_stream(self, host, port):
+        """Open a new logical stream to host:port through the exit node"""
+        return await self._open(FRAME_OPEN, (host, port), f"{host}:{port}".encode())
+
+    async def open_udp(self):
+        """Open a stream of datagram records relayed as UDP by the exit node"""
+        return await self._open(FRAME_OPEN_UDP, ('udp', 0), b"")
+
+    async def _open(self, frame_type, target, payload):
+        stream = MuxStream(self, self.next_stream_id, target)
+        self.next_stream_id += 1
+        if not self.register(stream):
+            raise ConnectionError("Relay memory budget exhausted; tunnel stream not opened")
+        self.send_frame(frame_type, stream.stream_id, payload)
+        try:
+            await asyncio.wait_for(asyncio.shield(stream.opened), OPEN_TIMEOUT)
+        except asyncio.TimeoutError:
+            stream.reset()
+            raise ConnectionError(f"Tunnel open to {target[0]}:{target[1]} timed out")
+        return stream.reader, stream.writer
+
+    async def run(self):
+        """Dispatch incoming frames until the connection drops"""
+        error = ConnectionResetError("Tunnel connection lost")
+        try:
+            while True:
+                frame_type, stream_id, payload = await self.codec.read_frame(self.reader)
+                self.dispatch(frame_type, stream_id, payload)
+        except (asyncio.IncompleteReadError, ConnectionError, OSError):
+            pass
+        except Exception as e:
+            log_event(f"Tunnel protocol error: {e}", 'ERROR')
+            error = ConnectionResetError(f"Tunnel protocol error: {e}")
+        finally:
+            self.close(error)
+
+    def dispatch(self, frame_type, stream_id, payload):
+        stream = self.streams.get(stream_id)
+
+        if frame_type == FRAME_DATA and stream:
+            if len(payload) > stream.recv_window:
+                # A peer ignoring flow control could otherwise grow our buffers without bound
+                log_event(f"Tunnel stream {stream_id} overran its window; resetting", 'WARNING')
+                stream.reset()
+                return
+            stream.recv_window -= len(payload)
+            stream.reader.feed_data(payload)
+        elif frame_type == FRAME_WINDOW and stream:
+            stream.grant(struct.unpack("!I", payload)[0])
+        elif frame_type == FRAME_CLOSE and stream:
+            stream.remote_eof()
+        elif frame_type == FRAME_RESET and stream:
+            stream.abort(ConnectionResetError("Tunnel stream reset by peer"))
+        elif frame_type == FRAME_OPEN_OK and stream and not stream.opened.done():
+            stream.opened.set_result(True)
+        elif frame_type == FRAME_OPEN_FAIL and stream:
+            stream.abort(ConnectionError(payload.decode(errors='replace') or "Open failed"))
+        elif frame_type == FRAME_OPEN and self.open_handler and stream_id not in self.streams:
+            host, port = split_host_port(payload.decode(), 443)
+            stream = MuxStream(self, stream_id, (host, port))
+            stream.opened.set_result(True)
+            if not self.register(stream):
+                self.send_frame(FRAME_OPEN_FAIL, stream_id, b"Memory budget exhausted")
+                return
+            asyncio.ensure_future(self.open_handler(stream, host, port))
+        elif frame_type == FRAME_OPEN_UDP and self.udp_handler and stream_id not in self.streams:
+            stream = MuxStream(self, stream_id, ('udp', 0))
+            stream.opened.set_result(True)
+            if not self.register(stream):
+                self.send_frame(FRAME_OPEN_FAIL, stream_id, b"Memory budget exhausted")
+                return
+            asyncio.ensure_future(self.udp_handler(stream))
+        elif frame_type == FRAME_PING:
+            self.send_frame(FRAME_PONG, 0, payload)
+        elif frame_type == FRAME_PONG:
+            self.last_pong = asyncio.get_running_loop().time()
+
+    def register(self, stream):
+        """Track a new stream, reserving its window from the memory budget if there is one"""
+        if self.memory_budget is not None and not self.memory_budget.try_reserve(INITIAL_WINDOW):
+            return False
+        self.streams[stream.stream_id] = stream
+        return True
+
+    def discard(self, stream):
+        if self.streams.pop(stream.stream_id, None) is None:
+            return
+        if self.memory_budget is not None:
+            self.memory_budget.release(INITIAL_WINDOW)
+
+    def close(self, exc=None):
+        if self.closed:
+            return
+        self.closed = True
+        for stream in list(self.streams.values()):
+            stream.abort(exc or ConnectionResetError("Tunnel connection closed"))
+        close_writer(self.writer)
+
+
+class TunnelClient:
+    """Client end of the tunnel; usable anywhere a relay dialer is expected"""
+
+    def __init__(self, host, port, key=None, connect_timeout=10, memory_budget=None):
+        self.host = host
+        self.port = port
+        self.key = key
+        self.connect_timeout = connect_timeout
+        # Set by the local proxy so tunnel streams count against its budget
+        self.memory_budget = memory_budget
+        self.mux = None
+        self._connecting = None
+
+    async def connect(self):
+        """Return the live mux connection, dialing the exit node if needed"""
+        if self.mux and not self.mux.closed:
+            return self.mux
+        if self._connecting is None:
+            self._connecting = asyncio.ensure_future(self._dial())
+        try:
+            return await asyncio.shield(self._connecting)
+        finally:
+            if self._connecting is not None and self._connecting.done():
+                self._connecting = None
+
+    async def _dial(self):
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), self.connect_timeout)
+        try:
+            codec = await asyncio.wait_for(handshake(reader, writer, self.key, True),
+                                           self.connect_timeout)
+        except (Exception, asyncio.CancelledError):
+            close_writer(writer)
+            raise
+        self.mux = MuxConnection(reader, writer, codec, memory_budget=self.memory_budget)
+        asyncio.ensure_future(self.mux.run())
+        asyncio.ensure_future(self._keepalive(self.mux))
+        log_event(f"Tunnel established to exit node {self.host}:{self.port}"
+                  f"{' (encrypted)' if self.key else ''}")
+        return self.mux
+
+    async def _keepalive(self, mux):
+        while not mux.closed:
+            await asyncio.sleep(KEEPALIVE_INTERVAL)
+            if mux.closed:
+                break
+            loop = asyncio.get_running_loop()
+            if loop.time() - mux.last_pong > 3 * KEEPALIVE_INTERVAL:
+                log_event("Tunnel keepalive timed out", 'WARNING')
+                mux.close()
+                break
+            mux.send_frame(FRAME_PING, 0)
+
+    async def open_connection(self, host, port):
+        with span('upstream_connect', tunnel=f"{self.host}:{self.port}"):
+            mux = await self.connect()
+        with span('handshake', kind='mux-open'):
+            return await mux.open_stream(host, port)
+
+    async def open_udp(self):
+        """(reader, writer) of a datagram-record stream; see encode_datagram/read_datagram"""
+        mux = await self.connect()
+        return await mux.open_udp()
+
+    async def close(self):
+        if self._connecting is not None:
+            # Abandon a dial still in progress (e.g. a cancelled connect)
+            self._connecting.cancel()
+            self._connecting = None
+        if self.mux:
+            self.mux.close()
+            self.mux = None
+
+
+class TunnelExitNode:
+    """Exit-node end of the tunnel: accepts mux connections and dials destinations"""
+
+    def __init__(self, host='0.0.0.0', port=8443, key=None, dialer=None, allow_private=False):
+        self.host = host
+        self.port = port
+        self.key = key
+        self.dialer = dialer or DirectDialer()
+        # Off by default so clients cannot reach the exit node's own machine or LAN
+        self.allow_private = allow_private
+        self.server = None
+        self.connections = set()
+
+    async def start(self):
+        if self.key and not CRYPTO_AVAILABLE:
+            raise RuntimeError("Tunnel encryption requires: pip install cryptography")
+        if not self.key and self.host not in ('127.0.0.1', 'localhost', '::1'):
+            raise RuntimeError(f"Refusing to run an open relay on {self.host}: set a tunnel key "
+                               f"or listen on 127.0.0.1")
+        self.server = await asyncio.start_server(self.handle_peer, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        log_event(f"Tunnel exit node listening on {self.host}:{self.port}"
+                  f"{' (encrypted)' if self.key else ''}")
+        return self
+
+    async def stop(self):
+        server, self.server = self.server, None
+        if server:
+            server.close()
+        # Before wait_closed(), which from Python 3.12 waits for every peer connection
+        for mux in list(self.connections):
+            mux.close()
+        if server:
+            await server.wait_closed()
+
+    async def public_address(self, host, port):
+        """host resolved to an address, refusing loopback, link-local and private ones"""
+        try:
+            addresses = [str(ipaddress.ip_address(host))]
+        except ValueError:
+            infos = await asyncio.get_running_loop().getaddrinfo(host, port,
+                                                                 type=socket.SOCK_STREAM)
+            addresses = [info[4][0] for info in infos]
+        for address in addresses:
+            if not ipaddress.ip_address(address.split('%')[0]).is_global:
+                raise ConnectionRefusedError(f"Destination {host} ({address}) is not public")
+        # Dial the checked address so a second lookup cannot rebind the name
+        return addresses[0]
+
+    async def handle_peer(self, reader, writer):
+        try:
+            codec = await asyncio.wait_for(handshake(reader, writer, self.key, False), 10)
+        except Exception as e:
+            log_event(f"Tunnel handshake failed: {e}", 'WARNING')
+            close_writer(writer)
+            return
+
+        mux = MuxConnection(reader, writer, codec, open_handler=self.open_stream,
+                            udp_handler=self.open_udp)
+        self.connections.add(mux)
+        try:
+            await mux.run()
+        finally:
+            self.connections.discard(mux)
+
+    async def open_stream(self, stream, host, port):
+        """Dial the destination for a stream opened by the client"""
+        try:
+            if not self.allow_private:
+                host = await self.public_address(host, port)
+            upstream_reader, upstream_writer = await self.dialer.open_connection(host, port)
+        except Exception as e:
+            if not stream.mux.closed:
+                stream.mux.send_frame(FRAME_OPEN_FAIL, stream.stream_id, str(e).encode()[:512])
+            stream.abort(ConnectionError(str(e)))
+            return
+
+        try:
+            stream.mux.send_frame(FRAME_OPEN_OK, stream.stream_id)
+            await asyncio.gather(pipe(stream.reader, upstream_writer),
+                                 pipe(upstream_reader, stream.writer))
+        except ConnectionError:
+            pass
+        finally:
+            close_writer(upstream_writer)
+            if stream.stream_id in stream.mux.streams and not stream.mux.closed:
+                stream.reset()
+
+    async def open_udp(self, stream):
+        """Send a client's datagram records as UDP, returning replies from peers it sent to"""
+        from vpn_udp import DNS_CACHE_TTL, DatagramEndpoint
+
+        loop = asyncio.get_running_loop()
+        endpoints = {}
+        allowed = set()
+        resolved = {}
+
+        def on_replies(batch):
+            writer = stream.writer
+            for data, addr in batch:
+                # Address-restricted like the local relay; a backed-up stream drops like UDP
+                if addr[:2] in allowed and not writer.is_closing() and \
+                        len(writer.pending) < INITIAL_WINDOW:
+                    writer.write(encode_datagram(addr[0], addr[1], data))
+
+        def endpoint(family):
+            if family not in endpoints:
+                sock = socket.socket(family, socket.SOCK_DGRAM)
+                sock.bind(('::' if family == socket.AF_INET6 else '0.0.0.0', 0))
+                endpoints[family] = DatagramEndpoint(sock, on_replies)
+            return endpoints[family]
+
+        try:
+            stream.mux.send_frame(FRAME_OPEN_OK, stream.stream_id)
+            while True:
+                host, port, payload = await read_datagram(stream.reader)
+                entry = resolved.get(host)
+                if entry is None or entry[1] < loop.time():
+                    try:
+                        if self.allow_private:
+                            infos = await loop.getaddrinfo(host, port, type=socket.SOCK_DGRAM)
+                            address = infos[0][4][0]
+                        else:
+                            address = await self.public_address(host, port)
+                    except OSError:
+                        continue
+                    if len(resolved) >= 1024:
+                        resolved.clear()
+                    entry = resolved[host] = (address, loop.time() + DNS_CACHE_TTL)
+                address = entry[0]
+                allowed.add((address, port))
+                family = socket.AF_INET6 if ':' in address else socket.AF_INET
+                endpoint(family).send_batch([(payload, (address, port))])
+        except (asyncio.IncompleteReadError, ConnectionError, OSError, ValueError):
+            pass
+        finally:
+            for udp in endpoints.values():
+                udp.close()
+            if stream.stream_id in stream.mux.streams and not stream.mux.closed:
+                stream.reset()
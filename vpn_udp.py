@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+"""
+VPN UDP Module - SOCKS5 UDP ASSOCIATE relay for the local proxy listener
+Per-association NAT tables with idle expiry and batched datagram handling; datagrams
+follow the same route as TCP: direct when bypassed or unproxied, over the mux stream
+of a tunnel upstream, and never direct in place of an upstream that cannot carry UDP
+"""
+
+import asyncio
+import socket
+import time
+
+from vpn_relay import (SOCKS_ATYP_IPV4, SOCKS_ATYP_IPV6, DirectDialer, decode_socks_address,
+                       encode_socks_address, log_event)
+
+MAX_DATAGRAM = 65535
+BATCH_SIZE = 64
+NAT_IDLE_TIMEOUT = 30
+ASSOCIATION_IDLE_TIMEOUT = 120
+SWEEP_INTERVAL = 5
+DNS_CACHE_TTL = 60
+# Datagrams held per destination while its name resolves or its tunnel stream opens
+MAX_PENDING_DATAGRAMS = 64
+
+
+def carries_udp(dialer):
+    """Whether datagrams routed to dialer can be relayed: sent direct or tunnelled"""
+    return isinstance(dialer, DirectDialer) or hasattr(dialer, 'open_udp')
+
+
+class DatagramEndpoint:
+    """Non-blocking UDP socket drained in batches on each readiness event"""
+
+    def __init__(self, sock, handler, batch_size=BATCH_SIZE):
+        self.sock = sock
+        self.handler = handler
+        self.batch_size = batch_size
+        self.loop = asyncio.get_running_loop()
+        self.transport = None
+        self.dropped = 0
+        sock.setblocking(False)
+        try:
+            self.loop.add_reader(sock.fileno(), self._on_readable)
+        except NotImplementedError:
+            # Proactor loops (Windows) have no add_reader; take datagrams one at a time
+            self.loop.create_task(self._start_protocol())
+
+    async def _start_protocol(self):
+        endpoint = self
+
+        class Protocol(asyncio.DatagramProtocol):
+            def datagram_received(self, data, addr):
+                endpoint.handler([(data, addr)])
+
+        self.transport, _ = await self.loop.create_datagram_endpoint(Protocol, sock=self.sock)
+
+    def _on_readable(self):
+        batch = []
+        recvfrom = self.sock.recvfrom
+        for _ in range(self.batch_size):
+            try:
+                batch.append(recvfrom(MAX_DATAGRAM))
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                # ICMP errors surface here on some platforms; skip and keep draining
+                continue
+        if batch:
+            self.handler(batch)
+
+    def send_batch(self, datagrams):
+        """Send (data, addr) pairs, dropping on a full socket buffer like any UDP sender"""
+        if self.transport is not None:
+            for data, addr in datagrams:
+                self.transport.sendto(data, addr)
+            return
+        sendto = self.sock.sendto
+        for data, addr in datagrams:
+            try:
+                sendto(data, addr)
+            except (BlockingIOError, InterruptedError):
+                self.dropped += 1
+            except OSError:
+                self.dropped += 1
+
+    def sockname(self):
+        return self.sock.getsockname()
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+        else:
+            self.loop.remove_reader(self.sock.fileno())
+            self.sock.close()
+
+
+class TunnelDatagrams:
+    """An association's datagrams through one tunnel upstream, as records on a mux stream"""
+
+    def __init__(self, association, dialer):
+        self.association = association
+        self.dialer = dialer
+        self.writer = None
+        self.pending = []
+        self.task = asyncio.ensure_future(self.run())
+
+    def send(self, host, port, payload):
+        """Queue or write one datagram; False when it had to be dropped"""
+        from vpn_tunnel import INITIAL_WINDOW, encode_datagram
+
+        if self.writer is None:
+            if len(self.pending) >= MAX_PENDING_DATAGRAMS:
+                return False
+            self.pending.append(encode_datagram(host, port, payload))
+            return True
+        # A stream backed up past its window drops, as a congested UDP path would
+        if self.writer.is_closing() or len(self.writer.pending) >= INITIAL_WINDOW:
+            return False
+        self.writer.write(encode_datagram(host, port, payload))
+        return True
+
+    async def run(self):
+        from vpn_tunnel import read_datagram
+
+        try:
+            reader, self.writer = await self.dialer.open_udp()
+            for record in self.pending:
+                self.writer.write(record)
+            self.pending = []
+            while True:
+                host, port, payload = await read_datagram(reader)
+                self.association.deliver([(host, port, payload)])
+        except (asyncio.IncompleteReadError, ConnectionError, OSError, ValueError) as e:
+            if not self.association.closed:
+                log_event(f"UDP over tunnel ended: {e or e.__class__.__name__}", 'WARNING')
+        finally:
+            self.close()
+
+    def close(self):
+        if self.association.tunnels.get(self.dialer) is self:
+            del self.association.tunnels[self.dialer]
+        if self.writer is not None:
+            self.writer.close()
+        if not self.task.done() and self.task is not asyncio.current_task():
+            self.task.cancel()
+
+
+class UdpAssociation:
+    """One SOCKS5 UDP association: a client-facing socket and an outbound NAT socket"""
+
+    def __init__(self, relay, bind_host, client_host, route=None):
+        self.relay = relay
+        self.client_host = client_host
+        # Dialer a destination host goes through (e.g. LocalProxyServer.pick_dialer)
+        self.route = route
+        self.client_addr = None
+        self.nat = {}
+        self.dns_cache = {}
+        # Host -> [(port, payload)] waiting on the one lookup in flight for it
+        self.resolving = {}
+        self.tunnels = {}
+        self.last_activity = time.monotonic()
+        self.closed = False
+        self.packets_out = 0
+        self.packets_in = 0
+        self.dropped = 0
+        self.on_close = None
+
+        client_sock = socket.socket(socket.AF_INET6 if ':' in bind_host else socket.AF_INET,
+                                    socket.SOCK_DGRAM)
+        client_sock.bind((bind_host, 0))
+        self.client = DatagramEndpoint(client_sock, self.on_client_batch, relay.batch_size)
+        self.outbound = {}
+
+    def client_address(self):
+        return self.client.sockname()[:2]
+
+    def outbound_endpoint(self, family):
+        """Outbound socket per address family, created on first use"""
+        endpoint = self.outbound.get(family)
+        if endpoint is None:
+            sock = socket.socket(family, socket.SOCK_DGRAM)
+            sock.bind(('::' if family == socket.AF_INET6 else '0.0.0.0', 0))
+            endpoint = DatagramEndpoint(sock, self.on_remote_batch, self.relay.batch_size)
+            self.outbound[family] = endpoint
+        return endpoint
+
+    def on_client_batch(self, batch):
+        """Unwrap SOCKS headers and forward client datagrams to their destinations"""
+        now = time.monotonic()
+        pending = {}
+        for packet, addr in batch:
+            if addr[0] != self.client_host and self.client_host not in ('127.0.0.1', '::1'):
+                continue
+            if self.client_addr is None:
+                self.client_addr = addr
+            elif addr != self.client_addr:
+                continue
+            # RSV(2) FRAG(1); fragmentation is optional and not supported
+            if len(packet) < 4 or packet[2] != 0:
+                continue
+            try:
+                host, port, offset = decode_socks_address(packet, 3)
+            except (ValueError, IndexError):
+                continue
+
+            dialer = self.route(host) if self.route else None
+            if dialer is not None and not isinstance(dialer, DirectDialer):
+                if not (hasattr(dialer, 'open_udp') and self.send_tunnelled(dialer, host, port,
+                                                                            packet[offset:])):
+                    # Proxies cannot carry UDP; going direct instead would leak the real IP
+                    self.dropped += 1
+                continue
+
+            resolved = self.resolve_cached(packet[3], host, now)
+            if resolved is None:
+                self.queue_for_lookup(host, port, packet[offset:])
+                continue
+            family, ip = resolved
+            self.nat[(ip, port)] = now
+            pending.setdefault(family, []).append((packet[offset:], (ip, port)))
+
+        for family, datagrams in pending.items():
+            self.outbound_endpoint(family).send_batch(datagrams)
+            self.packets_out += len(datagrams)
+        self.last_activity = now
+
+    def resolve_cached(self, atyp, host, now):
+        if atyp == SOCKS_ATYP_IPV4:
+            return socket.AF_INET, host
+        if atyp == SOCKS_ATYP_IPV6:
+            return socket.AF_INET6, host
+        entry = self.dns_cache.get(host)
+        if entry and entry[2] > now:
+            return entry[0], entry[1]
+        return None
+
+    def send_tunnelled(self, dialer, host, port, payload):
+        tunnel = self.tunnels.get(dialer)
+        if tunnel is None:
+            tunnel = self.tunnels[dialer] = TunnelDatagrams(self, dialer)
+        if not tunnel.send(host, port, payload):
+            return False
+        self.packets_out += 1
+        return True
+
+    def queue_for_lookup(self, host, port, payload):
+        """Hold a datagram for a name being resolved, starting one lookup per host"""
+        waiting = self.resolving.get(host)
+        if waiting is None:
+            self.resolving[host] = [(port, payload)]
+            asyncio.ensure_future(self.resolve_and_send(host))
+        elif len(waiting) < MAX_PENDING_DATAGRAMS:
+            waiting.append((port, payload))
+        else:
+            self.dropped += 1
+
+    async def resolve_and_send(self, host):
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(
+                host, None, type=socket.SOCK_DGRAM)
+        except OSError:
+            infos = None
+        waiting = self.resolving.pop(host, [])
+        if self.closed or not infos:
+            self.dropped += len(waiting)
+            return
+        family, _, _, _, sockaddr = infos[0]
+        now = time.monotonic()
+        self.dns_cache[host] = (family, sockaddr[0], now + DNS_CACHE_TTL)
+        for port, _ in waiting:
+            self.nat[(sockaddr[0], port)] = now
+        self.outbound_endpoint(family).send_batch([(payload, (sockaddr[0], port))
+                                                   for port, payload in waiting])
+        self.packets_out += len(waiting)
+
+    def on_remote_batch(self, batch):
+        """Wrap replies from known destinations and return them to the client"""
+        now = time.monotonic()
+        replies = []
+        for data, addr in batch:
+            key = (addr[0], addr[1])
+            if key not in self.nat:
+                # Address-restricted NAT: only peers the client has sent to may reply
+                continue
+            self.nat[key] = now
+            replies.append((addr[0], addr[1], data))
+        self.deliver(replies)
+
+    def deliver(self, replies):
+        """Return (host, port, payload) replies to the client with SOCKS headers"""
+        if self.client_addr is None or not replies:
+            return
+        self.client.send_batch([(b"\x00\x00\x00" + encode_socks_address(host, port) + data,
+                                 self.client_addr) for host, port, data in replies])
+        self.packets_in += len(replies)
+        self.last_activity = time.monotonic()
+
+    def expire(self, now):
+        """Drop idle NAT entries; return True when the whole association is idle"""
+        stale = [key for key, seen in self.nat.items() if now - seen > self.relay.nat_idle_timeout]
+        for key in stale:
+            del self.nat[key]
+        return now - self.last_activity > self.relay.idle_timeout
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.client.close()
+        for endpoint in self.outbound.values():
+            endpoint.close()
+        for tunnel in list(self.tunnels.values()):
+            tunnel.close()
+        self.relay.associations.discard(self)
+        if self.on_close:
+            self.on_close()
+
+
+class UdpRelay:
+    """Owns all UDP associations and expires idle ones in a single sweep task"""
+
+    def __init__(self, nat_idle_timeout=NAT_IDLE_TIMEOUT, idle_timeout=ASSOCIATION_IDLE_TIMEOUT,
+                 batch_size=BATCH_SIZE):
+        self.nat_idle_timeout = nat_idle_timeout
+        self.idle_timeout = idle_timeout
+        self.batch_size = batch_size
+        self.associations = set()
+        self.sweeper = None
+
+    def associate(self, bind_host, client_host, route=None):
+        """Create a new association bound on the listener's address"""
+        association = UdpAssociation(self, bind_host, client_host, route)
+        self.associations.add(association)
+        if self.sweeper is None or self.sweeper.done():
+            self.sweeper = asyncio.ensure_future(self.sweep())
+        return association
+
+    async def sweep(self):
+        while self.associations:
+            await asyncio.sleep(SWEEP_INTERVAL)
+            now = time.monotonic()
+            for association in list(self.associations):
+                if association.expire(now):
+                    log_event(f"UDP association for {association.client_addr} expired (idle)")
+                    association.close()
+
+    def close(self):
+        for association in list(self.associations):
+            association.close()
+        if self.sweeper:
+            self.sweeper.cancel()
+            self.sweeper = None
+
+
+def benchmark_udp_relay(packets=200000, size=64, window=256):
+    """Measure relayed packet rate against a local UDP echo server"""
+    import socket as blocking_socket
+    from vpn_relay import BackgroundLoop, LocalProxyServer
+
+    loop = BackgroundLoop('udp-bench')
+
+    async def setup():
+        echo_sock = blocking_socket.socket(blocking_socket.AF_INET, blocking_socket.SOCK_DGRAM)
+        echo_sock.bind(('127.0.0.1', 0))
+        echo = None
+
+        def on_echo(batch):
+            echo.send_batch(batch)
+
+        echo = DatagramEndpoint(echo_sock, on_echo)
+        proxy = await LocalProxyServer(port=0).start()
+        return echo, proxy
+
+    echo, proxy = loop.run(setup())
+    echo_addr = echo.sockname()
+
+    control = blocking_socket.create_connection(('127.0.0.1', proxy.port))
+    control.sendall(b"\x05\x01\x00")
+    control.recv(2)
+    control.sendall(b"\x05\x03\x00" + encode_socks_address('0.0.0.0', 0))
+    reply = control.recv(262)
+    relay_host, relay_port, _ = decode_socks_address(reply, 3)
+
+    client = blocking_socket.socket(blocking_socket.AF_INET, blocking_socket.SOCK_DGRAM)
+    client.bind(('127.0.0.1', 0))
+    client.settimeout(2)
+    datagram = b"\x00\x00\x00" + encode_socks_address(*echo_addr) + b"x" * size
+
+    sent = received = lost = 0
+    start = time.perf_counter()
+    while received + lost < packets:
+        while sent < packets and sent - received - lost < window:
+            client.sendto(datagram, (relay_host, relay_port))
+            sent += 1
+        try:
+            client.recvfrom(MAX_DATAGRAM)
+            received += 1
+        except blocking_socket.timeout:
+            # Datagrams dropped under load are written off so the window refills
+            lost = sent - received
+    elapsed = time.perf_counter() - start
+
+    control.close()
+    client.close()
+    loop.loop.call_soon_threadsafe(echo.close)
+    loop.run(proxy.stop())
+    loop.stop()
+    return {
+        'packets': packets,
+        'payload_bytes': size,
+        'lost': lost,
+        'seconds': round(elapsed, 3),
+        'packets_per_second': int(received / elapsed),
+    }
+
+
+if __name__ == "__main__":
+    print("📦 UDP relay packet-rate benchmark")
+    print("=" * 40)
+    for key, value in benchmark_udp_relay().items():
+        print(f"{key}: {value}")